@@ -1,11 +1,296 @@
 from __future__ import annotations
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, TypeVar
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from functools import lru_cache
+import contextvars
 import json
+import logging
+import os
+import random
+import threading
+import time
 
-from backend.config.config import create_openai_client, MODEL_NAME
+import openai
+from pydantic import BaseModel
 
-# Create a single client instance
-_client = create_openai_client()
+from backend.config.config import (
+	create_openai_client, MODEL_NAME, ADAPTIVE_MAX_TOKENS, ADAPTIVE_MIN_SAMPLES,
+	CANDIDATE_GEN_MODE, CANDIDATE_FANOUT_DEADLINE_S, CANDIDATE_FANOUT_WORKERS,
+	FAST_MODEL_NAME, CASCADE_SITES,
+	LLM_RETRIES, LLM_RETRY_BASE_S, LLM_RETRY_MAX_WAIT_S, LLM_RETRY_POLICY, LLM_HEDGE_MIN_SAMPLES,
+	THINKING_BUDGETS, THINKING_DEFAULT_BUDGET, USAGE_STREAM_USAGE,
+)
+from backend.models.serialization import dumps, dumps_object, RawJSON
+from backend.services import trace_service, metrics_service, usage_service
+from backend.clients.llm_scheduler import llm_slot
+from backend.clients.prompts import (
+	estimate_tokens,
+	CANDIDATES_SYSTEM, CANDIDATES_MODE, CANDIDATES_USER, CANDIDATES_FANOUT_USER,
+	CANDIDATES_SLOT_SUFFIX, CANDIDATES_SCENARIO, CANDIDATES_STYLE_RULE, CANDIDATES_PERSONA,
+	MBTI_SYSTEM, MBTI_USER, SCENARIO_SYSTEM, SCENARIO_USER, THINKING_CUTOFF,
+)
+
+# 客户端延迟创建：导入本模块（如离线回放工具）不要求 Token，
+# 预fork部署时每个 worker 也各自持有自己的连接池
+_client = None
+_client_lock = threading.Lock()
+
+
+def _get_client():
+	global _client
+	if _client is None:
+		with _client_lock:
+			if _client is None:
+				_client = create_openai_client()
+	return _client
+
+
+def _reset_client() -> None:
+	global _client
+	_client = None
+
+
+os.register_at_fork(after_in_child=_reset_client)
+
+
+class _OutputLengthTracker:
+	"""
+	按调用点记录最近若干次输出长度（token 估算），据此给出自适应 max_tokens：
+	取近似 p95 再留出余量，并限制在 [floor, ceiling] 内。样本不足时使用 ceiling。
+	"""
+
+	def __init__(self, window: int = 64):
+		self._window = window
+		self._samples: Dict[str, deque] = {}
+		self._lock = threading.Lock()
+
+	def observe(self, call_site: str, tokens: int, truncated: bool = False, limit: int = 0) -> None:
+		# 被 max_tokens 截断的样本是“删失”的，按上限放大记录，避免预算越缩越小
+		if truncated and limit:
+			tokens = max(tokens, int(limit * 1.5))
+		with self._lock:
+			dq = self._samples.setdefault(call_site, deque(maxlen=self._window))
+			dq.append(int(tokens))
+
+	def max_tokens(self, call_site: str, ceiling: int, floor: int = 96) -> int:
+		if not ADAPTIVE_MAX_TOKENS:
+			return ceiling
+		with self._lock:
+			samples = sorted(self._samples.get(call_site) or ())
+		if len(samples) < ADAPTIVE_MIN_SAMPLES:
+			return ceiling
+		p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+		return max(floor, min(ceiling, int(p95 * 1.3) + 16))
+
+	def snapshot(self) -> Dict[str, Dict[str, int]]:
+		with self._lock:
+			items = {k: sorted(v) for k, v in self._samples.items()}
+		return {
+			k: {"samples": len(v), "p50": v[len(v) // 2] if v else 0, "max": v[-1] if v else 0}
+			for k, v in items.items()
+		}
+
+
+_length_tracker = _OutputLengthTracker()
+metrics_service.register_provider("output_lengths", lambda: _length_tracker.snapshot())
+
+
+def adaptive_max_tokens(call_site: str, ceiling: int, floor: int = 96) -> int:
+	return _length_tracker.max_tokens(call_site, ceiling, floor)
+
+
+def output_length_stats() -> Dict[str, Dict[str, int]]:
+	return _length_tracker.snapshot()
+
+
+class _RetryPolicy(NamedTuple):
+	retries: int
+	hedge: bool
+
+
+# 调用点默认策略：交互类少重试、对冲扇出槽位；后台类多给几次机会
+_RETRY_DEFAULTS: Dict[str, Dict[str, Any]] = {
+	"generate_peer_reply": {"retries": 1},
+	"generate_candidates": {"retries": 1},
+	"generate_candidates.slot": {"retries": 0, "hedge": True},
+	"infer_mbti_from_chat": {"retries": 3},
+	"analyze_scenario_llm": {"retries": 2},
+}
+
+
+def _load_retry_policies() -> Dict[str, _RetryPolicy]:
+	merged = {k: dict(v) for k, v in _RETRY_DEFAULTS.items()}
+	if LLM_RETRY_POLICY:
+		try:
+			for site, conf in json.loads(LLM_RETRY_POLICY).items():
+				merged.setdefault(site, {}).update(conf)
+		except Exception:
+			pass
+	return {
+		site: _RetryPolicy(int(conf.get("retries", LLM_RETRIES)), bool(conf.get("hedge", False)))
+		for site, conf in merged.items()
+	}
+
+
+_RETRY_POLICIES = _load_retry_policies()
+
+
+def _retry_policy(call_site: str) -> _RetryPolicy:
+	return _RETRY_POLICIES.get(call_site) or _RetryPolicy(LLM_RETRIES, False)
+
+
+def _is_retryable(e: BaseException) -> bool:
+	# 连接/超时、429、5xx 可重试；4xx 参数错误与调度器拒绝不重试
+	return isinstance(e, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError))
+
+
+def _retry_after(e: BaseException) -> Optional[float]:
+	response = getattr(e, "response", None)
+	headers = getattr(response, "headers", None)
+	if not headers:
+		return None
+	try:
+		if headers.get("retry-after-ms"):
+			return float(headers["retry-after-ms"]) / 1000
+		if headers.get("retry-after"):
+			return float(headers["retry-after"])
+	except (TypeError, ValueError):
+		return None
+	return None
+
+
+def _with_retries(call_site: str, fn: Callable[[], Any]) -> Any:
+	"""
+	按调用点策略重试：指数退避 + 全抖动；上游给出 Retry-After 时按其等待，
+	超过 LLM_RETRY_MAX_WAIT_S 则直接放弃，交给调用方兜底。
+	"""
+	retries = _retry_policy(call_site).retries
+	attempt = 0
+	while True:
+		try:
+			return fn()
+		except Exception as e:
+			metrics_service.incr(f"llm_errors:{call_site}:{type(e).__name__}")
+			if attempt >= retries or not _is_retryable(e):
+				raise
+			delay = _retry_after(e)
+			if delay is None:
+				delay = random.uniform(0, min(LLM_RETRY_MAX_WAIT_S, LLM_RETRY_BASE_S * (2 ** attempt)))
+			elif delay > LLM_RETRY_MAX_WAIT_S:
+				raise
+			attempt += 1
+			metrics_service.incr(f"llm_retries:{call_site}")
+			time.sleep(delay)
+
+
+_hedge_pool = ThreadPoolExecutor(max_workers=CANDIDATE_FANOUT_WORKERS, thread_name_prefix="llm-hedge")
+
+
+def _hedged(call_site: str, fn: Callable[[], Any]) -> Any:
+	"""
+	对冲请求：首个请求超过该调用点观测 p95 仍未返回时，再发一个相同请求，取先成功者。
+	样本不足时不对冲。落后的请求无法中止，在后台线程中自然结束，结果丢弃。
+	"""
+	key = f"llm_latency_ms:{call_site}"
+	if metrics_service.sample_count(key) < LLM_HEDGE_MIN_SAMPLES:
+		return fn()
+	delay_s = metrics_service.quantile(key, 0.95) / 1000
+	first = _hedge_pool.submit(contextvars.copy_context().run, fn)
+	done, _ = wait([first], timeout=delay_s)
+	if done:
+		return first.result()
+	metrics_service.incr(f"llm_hedges:{call_site}")
+	second = _hedge_pool.submit(contextvars.copy_context().run, fn)
+	pending = {first, second}
+	error: Optional[BaseException] = None
+	while pending:
+		done, pending = wait(pending, return_when=FIRST_COMPLETED)
+		for fut in done:
+			try:
+				result = fut.result()
+			except Exception as e:
+				error = error or e
+				continue
+			if fut is second:
+				metrics_service.incr(f"llm_hedge_wins:{call_site}")
+			return result
+	raise error  # type: ignore[misc]
+
+
+T = TypeVar("T")
+
+_cascade_log = logging.getLogger("soul.cascade")
+
+
+def cascade_model(key: str) -> Optional[str]:
+	"""该级联键配置了小模型时返回其名称，否则 None（直接用默认模型）。"""
+	if FAST_MODEL_NAME and FAST_MODEL_NAME != MODEL_NAME and key in CASCADE_SITES:
+		return FAST_MODEL_NAME
+	return None
+
+
+def cascade(key: str, attempt: Callable[[Optional[str]], T], validate: Callable[[T], bool]) -> T:
+	"""
+	模型级联：先用小模型调用 attempt(fast_model)，validate 通过即返回；
+	出错或校验失败再用默认模型 attempt(None)。两次尝试都记日志、追踪与指标，便于调参。
+	"""
+	fast = cascade_model(key)
+	if fast is None:
+		return attempt(None)
+	t0 = time.perf_counter()
+	try:
+		result = attempt(fast)
+		ok = bool(validate(result))
+		reason = "ok" if ok else "invalid"
+	except Exception as e:
+		ok = False
+		reason = type(e).__name__
+	_log_cascade(key, fast, ok, reason, (time.perf_counter() - t0) * 1000)
+	if ok:
+		metrics_service.incr(f"cascade_fast_ok:{key}")
+		return result
+	metrics_service.incr(f"cascade_escalated:{key}:{reason}")
+	t0 = time.perf_counter()
+	try:
+		result = attempt(None)
+	except Exception as e:
+		_log_cascade(key, MODEL_NAME, False, type(e).__name__, (time.perf_counter() - t0) * 1000)
+		raise
+	_log_cascade(key, MODEL_NAME, True, "escalated", (time.perf_counter() - t0) * 1000)
+	return result
+
+
+def _log_cascade(key: str, model: str, ok: bool, reason: str, elapsed_ms: float) -> None:
+	entry = {"key": key, "model": model, "ok": ok, "reason": reason, "ms": round(elapsed_ms, 2)}
+	_cascade_log.info(dumps(entry))
+	tr = trace_service.current()
+	if tr is not None:
+		tr.data.setdefault("cascade", []).append(entry)
+
+
+def _stream_usage_kwargs() -> Dict[str, Any]:
+	# 上游支持时在流末尾附带 usage（USAGE_STREAM_USAGE=1 开启）
+	return {"stream_options": {"include_usage": True}} if USAGE_STREAM_USAGE else {}
+
+
+def _load_thinking_budgets() -> Dict[str, int]:
+	budgets: Dict[str, int] = {}
+	if THINKING_BUDGETS:
+		try:
+			for k, v in json.loads(THINKING_BUDGETS).items():
+				budgets[k] = int(v)
+		except Exception:
+			pass
+	return budgets
+
+
+_THINKING_BUDGETS = _load_thinking_budgets()
+
+
+def thinking_budget(key: str) -> int:
+	"""该调用点（或 调用点.模式）配置的思考 token 预算；0 表示不开启思考。"""
+	return max(0, _THINKING_BUDGETS.get(key, 0))
 
 
 def chat_completion(
@@ -14,26 +299,138 @@ def chat_completion(
 	temperature: float = 0.6,
 	extra_body: Optional[Dict[str, Any]] = None,
 	use_stream: bool = False,
+	call_site: str = "default",
+	priority: Optional[str] = None,
+	model: Optional[str] = None,
+	thinking: int = 0,
+	on_reasoning: Optional[Callable[[str], None]] = None,
 ) -> str:
 	"""
 	Call ModelScope OpenAI-compatible chat completion and return content text.
 	- 注意：ModelScope 的 enable_thinking 仅支持 stream 模式。
+	- priority：调度优先级（interactive/standard/background），默认按调用点决定。
+	- model：覆盖默认模型（级联时传入小模型）。
+	- thinking：思考 token 预算，>0 时开启思考并走流式；use_stream=True 未给预算时用 THINKING_DEFAULT_BUDGET。
+	- on_reasoning：思考增量回调（仅思考模式），可用于向客户端推送思考进度。
+	- 当前用户/会话超出用量预算时改用小模型（无小模型时抛 BudgetExceeded）。
 	"""
+	model = usage_service.budget_model(call_site, model)
+	if use_stream and thinking <= 0 and (extra_body or {}).get("enable_thinking", True):
+		thinking = THINKING_DEFAULT_BUDGET
+	if thinking > 0:
+		return _thinking_completion(
+			messages, max_tokens, temperature, extra_body, call_site, priority, model, thinking, on_reasoning,
+		)
 	kwargs: Dict[str, Any] = dict(
-		model=MODEL_NAME,
+		model=model or MODEL_NAME,
 		messages=messages,
 		max_tokens=max_tokens,
 		temperature=temperature,
-	)
-	if use_stream:
-		kwargs["stream"] = True
-		kwargs["extra_body"] = extra_body or {"enable_thinking": True}
-	else:
-		kwargs["stream"] = False
+		stream=False,
 		# 关键：非流式需明确关闭 thinking
-		kwargs["extra_body"] = {"enable_thinking": False}
-	resp = _client.chat.completions.create(**kwargs)
+		extra_body={**(extra_body or {}), "enable_thinking": False},
+	)
+	def _attempt():
+		# 每次尝试（含对冲副本）各自占用一个调度槽位，退避等待期间不占槽
+		with llm_slot(call_site, priority):
+			return _get_client().chat.completions.create(**kwargs)
+
+	call = (lambda: _hedged(call_site, _attempt)) if _retry_policy(call_site).hedge else _attempt
+	t0 = time.perf_counter()
+	resp = _with_retries(call_site, call)
+	elapsed_ms = (time.perf_counter() - t0) * 1000
 	content = resp.choices[0].message.content or ""
+	usage_service.record(call_site, kwargs["model"], getattr(resp, "usage", None), messages, content)
+	metrics_service.observe(f"llm_latency_ms:{call_site}", elapsed_ms)
+	metrics_service.observe("llm_latency_ms", elapsed_ms)
+	trace_service.record_llm(
+		call_site, messages, content, elapsed_ms,
+		mode="chat", max_tokens=max_tokens, model=kwargs["model"],
+	)
+	return content
+
+
+def _thinking_completion(
+	messages: List[Dict[str, str]],
+	max_tokens: int,
+	temperature: float,
+	extra_body: Optional[Dict[str, Any]],
+	call_site: str,
+	priority: Optional[str],
+	model: Optional[str],
+	budget: int,
+	on_reasoning: Optional[Callable[[str], None]],
+) -> str:
+	"""
+	思考模式：流式读取，reasoning_content 与 content 分开累积。
+	思考 token 达到预算即关闭上游流，带着已有思考追加一次非思考调用直接出结果，
+	额外延迟以预算为界。thinking_budget 同时透传给上游，支持的服务端会自行截断。
+	max_tokens 只约束最终输出，上游上限为 预算 + max_tokens。
+	"""
+	model = model or MODEL_NAME
+	body = {**(extra_body or {}), "enable_thinking": True, "thinking_budget": budget}
+	reasoning: List[str] = []
+	parts: List[str] = []
+	thought = 0
+	cut = False
+	finish_reason = None
+	usage = None
+	# 槽位覆盖整个流式读取过程；只在建立流之前重试
+	with llm_slot(call_site, priority):
+		t0 = time.perf_counter()
+		stream = _with_retries(call_site, lambda: _get_client().chat.completions.create(
+			model=model,
+			messages=messages,
+			max_tokens=budget + max_tokens,
+			temperature=temperature,
+			stream=True,
+			extra_body=body,
+			**_stream_usage_kwargs(),
+		))
+		try:
+			for chunk in stream:
+				usage = getattr(chunk, "usage", None) or usage
+				if not chunk.choices:
+					continue
+				choice = chunk.choices[0]
+				if choice.finish_reason:
+					finish_reason = choice.finish_reason
+				delta = choice.delta
+				if delta is None:
+					continue
+				piece = getattr(delta, "reasoning_content", None)
+				if piece and not parts:
+					reasoning.append(piece)
+					thought += estimate_tokens(piece)
+					if on_reasoning is not None:
+						on_reasoning(piece)
+					if thought >= budget:
+						cut = True
+						break
+				if delta.content:
+					parts.append(delta.content)
+		finally:
+			stream.close()
+		elapsed_ms = (time.perf_counter() - t0) * 1000
+	content = "".join(parts)
+	# 未拿到上游 usage 时按 思考 + 输出 文本估算
+	usage_service.record(call_site, model, usage, messages, "".join(reasoning) + content)
+	metrics_service.observe(f"llm_latency_ms:{call_site}", elapsed_ms)
+	metrics_service.observe("llm_latency_ms", elapsed_ms)
+	metrics_service.observe(f"llm_reasoning_tokens:{call_site}", thought)
+	trace_service.record_llm(
+		call_site, messages, content, elapsed_ms,
+		mode="thinking", model=model, max_tokens=max_tokens, budget=budget,
+		reasoning_tokens=thought, cut=cut, finish_reason=finish_reason,
+	)
+	if cut or (reasoning and not content.strip()):
+		# 思考超出预算（或上限耗尽在思考阶段）：不再等它想完，带着已有思考直接出结果
+		metrics_service.incr(f"thinking_cutoff:{call_site}")
+		return chat_completion(
+			messages + [{"role": "user", "content": THINKING_CUTOFF.render(reasoning="".join(reasoning))}],
+			max_tokens=max_tokens, temperature=temperature, extra_body=extra_body,
+			call_site=call_site, priority=priority, model=model,
+		)
 	return content
 
 
@@ -61,116 +458,323 @@ def safe_json_parse(text: str) -> Any:
 	return _safe_json_parse(text)
 
 
+class _JSONArrayStream:
+	"""
+	增量解析 JSON 数组：逐段喂入模型输出，每当数组内一个顶层对象闭合即解析并返回。
+	只跟踪括号深度与字符串/转义状态，不依赖第三方流式解析库。
+	"""
+
+	def __init__(self):
+		self._buf: List[str] = []
+		self._depth = 0
+		self._in_str = False
+		self._escape = False
+		self._started = False
+		self._obj_start = -1
+		self._pos = 0
+
+	def feed(self, chunk: str) -> List[Dict[str, Any]]:
+		out: List[Dict[str, Any]] = []
+		for ch in chunk:
+			self._buf.append(ch)
+			idx = self._pos
+			self._pos += 1
+			if self._in_str:
+				if self._escape:
+					self._escape = False
+				elif ch == "\\":
+					self._escape = True
+				elif ch == '"':
+					self._in_str = False
+				continue
+			if not self._started:
+				if ch == "[":
+					self._started = True
+					self._depth = 1
+				continue
+			if ch == '"':
+				self._in_str = True
+			elif ch in "{[":
+				if ch == "{" and self._depth == 1:
+					self._obj_start = idx
+				self._depth += 1
+			elif ch in "}]":
+				self._depth -= 1
+				if ch == "}" and self._depth == 1 and self._obj_start >= 0:
+					frag = "".join(self._buf[self._obj_start:idx + 1])
+					self._obj_start = -1
+					try:
+						obj = json.loads(frag)
+					except Exception:
+						obj = None
+					if isinstance(obj, dict):
+						out.append(obj)
+		return out
+
+
+def stream_json_items(
+	messages: List[Dict[str, str]],
+	need: int,
+	accept: Optional[Callable[[Dict[str, Any]], bool]] = None,
+	max_tokens: int = 512,
+	temperature: float = 0.6,
+	call_site: str = "default",
+	cancelled: Optional[Callable[[], bool]] = None,
+	priority: Optional[str] = None,
+	model: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], str]:
+	"""
+	以流式方式请求 JSON 数组输出，边接收边解析；
+	当通过 accept 校验的条目达到 need 条时立即关闭上游流，不再为多余 token 付费/等待。
+	cancelled() 返回 True 时（如请求已被取代）同样立即关闭上游流。
+	返回 (已接受条目, 已收到的原始文本)。max_tokens 为上限，实际按调用点历史长度自适应。
+	"""
+	model = usage_service.budget_model(call_site, model) or MODEL_NAME
+	limit = adaptive_max_tokens(call_site, max_tokens)
+	parser = _JSONArrayStream()
+	parts: List[str] = []
+	items: List[Dict[str, Any]] = []
+	finish_reason = None
+	usage = None
+	# 槽位覆盖整个流式读取过程，提前关闭流即归还
+	with llm_slot(call_site, priority):
+		t0 = time.perf_counter()
+		# 只在建立流之前重试；开始输出后中途出错交给调用方兜底
+		stream = _with_retries(call_site, lambda: _get_client().chat.completions.create(
+			model=model,
+			messages=messages,
+			max_tokens=limit,
+			temperature=temperature,
+			stream=True,
+			extra_body={"enable_thinking": False},
+			**_stream_usage_kwargs(),
+		))
+		try:
+			for chunk in stream:
+				# 提前关闭时拿不到末尾的 usage，记录时按已收到的文本估算
+				usage = getattr(chunk, "usage", None) or usage
+				if not chunk.choices:
+					continue
+				choice = chunk.choices[0]
+				delta = choice.delta.content if choice.delta else None
+				if choice.finish_reason:
+					finish_reason = choice.finish_reason
+				if not delta:
+					continue
+				parts.append(delta)
+				for obj in parser.feed(delta):
+					if accept is None or accept(obj):
+						items.append(obj)
+				if need and len(items) >= need:
+					break
+				if cancelled is not None and cancelled():
+					break
+		finally:
+			stream.close()
+		elapsed_ms = (time.perf_counter() - t0) * 1000
+	raw = "".join(parts)
+	usage_service.record(call_site, model, usage, messages, raw)
+	_length_tracker.observe(
+		call_site, estimate_tokens(raw), truncated=(finish_reason == "length"), limit=limit
+	)
+	metrics_service.observe(f"llm_latency_ms:{call_site}", elapsed_ms)
+	metrics_service.observe("llm_latency_ms", elapsed_ms)
+	trace_service.record_llm(
+		call_site, messages, raw, elapsed_ms,
+		mode="stream", model=model, max_tokens=limit, need=need, accepted=len(items), finish_reason=finish_reason,
+	)
+	if not items and raw:
+		# 输出不是标准数组（如包在对象里），退回整体解析
+		data = _safe_json_parse(raw)
+		if isinstance(data, list):
+			items = [it for it in data if isinstance(it, dict) and (accept is None or accept(it))]
+	return items, raw
+
+
+@lru_cache(maxsize=512)
+def _scenario_hint(scenario_json: str) -> str:
+	"""
+	由场景 JSON 构造候选生成用的场景/身份逻辑提示。
+	同一场景在整个会话内不变，按序列化结果缓存，避免每次请求重复拼装。
+	"""
+	scenario = json.loads(scenario_json) or {}
+	if not scenario:
+		return ""
+	oppo = scenario.get("opponent") or {}
+	ug = scenario.get("userGoal") or {}
+	traits = oppo.get("traits") or []
+	scn_desc = {
+		"scenario": scenario.get("scenario") or "",
+		"opponent": {
+			"roleTitle": oppo.get("roleTitle") or "",
+			"style": oppo.get("style") or "",
+			"tone": oppo.get("tone") or "",
+			"traits": traits,
+			"domain": oppo.get("domain") or "",
+		},
+		"userGoal": {
+			"goal": (ug.get("goal") or ""),
+			"subgoals": ug.get("subgoals") or [],
+			"successCriteria": ug.get("successCriteria") or [],
+		},
+	}
+	traits_hint = ("；对方形象关键词：" + "、".join([str(t) for t in traits if t])) if traits else ""
+	return CANDIDATES_SCENARIO.render(
+		scn_desc_json=dumps(scn_desc),
+		traits_hint=traits_hint,
+		scenario_desc=scn_desc.get('scenario') or '',
+		role_title=scn_desc['opponent']['roleTitle'] or '对方',
+		user_goal=scn_desc['userGoal']['goal'] or '自然交流',
+		style_rule=CANDIDATES_STYLE_RULE.render() if traits else "",
+	)
+
+
+@lru_cache(maxsize=256)
+def _persona_hint(funcs_items: Tuple[Tuple[str, Any], ...]) -> str:
+	return CANDIDATES_PERSONA.render(funcs_json=dumps(dict(funcs_items)))
+
+
+# 并发扇出：每个槽位一次请求
+_CANDIDATE_SLOTS: List[Tuple[str, str]] = [
+	("mirror", "镜像：引用/复述对方上一条中的关键词，紧密承接"),
+	("safe", "稳妥：低风险、礼貌地推进对话"),
+	("humor", "幽默：轻松有趣但不冒犯、不讽刺"),
+]
+_fanout_pool = ThreadPoolExecutor(max_workers=CANDIDATE_FANOUT_WORKERS, thread_name_prefix="cand-fanout")
+
+
+def _generate_slot(
+	messages: List[Dict[str, str]], slot_id: str, desc: str, model: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+	# 共享前缀 + 槽位后缀：前缀字节一致，便于上游 prompt cache 命中
+	suffix = CANDIDATES_SLOT_SUFFIX.render(slot_id=slot_id, desc=desc)
+	slot_messages = messages[:-1] + [{"role": "user", "content": messages[-1]["content"] + suffix}]
+	limit = adaptive_max_tokens("generate_candidates.slot", 160, floor=48)
+	raw = chat_completion(
+		slot_messages, max_tokens=limit, temperature=0.7, call_site="generate_candidates.slot", model=model,
+	)
+	_length_tracker.observe("generate_candidates.slot", estimate_tokens(raw))
+	data = _safe_json_parse(raw)
+	if isinstance(data, list):
+		data = next((it for it in data if isinstance(it, dict)), None)
+	if not isinstance(data, dict):
+		return None
+	data["id"] = slot_id
+	return data
+
+
+def _fanout_candidates(
+	messages: List[Dict[str, str]],
+	need: int,
+	accept: Optional[Callable[[Dict[str, Any]], bool]],
+	deadline_s: float,
+	cancelled: Optional[Callable[[], bool]] = None,
+	model: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+	"""
+	各槽位并发请求，按到达顺序合并；凑够 need 条或到达截止时间即返回。
+	未完成的请求留在线程池里自然结束，结果丢弃。
+	"""
+	# 复制上下文，使各槽位线程中的追踪记录归属当前请求
+	futures = {
+		_fanout_pool.submit(contextvars.copy_context().run, _generate_slot, messages, sid, desc, model): sid
+		for sid, desc in _CANDIDATE_SLOTS
+	}
+	pending = set(futures)
+	merged: List[Dict[str, Any]] = []
+	errors: List[BaseException] = []
+	end = time.monotonic() + deadline_s
+	while pending and (not need or len(merged) < need):
+		remaining = end - time.monotonic()
+		if remaining <= 0 or (cancelled is not None and cancelled()):
+			break
+		# 分片等待，便于及时响应取消
+		done, pending = wait(pending, timeout=min(remaining, 0.1), return_when=FIRST_COMPLETED)
+		for fut in done:
+			try:
+				it = fut.result()
+			except Exception as e:
+				errors.append(e)
+				continue
+			if it and (accept is None or accept(it)):
+				merged.append(it)
+	for fut in pending:
+		fut.cancel()
+	if not merged and not (cancelled is not None and cancelled()):
+		if errors:
+			raise errors[0]
+		if pending:
+			raise TimeoutError("candidate fan-out deadline exceeded")
+	return merged
+
+
 def generate_candidates(
 	context: Dict[str, Any],
 	persona: Optional[Dict[str, Any]] = None,
 	reply_mode: str = "probe",  # "answer" | "probe"
+	need: int = 0,
+	accept: Optional[Callable[[Dict[str, Any]], bool]] = None,
+	mode: Optional[str] = None,  # "stream" | "fanout"，默认取配置
+	cancelled: Optional[Callable[[], bool]] = None,
+	model: Optional[str] = None,
 ) -> List[Dict[str, Any]]:
 	"""
 	Use LLM to generate 3+ candidate replies (mirror/safe/humor),
 	then caller can score and pick top-3.
+	- need>0 时走流式：凑够 need 条通过 accept（如安全审校）的候选即提前结束。
+	- mode="fanout"：每个槽位并发一个小请求，先到先合并，截止时间到即返回已有结果。
+	- cancelled：请求被取代时尽早停止生成并返回已有结果。
+	- model：覆盖默认模型（由调用方的级联策略决定）。
 	"""
 	persona_hint = ""
 	if persona and persona.get("enabled"):
 		funcs = persona.get("functions") or {}
-		persona_hint = f"\n已知用户八维偏好：{json.dumps(funcs, ensure_ascii=False)}。请尽量匹配沟通风格。"
+		persona_hint = _persona_hint(tuple(funcs.items()))
 
-	sys = (
-		"你是一位中文沟通教练助手，专门帮助用户提升社交对话技巧。"
-		"你的任务是为用户生成多条候选回复，帮助用户学习如何更好地与对方沟通。"
-	)
-	mode_hint = ""
-	if reply_mode == "answer":
-		mode_hint = (
-			"\n当前应对模式：answer（对方刚提出问题）。"
-			"\n请先直接给出回答/信息/观点，不要以提问开头；整条最多可包含0-1个轻问（可为0）。"
-			"\n尽量具体，结合上下文中的事实或常识补充一个小细节，再视情况加一句轻提问。"
-		)
+	sys = CANDIDATES_SYSTEM.render()
+	mode_hint = CANDIDATES_MODE["answer" if reply_mode == "answer" else "probe"].render()
+	scenario = context.get("scenario")
+	if isinstance(scenario, BaseModel):
+		scenario_json = scenario.model_dump_json()
 	else:
-		mode_hint = (
-			"\n当前应对模式：probe（推进对话）。"
-			"\n可以包含一个自然追问，用于推动互动。"
-		)
-	scenario = context.get("scenario") or {}
-	scenario_hint = ""
-	if scenario:
-		oppo = scenario.get("opponent") or {}
-		ug = scenario.get("userGoal") or {}
-		traits = oppo.get("traits") or []
-		scn_desc = {
-			"scenario": scenario.get("scenario") or "",
-			"opponent": {
-				"roleTitle": oppo.get("roleTitle") or "",
-				"style": oppo.get("style") or "",
-				"tone": oppo.get("tone") or "",
-				"traits": traits,
-				"domain": oppo.get("domain") or "",
-			},
-			"userGoal": {
-				"goal": (ug.get("goal") or ""),
-				"subgoals": ug.get("subgoals") or [],
-				"successCriteria": ug.get("successCriteria") or [],
-			},
-		}
-		traits_hint = ("；对方形象关键词：" + "、".join([str(t) for t in traits if t])) if traits else ""
-		style_rule = (
-			"\n请优先依据对方形象关键词调整语气、关注点与说话方式；"
-			"若关键词与固定风格冲突，以关键词为准；避免与其相悖的表达。"
-			if traits else ""
-		)
-		role_title = scn_desc['opponent']['roleTitle'] or '对方'
-		scenario_desc_text = scn_desc.get('scenario') or ''
-		user_goal = scn_desc['userGoal']['goal'] or '自然交流'
-		
-		scenario_hint = (
-			f"\n场景设定：{json.dumps(scn_desc, ensure_ascii=False)}{traits_hint}。\n\n"
-			"【极其重要的身份逻辑】\n"
-			"根据场景描述和对方角色，你需要推断出用户的身份。\n"
-			f"场景描述：{scenario_desc_text}\n"
-			f"对方角色：{role_title}\n"
-			f"用户目标：{user_goal}\n\n"
-			"基于以上信息，请明确：\n"
-			"1. 用户的身份是什么？（例如：如果对方是学弟且场景是社团招新，那用户就是学长/学姐；如果对方是面试官，用户就是求职者）\n"
-			"2. 用户和对方的关系是什么？（引导者vs被引导者？平等关系？）\n"
-			"3. 用户在这个场景中的角色定位是什么？\n\n"
-			"【候选生成要求】\n"
-			"你是为“用户”（而不是对方）生成候选回复。\n"
-			"候选回复必须：\n"
-			"1. 以用户的真实身份口吻说话（根据你的推断）\n"
-			f"2. 适合对{role_title}说的话\n"
-			"3. 符合场景逻辑和社交常识（例如：社团成员介绍自己社团说'我们'，不说'你们'；求职者回答问题，不反问面试官的个人兴趣）\n"
-			"4. 推进用户目标的实现\n\n"
-			"【举例说明】\n"
-			"错误示例：如果用户是学长招新，说'听说你们社团很有趣'←这是学弟的口吻\n"
-			"正确示例：学长招新应说'我们社团最近有个活动很有趣'←这才是学长的口吻\n"
-			+ style_rule
-		)
+		scenario_json = dumps(scenario or {})
+	scenario_hint = _scenario_hint(scenario_json) if scenario else ""
+	# 上下文中的场景直接拼入已序列化的片段，不再转 dict
+	context_json = dumps_object({**context, "scenario": RawJSON(scenario_json if scenario else "null")})
+	anchor_json = dumps(context.get("anchor", {}))
 
-	usr = (
-		"请基于提供的对话上下文与画像，输出3-6条中文候选回复，槽位包含：镜像/稳妥/幽默。"
-		"\n要求：每条≤2句；避免冒犯、隐私、刻板印象。"
-		f"{mode_hint}"
-		"\n如果上一条是对方消息，请优先引用上一条中的关键词或关键短语，保持紧密承接；若无法引用请说明原因再简洁回应。"
-		"\n上下文锚点（可能为空）："
-		f"{json.dumps(context.get('anchor', {}), ensure_ascii=False)}"
-		"\n输出严格为JSON数组：[{\"id\":\"mirror|safe|humor|...\",\"text\":\"...\",\"why\":\"原因\",\"risk\":\"low|mid|high\"}]\n"
-		f"上下文：{json.dumps(context, ensure_ascii=False)}"
-		f"{scenario_hint}"
-		f"{persona_hint}"
+	slots = dict(
+		mode_hint=mode_hint, anchor_json=anchor_json, context_json=context_json,
+		scenario_hint=scenario_hint, persona_hint=persona_hint,
 	)
-	raw = chat_completion(
-		[{"role": "system", "content": sys}, {"role": "user", "content": usr}],
-		max_tokens=512,
-		temperature=0.7,
-	)
-	data = _safe_json_parse(raw)
+	usr = CANDIDATES_USER.render(**slots)
+	messages = [{"role": "system", "content": sys}, {"role": "user", "content": usr}]
+	def _accept(it: Dict[str, Any]) -> bool:
+		text = (it.get("text") or "").strip() if isinstance(it.get("text"), str) else ""
+		return bool(text) and (accept is None or accept(it))
+	if (mode or CANDIDATE_GEN_MODE) == "fanout":
+		shared = CANDIDATES_FANOUT_USER.render(**slots)
+		data = _fanout_candidates(
+			[{"role": "system", "content": sys}, {"role": "user", "content": shared}],
+			need=need or len(_CANDIDATE_SLOTS), accept=_accept, deadline_s=CANDIDATE_FANOUT_DEADLINE_S,
+			cancelled=cancelled, model=model,
+		)
+	elif need > 0:
+		data, _raw = stream_json_items(
+			messages, need=need, accept=_accept,
+			max_tokens=512, temperature=0.7, call_site="generate_candidates",
+			cancelled=cancelled, model=model,
+		)
+	else:
+		raw = chat_completion(messages, max_tokens=512, temperature=0.7, call_site="generate_candidates", model=model)
+		data = _safe_json_parse(raw)
 	if not isinstance(data, list):
 		return []
 	cands = []
 	for it in data:
 		if not isinstance(it, dict):
 			continue
-		text = (it.get("text") or "").strip()
+		text = (it.get("text") or "").strip() if isinstance(it.get("text"), str) else ""
 		if not text:
 			continue
 		cands.append({
@@ -186,22 +790,13 @@ def infer_mbti_from_chat(messages_for_infer: List[Dict[str, str]]) -> Dict[str,
 	"""
 	Use LLM to infer MBTI and Jung functions with confidence.
 	"""
-	sys = "你是性格与沟通风格分析助手。"
-	usr = (
-		"基于以下中文聊天记录，推断说话者（第一人称）的MBTI与荣格八维强度（0-100）。"
-		"\n请给出证据点（抽象/具体、情感词密度、疑问/推理词、直接/委婉等），"
-		"\n仅输出JSON对象：{"
-		"\"mbti\":\"INTJ\","
-		"\"confidence\":0.0,"
-		"\"functions\":{\"Ni\":0,\"Ne\":0,\"Si\":0,\"Se\":0,\"Ti\":0,\"Te\":0,\"Fi\":0,\"Fe\":0},"
-		"\"notes\":\"简要证据\"}"
-		"\n聊天记录："
-		f"{json.dumps(messages_for_infer, ensure_ascii=False)}"
-	)
+	sys = MBTI_SYSTEM.render()
+	usr = MBTI_USER.render(chat_json=dumps(messages_for_infer))
 	raw = chat_completion(
 		[{"role": "system", "content": sys}, {"role": "user", "content": usr}],
 		max_tokens=400,
 		temperature=0.2,
+		call_site="infer_mbti_from_chat",
 	)
 	data = _safe_json_parse(raw) or {}
 	if not isinstance(data, dict):
@@ -222,38 +817,35 @@ def infer_mbti_from_chat(messages_for_infer: List[Dict[str, str]]) -> Dict[str,
 	return data
 
 
-def analyze_scenario_llm(payload: Dict[str, Any]) -> Dict[str, Any]:
+def analyze_scenario_llm(
+	payload: Dict[str, Any],
+	on_reasoning: Optional[Callable[[str], None]] = None,
+) -> Dict[str, Any]:
+	"""on_reasoning：该模式配置了思考预算（THINKING_BUDGETS）时接收思考增量。"""
 	mode = (payload.get("mode") or "full").lower()
-	sys = "你是沟通教练助手，负责将自然语言的场景与意图结构化为可执行的沟通设定。"
-	if mode == "goal_only":
-		schema = "{\"userGoal\":{\"goal\":\"\",\"reason\":\"\"}}"
-		guide = (
-			"仅根据给定的‘场景描述’与‘对方形象关键词’推断并精炼一个适合当前轮次的沟通目标，"
-			"用简洁中文表达；必要时给出形成该目标的‘reason’（一句话）。"
-		)
-	else:
-		schema = (
-			"{\"scenario\":\"...\","
-			"\"opponent\":{\"roleTitle\":\"\",\"tone\":\"\",\"traits\":[],\"domain\":\"\"},"
-			"\"userGoal\":{\"goal\":\"\",\"reason\":\"\",\"subgoals\":[],\"successCriteria\":[]},"
-			"\"flow\":{\"startingParty\":\"user|opponent|either\",\"openingHints\":[]},"
-			"\"anchors\":[],\"constraints\":{\"taboo\":[],\"lengthHint\":\"\",\"askRatio\":\"\"}}"
-		)
-		guide = (
-			"请从‘场景描述/模板’中抽象出简洁的对方形象关键词（3-6条短语，避免单字或空泛词），"
-			"补全对方称谓/语气与可选领域；根据‘对方形象+场景’产出‘我的目标’，并给出简短reason。"
-			"同时判断该场景通常由谁先开场：user(我方主动)/opponent(对方先说，如面试官、客服)/either(均可)，"
-			"并在flow.openingHints中给出1-2条开场建议（若startingParty=opponent则给对方开场示例，否则给我方）。"
-		)
-	usr = (
-		"严格按以下JSON Schema输出，不要添加解释：" + schema + "\n"
-		+ guide + "\n输入：" + json.dumps(payload, ensure_ascii=False)
-	)
-	raw = chat_completion([
-		{"role": "system", "content": sys},
-		{"role": "user", "content": usr},
-	], max_tokens=600, temperature=0.3)
-	data = _safe_json_parse(raw) or {}
-	if not isinstance(data, dict):
-		data = {}
-	return data
+	sys = SCENARIO_SYSTEM.render()
+	if mode not in SCENARIO_USER:
+		mode = "full"
+	tpl = SCENARIO_USER[mode]
+	usr = tpl.render(payload_json=dumps(payload))
+	budget = thinking_budget(f"analyze_scenario_llm.{mode}")
+
+	def _attempt(model: Optional[str]) -> Dict[str, Any]:
+		raw = chat_completion([
+			{"role": "system", "content": sys},
+			{"role": "user", "content": usr},
+		], max_tokens=600 if mode == "full" else 200, temperature=0.3, call_site="analyze_scenario_llm",
+			# goal_only/opponent_patch 是进入会话前的轻量补全，完整分析才算后台任务
+			priority=None if mode == "full" else "standard", model=model,
+			thinking=budget, on_reasoning=on_reasoning)
+		data = _safe_json_parse(raw) or {}
+		return data if isinstance(data, dict) else {}
+
+	def _valid(data: Dict[str, Any]) -> bool:
+		if mode == "goal_only":
+			return bool((data.get("userGoal") or {}).get("goal"))
+		if mode == "opponent_patch":
+			return bool(data.get("opponent"))
+		return bool(data.get("opponent")) and bool(data.get("userGoal"))
+
+	return cascade(f"analyze_scenario_llm.{mode}", _attempt, _valid)
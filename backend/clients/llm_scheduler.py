@@ -0,0 +1,222 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+import itertools
+import threading
+import time
+
+from backend.config.config import (
+	LLM_MAX_CONCURRENCY, LLM_RESERVED_INTERACTIVE, LLM_BACKGROUND_MAX_CONCURRENCY,
+	LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT_INTERACTIVE_S, LLM_QUEUE_TIMEOUT_STANDARD_S,
+	LLM_QUEUE_TIMEOUT_BACKGROUND_S,
+)
+from backend.services import metrics_service
+
+# 上游调用调度：所有模型请求先在这里取得并发槽位。
+# - 三个优先级：interactive（preSend 建议、对方回复）> standard > background（完整场景分析、MBTI 推断）
+# - interactive 独享 LLM_RESERVED_INTERACTIVE 个槽位，其它类别不能占用；background 另有并发上限
+# - 槽位不足时按（优先级, 到达顺序）排队，每类有各自的排队截止时间
+# - 队列满时优先丢弃排队中最低优先级、最新到达的请求
+# LLM_MAX_CONCURRENCY=0 时关闭调度，直通上游。
+
+INTERACTIVE = "interactive"
+STANDARD = "standard"
+BACKGROUND = "background"
+
+_RANK: Dict[str, int] = {INTERACTIVE: 0, STANDARD: 1, BACKGROUND: 2}
+
+# 调用点默认优先级；请求级可用 priority_scope 覆盖
+_SITE_PRIORITY: Dict[str, str] = {
+	"generate_peer_reply": INTERACTIVE,
+	"generate_candidates": STANDARD,
+	"generate_candidates.slot": STANDARD,
+	"infer_mbti_from_chat": BACKGROUND,
+	"analyze_scenario_llm": BACKGROUND,
+}
+
+_scope: ContextVar[Optional[str]] = ContextVar("llm_priority", default=None)
+
+
+class SchedulerRejected(RuntimeError):
+	"""排队超时或过载被丢弃；retry_after 为建议的重试间隔（秒）。"""
+
+	def __init__(self, priority: str, reason: str, retry_after: float = 1.0):
+		super().__init__(f"LLM call rejected ({priority}, {reason})")
+		self.priority = priority
+		self.reason = reason
+		self.retry_after = retry_after
+
+
+class _Waiter:
+	__slots__ = ("rank", "seq", "granted", "rejected")
+
+	def __init__(self, rank: int, seq: int):
+		self.rank = rank
+		self.seq = seq
+		self.granted = False
+		self.rejected: Optional[str] = None
+
+
+class LLMScheduler:
+	def __init__(
+		self,
+		capacity: int,
+		reserved_interactive: int,
+		background_max: int,
+		max_queue: int,
+		queue_timeouts: Dict[str, float],
+	):
+		self.capacity = capacity
+		self.reserved_interactive = min(reserved_interactive, capacity)
+		self.background_max = background_max
+		self.max_queue = max_queue
+		self.queue_timeouts = queue_timeouts
+		self._cond = threading.Condition()
+		self._running = [0, 0, 0]
+		self._queue: List[_Waiter] = []
+		self._seq = itertools.count()
+		self._shed = {name: 0 for name in _RANK}
+
+	def _admissible(self, rank: int) -> bool:
+		total = sum(self._running)
+		if total >= self.capacity:
+			return False
+		if rank == _RANK[BACKGROUND] and self.background_max and self._running[rank] >= self.background_max:
+			return False
+		if rank == _RANK[INTERACTIVE]:
+			return True
+		# 非交互请求只能使用预留之外的槽位
+		return total - self._running[0] < self.capacity - self.reserved_interactive
+
+	def _dispatch(self) -> None:
+		# 按（优先级, 到达顺序）依次放行，能放则放；调用方已持锁
+		granted = False
+		for w in sorted(self._queue, key=lambda w: (w.rank, w.seq)):
+			if self._admissible(w.rank):
+				w.granted = True
+				self._running[w.rank] += 1
+				self._queue.remove(w)
+				granted = True
+		if granted:
+			self._cond.notify_all()
+
+	def _shed_for(self, rank: int) -> bool:
+		"""队列已满：挤掉一个比新请求优先级更低的排队者；没有则返回 False。"""
+		victim = max(self._queue, key=lambda w: (w.rank, w.seq), default=None)
+		if victim is None or victim.rank <= rank:
+			return False
+		victim.rejected = "shed"
+		self._queue.remove(victim)
+		self._cond.notify_all()
+		return True
+
+	def _retry_after(self, rank: int) -> float:
+		name = _name(rank)
+		return max(1.0, round(self.queue_timeouts.get(name, 1.0), 1))
+
+	def _reject(self, name: str, reason: str) -> SchedulerRejected:
+		self._shed[name] += 1
+		metrics_service.incr(f"llm_sched_rejected:{name}:{reason}")
+		return SchedulerRejected(name, reason, self._retry_after(_RANK[name]))
+
+	@contextmanager
+	def slot(self, priority: str) -> Iterator[None]:
+		"""取得一个上游并发槽位，退出时归还。拿不到时抛 SchedulerRejected。"""
+		rank = _RANK.get(priority, _RANK[STANDARD])
+		name = _name(rank)
+		t0 = time.perf_counter()
+		with self._cond:
+			if not self._queue and self._admissible(rank):
+				self._running[rank] += 1
+			else:
+				if len(self._queue) >= self.max_queue and not self._shed_for(rank):
+					raise self._reject(name, "queue_full")
+				w = _Waiter(rank, next(self._seq))
+				self._queue.append(w)
+				self._dispatch()
+				deadline = time.monotonic() + self.queue_timeouts.get(name, 5.0)
+				while not w.granted and w.rejected is None:
+					remaining = deadline - time.monotonic()
+					if remaining <= 0:
+						w.rejected = "deadline"
+						self._queue.remove(w)
+						break
+					self._cond.wait(remaining)
+				if not w.granted:
+					raise self._reject(name, w.rejected or "deadline")
+		metrics_service.observe(f"llm_queue_wait_ms:{name}", (time.perf_counter() - t0) * 1000)
+		try:
+			yield
+		finally:
+			with self._cond:
+				self._running[rank] -= 1
+				self._dispatch()
+
+	def depth(self) -> int:
+		with self._cond:
+			return len(self._queue)
+
+	def stats(self) -> Dict[str, object]:
+		with self._cond:
+			queued = {name: 0 for name in _RANK}
+			for w in self._queue:
+				queued[_name(w.rank)] += 1
+			return {
+				"capacity": self.capacity,
+				"reservedInteractive": self.reserved_interactive,
+				"running": {name: self._running[r] for name, r in _RANK.items()},
+				"queued": queued,
+				"rejected": dict(self._shed),
+			}
+
+
+def _name(rank: int) -> str:
+	return (INTERACTIVE, STANDARD, BACKGROUND)[rank]
+
+
+_scheduler: Optional[LLMScheduler] = None
+if LLM_MAX_CONCURRENCY > 0:
+	_scheduler = LLMScheduler(
+		capacity=LLM_MAX_CONCURRENCY,
+		reserved_interactive=LLM_RESERVED_INTERACTIVE,
+		background_max=LLM_BACKGROUND_MAX_CONCURRENCY,
+		max_queue=LLM_MAX_QUEUE,
+		queue_timeouts={
+			INTERACTIVE: LLM_QUEUE_TIMEOUT_INTERACTIVE_S,
+			STANDARD: LLM_QUEUE_TIMEOUT_STANDARD_S,
+			BACKGROUND: LLM_QUEUE_TIMEOUT_BACKGROUND_S,
+		},
+	)
+	metrics_service.register_provider("llm_scheduler", _scheduler.stats)
+
+
+def resolve_priority(call_site: str, priority: Optional[str] = None) -> str:
+	"""显式参数 > 请求级 priority_scope > 调用点默认。"""
+	return priority or _scope.get() or _SITE_PRIORITY.get(call_site, STANDARD)
+
+
+@contextmanager
+def priority_scope(priority: str) -> Iterator[None]:
+	"""在当前请求（及复制了上下文的扇出线程）内覆盖模型调用的优先级。"""
+	token = _scope.set(priority)
+	try:
+		yield
+	finally:
+		_scope.reset(token)
+
+
+@contextmanager
+def llm_slot(call_site: str, priority: Optional[str] = None) -> Iterator[None]:
+	if _scheduler is None:
+		yield
+		return
+	with _scheduler.slot(resolve_priority(call_site, priority)):
+		yield
+
+
+def queue_depth() -> int:
+	"""当前排队等待上游槽位的调用数（调度关闭时为 0）。"""
+	if _scheduler is None:
+		return 0
+	return _scheduler.depth()
@@ -0,0 +1,269 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import re
+
+# Prompt 模板库：所有固定文案在导入时编译一次，请求期只填充变量槽位。
+# - 槽位语法 ${name}，不与 JSON 花括号冲突
+# - 每个模板有 id + version；修改文案时同步提升 version，便于追踪与回放
+# - 固定说明放在模板开头、变量放在末尾，保证前缀逐字节稳定，利于上游 prompt cache 命中；
+#   变量按变化频率排列：会话内不变的（场景/画像）在前，每轮变化的（应对模式/锚点/上下文）最后
+
+_SLOT_RE = re.compile(r"\$\{(\w+)\}")
+
+
+def estimate_tokens(text: str) -> int:
+	"""
+	粗略估算 token 数：中日韩字符约 1 token/字，其余约 3 字符/token。
+	仅用于预算统计，不追求与分词器严格一致。
+	"""
+	if not text:
+		return 0
+	cjk = sum(1 for ch in text if ch >= "\u2e80")
+	return cjk + (len(text) - cjk + 2) // 3
+
+
+class PromptTemplate:
+	__slots__ = ("id", "version", "text", "segments", "slots", "static_prefix", "fingerprint")
+
+	def __init__(self, template_id: str, version: str, text: str):
+		self.id = template_id
+		self.version = version
+		self.text = text
+		segments: List[Tuple[str, Optional[str]]] = []
+		pos = 0
+		for m in _SLOT_RE.finditer(text):
+			segments.append((text[pos:m.start()], m.group(1)))
+			pos = m.end()
+		segments.append((text[pos:], None))
+		self.segments: Tuple[Tuple[str, Optional[str]], ...] = tuple(segments)
+		self.slots: Tuple[str, ...] = tuple(dict.fromkeys(name for _lit, name in segments if name))
+		self.static_prefix = segments[0][0]
+		self.fingerprint = hashlib.sha1(text.encode("utf-8")).hexdigest()[:10]
+
+	@property
+	def key(self) -> str:
+		return f"{self.id}@{self.version}"
+
+	def render(self, **values: Any) -> str:
+		if not self.slots:
+			return self.text
+		out: List[str] = []
+		for literal, name in self.segments:
+			out.append(literal)
+			if name is not None:
+				out.append(str(values[name]))
+		return "".join(out)
+
+	def size(self) -> Dict[str, Any]:
+		static = "".join(lit for lit, _name in self.segments)
+		return {
+			"id": self.id,
+			"version": self.version,
+			"fingerprint": self.fingerprint,
+			"static_tokens": estimate_tokens(static),
+			"prefix_tokens": estimate_tokens(self.static_prefix),
+			"slots": list(self.slots),
+		}
+
+
+_REGISTRY: Dict[str, PromptTemplate] = {}
+
+
+def register(template_id: str, version: str, text: str) -> PromptTemplate:
+	tpl = PromptTemplate(template_id, version, text)
+	_REGISTRY[template_id] = tpl
+	return tpl
+
+
+def get_template(template_id: str) -> PromptTemplate:
+	return _REGISTRY[template_id]
+
+
+def prompt_report() -> List[Dict[str, Any]]:
+	"""各模板的版本、指纹与固定部分 token 估算，用于发现 prompt 体积回归。"""
+	return [tpl.size() for tpl in _REGISTRY.values()]
+
+
+# ---- 候选生成 ----
+
+CANDIDATES_SYSTEM = register("candidates.system", "v1", (
+	"你是一位中文沟通教练助手，专门帮助用户提升社交对话技巧。"
+	"你的任务是为用户生成多条候选回复，帮助用户学习如何更好地与对方沟通。"
+))
+
+CANDIDATES_MODE = {
+	"answer": register("candidates.mode.answer", "v1", (
+		"\n当前应对模式：answer（对方刚提出问题）。"
+		"\n请先直接给出回答/信息/观点，不要以提问开头；整条最多可包含0-1个轻问（可为0）。"
+		"\n尽量具体，结合上下文中的事实或常识补充一个小细节，再视情况加一句轻提问。"
+	)),
+	"probe": register("candidates.mode.probe", "v1", (
+		"\n当前应对模式：probe（推进对话）。"
+		"\n可以包含一个自然追问，用于推动互动。"
+	)),
+}
+
+CANDIDATES_USER = register("candidates.user", "v3", (
+	"请基于提供的对话上下文与画像，输出3-6条中文候选回复，槽位包含：镜像/稳妥/幽默。"
+	"\n要求：每条≤2句；避免冒犯、隐私、刻板印象。"
+	"\n如果上一条是对方消息，请优先引用上一条中的关键词或关键短语，保持紧密承接；若无法引用请说明原因再简洁回应。"
+	"\n输出严格为JSON数组：[{\"id\":\"mirror|safe|humor|...\",\"text\":\"...\",\"why\":\"原因\",\"risk\":\"low|mid|high\"}]"
+	"${scenario_hint}"
+	"${persona_hint}"
+	"${mode_hint}"
+	"\n上下文锚点（可能为空）：${anchor_json}"
+	"\n上下文：${context_json}"
+))
+
+# 并发扇出：所有槽位共享同一前缀，只在末尾追加槽位说明
+CANDIDATES_FANOUT_USER = register("candidates.fanout.user", "v2", (
+	"请基于提供的对话上下文与画像，为用户生成中文候选回复。"
+	"\n要求：每条≤2句；避免冒犯、隐私、刻板印象。"
+	"\n如果上一条是对方消息，请优先引用上一条中的关键词或关键短语，保持紧密承接。"
+	"${scenario_hint}"
+	"${persona_hint}"
+	"${mode_hint}"
+	"\n上下文锚点（可能为空）：${anchor_json}"
+	"\n上下文：${context_json}"
+))
+
+CANDIDATES_SLOT_SUFFIX = register("candidates.fanout.slot", "v1", (
+	"\n\n本次只生成槽位「${slot_id}」的1条候选（${desc}）。"
+	"\n输出严格为JSON对象：{\"id\":\"${slot_id}\",\"text\":\"...\",\"why\":\"原因\",\"risk\":\"low|mid|high\"}"
+))
+
+CANDIDATES_SCENARIO = register("candidates.scenario", "v1", (
+	"\n场景设定：${scn_desc_json}${traits_hint}。\n\n"
+	"【极其重要的身份逻辑】\n"
+	"根据场景描述和对方角色，你需要推断出用户的身份。\n"
+	"场景描述：${scenario_desc}\n"
+	"对方角色：${role_title}\n"
+	"用户目标：${user_goal}\n\n"
+	"基于以上信息，请明确：\n"
+	"1. 用户的身份是什么？（例如：如果对方是学弟且场景是社团招新，那用户就是学长/学姐；如果对方是面试官，用户就是求职者）\n"
+	"2. 用户和对方的关系是什么？（引导者vs被引导者？平等关系？）\n"
+	"3. 用户在这个场景中的角色定位是什么？\n\n"
+	"【候选生成要求】\n"
+	"你是为“用户”（而不是对方）生成候选回复。\n"
+	"候选回复必须：\n"
+	"1. 以用户的真实身份口吻说话（根据你的推断）\n"
+	"2. 适合对${role_title}说的话\n"
+	"3. 符合场景逻辑和社交常识（例如：社团成员介绍自己社团说'我们'，不说'你们'；求职者回答问题，不反问面试官的个人兴趣）\n"
+	"4. 推进用户目标的实现\n\n"
+	"【举例说明】\n"
+	"错误示例：如果用户是学长招新，说'听说你们社团很有趣'←这是学弟的口吻\n"
+	"正确示例：学长招新应说'我们社团最近有个活动很有趣'←这才是学长的口吻\n"
+	"${style_rule}"
+))
+
+CANDIDATES_STYLE_RULE = register("candidates.style_rule", "v1", (
+	"\n请优先依据对方形象关键词调整语气、关注点与说话方式；"
+	"若关键词与固定风格冲突，以关键词为准；避免与其相悖的表达。"
+))
+
+CANDIDATES_PERSONA = register("candidates.persona", "v1", (
+	"\n已知用户八维偏好：${funcs_json}。请尽量匹配沟通风格。"
+))
+
+# ---- 对手回复 ----
+
+PEER_SYSTEM = register("peer.system", "v1", (
+	"你是一位中文虚拟聊天对象，目标是自然地与对方交流。"
+	"请根据你在场景中的身份和立场，使用符合该角色的语气、称谓和行为方式。"
+))
+
+PEER_STYLE_DESC: Dict[str, str] = {
+	"自然": "语气自然、不做作，表达清楚即可。",
+	"活泼": "语气轻快，偶尔用表情或拟声，加强互动感，但不过度。",
+	"理性": "语气沉稳偏理性，简洁、有逻辑，适度反问推进话题。",
+	"温和": "语气温柔与支持，给对方积极反馈与简短共情。",
+	"专业": "语气专业、信息密度较高，但不说教，注意浅显表达。",
+	"俏皮": "语气俏皮幽默，避免讽刺与刻板印象，轻松而不失礼貌。",
+	"克制": "语气简洁克制，不热情但不冷漠，回应在点上。",
+}
+
+PEER_TRAITS_STYLE = register("peer.traits_style", "v1", (
+	"请参考对方形象关键词：${traits}。"
+	"优先依据这些关键词调整语气、关注点与说话方式；若与固定风格冲突，以关键词为准。"
+))
+
+# 规则与输出格式在前（固定前缀），角色/场景/历史在后
+PEER_USER = register("peer.user", "v2", (
+	"请扮演与我聊天的对象，按下方【角色设定】中的身份、风格与场景说话。\n\n"
+	"重要规则：\n"
+	"1. 中文输出，每条不超过2句\n"
+	"2. 不要重复问已经回答过的问题（如果对方已经解释了某事，不要再问）\n"
+	"3. 如果对方提出邀请或问你是否有兴趣，应该回应是/否，而不是反问\n"
+	"4. 理解你的身份定位：结合你的角色、场景和对话历史决定合适的主动或被动程度\n"
+	"5. 场景逻辑：不要说不符合你身份的话（如学弟不会说'我们社团'，应该说'你们社团'）\n\n"
+	"请以 JSON 数组返回 3 条不同态度的回复（积极/中立/委婉拒绝）。\n"
+	"格式：[{\"id\":\"pos\",\"text\":\"...\",\"tone\":\"positive\"},{\"id\":\"neut\",\"text\":\"...\",\"tone\":\"neutral\"},{\"id\":\"neg\",\"text\":\"...\",\"tone\":\"negative\"}]\n"
+	"只输出 JSON 数组，不要任何解释文字。\n\n"
+	"【角色设定】\n"
+	"风格：${style}（${style_desc}）。${persona_hint}\n"
+	"${role_hint}\n"
+	"${scenario_line}"
+	"\n【对话历史】\n"
+	"${conv_str}\n\n"
+	"【回复要求】\n"
+	"对方（用户）最后一句话是：${last_msg}\n"
+	"你必须针对这句话给出直接、相关的回复。"
+))
+
+# ---- MBTI 推断 ----
+
+MBTI_SYSTEM = register("mbti.system", "v1", "你是性格与沟通风格分析助手。")
+
+MBTI_USER = register("mbti.user", "v1", (
+	"基于以下中文聊天记录，推断说话者（第一人称）的MBTI与荣格八维强度（0-100）。"
+	"\n请给出证据点（抽象/具体、情感词密度、疑问/推理词、直接/委婉等），"
+	"\n仅输出JSON对象：{"
+	"\"mbti\":\"INTJ\","
+	"\"confidence\":0.0,"
+	"\"functions\":{\"Ni\":0,\"Ne\":0,\"Si\":0,\"Se\":0,\"Ti\":0,\"Te\":0,\"Fi\":0,\"Fe\":0},"
+	"\"notes\":\"简要证据\"}"
+	"\n聊天记录：${chat_json}"
+))
+
+# ---- 场景分析 ----
+
+SCENARIO_SYSTEM = register("scenario.system", "v1", "你是沟通教练助手，负责将自然语言的场景与意图结构化为可执行的沟通设定。")
+
+SCENARIO_USER = {
+	"goal_only": register("scenario.user.goal_only", "v1", (
+		"严格按以下JSON Schema输出，不要添加解释："
+		"{\"userGoal\":{\"goal\":\"\",\"reason\":\"\"}}\n"
+		"仅根据给定的‘场景描述’与‘对方形象关键词’推断并精炼一个适合当前轮次的沟通目标，"
+		"用简洁中文表达；必要时给出形成该目标的‘reason’（一句话）。"
+		"\n输入：${payload_json}"
+	)),
+	"full": register("scenario.user.full", "v1", (
+		"严格按以下JSON Schema输出，不要添加解释："
+		"{\"scenario\":\"...\","
+		"\"opponent\":{\"roleTitle\":\"\",\"tone\":\"\",\"traits\":[],\"domain\":\"\"},"
+		"\"userGoal\":{\"goal\":\"\",\"reason\":\"\",\"subgoals\":[],\"successCriteria\":[]},"
+		"\"flow\":{\"startingParty\":\"user|opponent|either\",\"openingHints\":[]},"
+		"\"anchors\":[],\"constraints\":{\"taboo\":[],\"lengthHint\":\"\",\"askRatio\":\"\"}}\n"
+		"请从‘场景描述/模板’中抽象出简洁的对方形象关键词（3-6条短语，避免单字或空泛词），"
+		"补全对方称谓/语气与可选领域；根据‘对方形象+场景’产出‘我的目标’，并给出简短reason。"
+		"同时判断该场景通常由谁先开场：user(我方主动)/opponent(对方先说，如面试官、客服)/either(均可)，"
+		"并在flow.openingHints中给出1-2条开场建议（若startingParty=opponent则给对方开场示例，否则给我方）。"
+		"\n输入：${payload_json}"
+	)),
+	"opponent_patch": register("scenario.user.opponent_patch", "v1", (
+		"严格按以下JSON Schema输出，不要添加解释："
+		"{\"opponent\":{\"roleTitle\":\"\",\"style\":\"\",\"tone\":\"\"}}\n"
+		"场景与对方称谓已确定，仅对方形象关键词发生了变化。"
+		"请依据‘场景描述’与新的‘对方形象关键词’更新对方的称谓、说话风格与语气，保持与场景一致。"
+		"\n输入：${payload_json}"
+	)),
+}
+
+# ---- 思考模式 ----
+
+# 思考超出预算被截断后，带着已有思考以非思考模式续答（接在原对话末尾）
+THINKING_CUTOFF = register("thinking.cutoff", "v1", (
+	"思考已达长度上限。请不要继续思考，参考下面已有的思考，直接按上面要求的格式输出最终结果。"
+	"\n已有思考（已截断）：${reasoning}"
+))
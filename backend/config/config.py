@@ -1,6 +1,7 @@
 from pathlib import Path
 from typing import Optional
 import os
+import tempfile
 from openai import OpenAI
 
 # Base paths
@@ -11,6 +12,121 @@ TOKEN_FILE = BASE_DIR / "config" / "modelscope_token.txt"
 MODEL_NAME = os.getenv("QWEN_MODEL_NAME", "Qwen/Qwen3-8B")
 BASE_URL = os.getenv("MODEL_BASE_URL", "https://api-inference.modelscope.cn/v1")
 
+# 模型级联：配置 FAST_MODEL_NAME 后，CASCADE_SITES 中的调用点先用小模型，
+# 输出校验不通过（解析失败/条数不足/安全/评分低于 CASCADE_MIN_SCORE）再升级到 MODEL_NAME
+FAST_MODEL_NAME = os.getenv("FAST_MODEL_NAME", "")
+CASCADE_SITES = [s.strip() for s in os.getenv("CASCADE_SITES", "generate_peer_reply,analyze_scenario_llm.goal_only").split(",") if s.strip()]
+CASCADE_MIN_SCORE = float(os.getenv("CASCADE_MIN_SCORE", "0.55"))
+
+# 生成长度自适应：按调用点统计历史输出长度来决定 max_tokens（0 关闭，使用固定上限）
+ADAPTIVE_MAX_TOKENS = os.getenv("ADAPTIVE_MAX_TOKENS", "1") == "1"
+ADAPTIVE_MIN_SAMPLES = int(os.getenv("ADAPTIVE_MIN_SAMPLES", "8"))
+
+# 候选生成模式：stream（单次流式生成全部槽位）| fanout（每个槽位并发一次小请求）
+CANDIDATE_GEN_MODE = os.getenv("CANDIDATE_GEN_MODE", "stream").lower()
+CANDIDATE_FANOUT_DEADLINE_S = float(os.getenv("CANDIDATE_FANOUT_DEADLINE_S", "6.0"))
+CANDIDATE_FANOUT_WORKERS = int(os.getenv("CANDIDATE_FANOUT_WORKERS", "16"))
+
+# 同会话 typing 请求的服务端防抖窗口（毫秒，0 关闭）
+SUGGEST_DEBOUNCE_MS = int(os.getenv("SUGGEST_DEBOUNCE_MS", "0"))
+
+# 建议路由策略（JSON）：{领域: {entryType: "llm"|"local"}}，"*" 为默认领域；
+# 未配置的组合走内置默认（idle/firstEnter/postSend 本地，其余模型）
+SUGGEST_ROUTING_POLICY = os.getenv("SUGGEST_ROUTING_POLICY", "")
+
+# 快速响应序列化：模型直接 model_dump_json、dict 走 orjson（0 退回 FastAPI 默认编码）
+FAST_JSON_RESPONSES = os.getenv("FAST_JSON_RESPONSES", "1") == "1"
+
+# 会话增量分析：情感 EWMA 系数与进程内保留的最大会话数（LRU 淘汰）
+ANALYTICS_EWMA_ALPHA = float(os.getenv("ANALYTICS_EWMA_ALPHA", "0.35"))
+ANALYTICS_MAX_SESSIONS = int(os.getenv("ANALYTICS_MAX_SESSIONS", "10000"))
+
+# 请求追踪（默认关闭）：设置 TRACE_DIR 后按进程写入滚动 JSONL（已脱敏）
+TRACE_DIR = os.getenv("TRACE_DIR", "")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(20 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "5"))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+
+# 上游调用调度：总并发槽位（0 关闭调度）、交互类预留槽位、后台类并发上限、
+# 排队上限与各优先级的排队截止时间（秒）
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_RESERVED_INTERACTIVE = int(os.getenv("LLM_RESERVED_INTERACTIVE", "2"))
+LLM_BACKGROUND_MAX_CONCURRENCY = int(os.getenv("LLM_BACKGROUND_MAX_CONCURRENCY", "2"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_QUEUE_TIMEOUT_INTERACTIVE_S = float(os.getenv("LLM_QUEUE_TIMEOUT_INTERACTIVE_S", "2.0"))
+LLM_QUEUE_TIMEOUT_STANDARD_S = float(os.getenv("LLM_QUEUE_TIMEOUT_STANDARD_S", "4.0"))
+LLM_QUEUE_TIMEOUT_BACKGROUND_S = float(os.getenv("LLM_QUEUE_TIMEOUT_BACKGROUND_S", "20.0"))
+
+# 准入控制：按客户端地址 × 端点的令牌桶限流（反向代理后按 FORWARDED_ALLOW_IPS 信任的代理解析真实地址）。
+# RATE_LIMITS 为 JSON 覆盖：{端点: [桶容量, 每秒补充]}；后端 sqlite 时多 worker 共享同一文件
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "sqlite")  # sqlite | memory（sqlite 在线程池中执行，不阻塞事件循环）
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", str(Path(tempfile.gettempdir()) / "soul-ratelimit.sqlite"))
+# 过载判定：上游排队数或上游耗时 p95 超过阈值时快速 429（/api/suggest 改为本地降级响应）；0 关闭
+SHED_QUEUE_DEPTH = int(os.getenv("SHED_QUEUE_DEPTH", "32"))
+SHED_LATENCY_P95_MS = float(os.getenv("SHED_LATENCY_P95_MS", "12000"))
+# 耗时判定只看最近这段时间（秒）内的样本：降级期间上游样本停止增长，旧样本过期后自动恢复放行
+SHED_LATENCY_WINDOW_S = float(os.getenv("SHED_LATENCY_WINDOW_S", "60"))
+
+# 上游重试：默认重试次数、指数退避基数与单次等待上限（秒，上游 Retry-After 超过上限则不再重试）；
+# LLM_RETRY_POLICY 为 JSON 覆盖：{调用点: {"retries": n, "hedge": true}}；
+# 对冲请求在调用点耗时样本达到 LLM_HEDGE_MIN_SAMPLES 后，按观测 p95 触发
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "1"))
+LLM_RETRY_BASE_S = float(os.getenv("LLM_RETRY_BASE_S", "0.25"))
+LLM_RETRY_MAX_WAIT_S = float(os.getenv("LLM_RETRY_MAX_WAIT_S", "2.0"))
+LLM_RETRY_POLICY = os.getenv("LLM_RETRY_POLICY", "")
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+# WebSocket 会话：服务端保留的最大会话数（LRU 淘汰）与每个会话保留的最近轮次
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_KEEP_TURNS = int(os.getenv("SESSION_KEEP_TURNS", "40"))
+
+# 请求体摄入上限：超过即 413。对话只校验端点实际会用到的尾部轮次
+INGEST_MAX_BODY_BYTES = int(os.getenv("INGEST_MAX_BODY_BYTES", str(512 * 1024)))
+INGEST_MAX_TURNS = int(os.getenv("INGEST_MAX_TURNS", "2000"))
+INGEST_MAX_TURN_CHARS = int(os.getenv("INGEST_MAX_TURN_CHARS", "2000"))
+INGEST_SUGGEST_TURNS = int(os.getenv("INGEST_SUGGEST_TURNS", "50"))
+INGEST_PEER_TURNS = int(os.getenv("INGEST_PEER_TURNS", "12"))
+INGEST_MBTI_TURNS = int(os.getenv("INGEST_MBTI_TURNS", "60"))
+
+# 场景模板：预计算的 ScenarioContext（按 templateId）与完整分析结果缓存条数
+SCENARIO_TEMPLATES_FILE = os.getenv("SCENARIO_TEMPLATES_FILE", str(BASE_DIR / "config" / "scenario_templates.json"))
+SCENARIO_CACHE_SIZE = int(os.getenv("SCENARIO_CACHE_SIZE", "1024"))
+
+# 候选打分权重表（JSON，按修改时间热加载，检查间隔秒）
+SCORING_WEIGHTS_FILE = os.getenv("SCORING_WEIGHTS_FILE", str(BASE_DIR / "config" / "scoring_weights.json"))
+SCORING_RELOAD_INTERVAL_S = float(os.getenv("SCORING_RELOAD_INTERVAL_S", "2.0"))
+
+# Token 用量：按调用点/模型汇总，定期写入本机 sqlite（同机多 worker 共享）；
+# 上游未返回 usage（如流式提前关闭）时按文本估算并单独计数。USAGE_STREAM_USAGE=1 时流式请求附带 include_usage
+USAGE_DB = os.getenv("USAGE_DB", str(Path(tempfile.gettempdir()) / "soul-usage.sqlite"))
+USAGE_FLUSH_INTERVAL_S = float(os.getenv("USAGE_FLUSH_INTERVAL_S", "30"))
+USAGE_STREAM_USAGE = os.getenv("USAGE_STREAM_USAGE", "0") == "1"
+# 用量预算：每个用户/会话每天（UTC）的 token 上限，0 关闭。
+# 超出后：fast_model 改用 FAST_MODEL_NAME（未配置则同 local）；local 建议走本地模板，其余调用 429
+USAGE_BUDGET_TOKENS = int(os.getenv("USAGE_BUDGET_TOKENS", "0"))
+USAGE_BUDGET_ACTION = os.getenv("USAGE_BUDGET_ACTION", "fast_model").lower()
+USAGE_MAX_SUBJECTS = int(os.getenv("USAGE_MAX_SUBJECTS", "10000"))
+
+# 内存调试：DEBUG_MEMORY=1 时开放 GET /api/debug/memory（各会话占用 + 分配热点）；
+# TRACEMALLOC_FRAMES>0 时启动即开启 tracemalloc 并记录该深度的调用栈（有额外开销，仅用于容量评估）
+DEBUG_MEMORY = os.getenv("DEBUG_MEMORY", "0") == "1"
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "0"))
+
+# 预fork多进程运行（python -m backend.serve）：worker 数（兼容 WEB_CONCURRENCY）、
+# 优雅退出等待（秒）与滚动重启时等待新 worker 就绪的上限（秒）。
+# 会话态（取代/防抖、WebSocket 会话、增量分析）保存在各进程内，没有会话亲和时多 worker 会使其失效，默认 1
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", os.getenv("WEB_CONCURRENCY", "1")))
+SERVE_GRACEFUL_TIMEOUT_S = float(os.getenv("SERVE_GRACEFUL_TIMEOUT_S", "20"))
+SERVE_READY_TIMEOUT_S = float(os.getenv("SERVE_READY_TIMEOUT_S", "30"))
+
+# 思考模式（enable_thinking，仅流式）：THINKING_BUDGETS 为 JSON {调用点: 思考 token 上限}，
+# 如 {"analyze_scenario_llm.full": 1024}；未配置的调用点不开启思考。
+# 思考超出预算即截断，带着已有思考改用非思考模式直接给出结果
+THINKING_BUDGETS = os.getenv("THINKING_BUDGETS", "")
+THINKING_DEFAULT_BUDGET = int(os.getenv("THINKING_DEFAULT_BUDGET", "1024"))
+
 # Common env var names used by不同平台（取其一即可）
 _TOKEN_ENV_CANDIDATES = [
 	"MODELSCOPE_TOKEN",
@@ -48,6 +164,8 @@ def create_openai_client() -> OpenAI:
 	return OpenAI(
 		base_url=BASE_URL,
 		api_key=read_modelscope_token(),
+		# 重试由 llm_client 按调用点统一控制（退避、Retry-After、对冲），SDK 不再自行重试
+		max_retries=0,
 	)
 
 
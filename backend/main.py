@@ -1,9 +1,19 @@
 from __future__ import annotations
-from typing import Dict, Any
+from typing import Any, Callable, Dict
+import time
+import tracemalloc
 
-from fastapi import FastAPI
+from backend.config.config import TRACEMALLOC_FRAMES
+
+# 尽早开启 tracemalloc，模块加载期的分配（词典、模板、权重表等）也计入
+if TRACEMALLOC_FRAMES > 0 and not tracemalloc.is_tracing():
+	tracemalloc.start(TRACEMALLOC_FRAMES)
+
+from fastapi import FastAPI, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from pydantic import BaseModel
 
 from backend.models.types import (
 	SuggestRequest, SuggestResponse,
@@ -18,9 +28,48 @@ from backend.services.persona_service import compute_mbti_submit
 from backend.clients.llm_client import infer_mbti_from_chat
 from backend.services.memory_service import get_persona_state, apply_persona_state
 from backend.services.peer_service import generate_peer_reply
-from backend.services.scenario_service import analyze_scenario
+from backend.services.scenario_service import analyze_scenario, analyze_scenario_stream
+from backend.services.session_service import serve_websocket
+from backend.config.config import FAST_JSON_RESPONSES, DEBUG_MEMORY
+from backend.models.serialization import dumps_bytes
+from backend.services import trace_service, metrics_service, footprint_service
+from backend.clients.llm_scheduler import SchedulerRejected
+from backend.models.ingest import PayloadTooLarge
+from backend.services.admission_service import AdmissionMiddleware
+from backend.services.usage_service import BudgetExceeded
+
+
+class FastJSONResponse(JSONResponse):
+	"""pydantic 模型直接 model_dump_json，其余走 orjson，跳过 jsonable_encoder 的逐字段转换。"""
+
+	def render(self, content: Any) -> bytes:
+		return dumps_bytes(content)
+
+
+def _respond(model: BaseModel):
+	# 直接返回 Response 时 FastAPI 不再按 response_model 二次校验/编码；
+	# 服务层返回的已经是对应的响应模型
+	if FAST_JSON_RESPONSES:
+		return FastJSONResponse(model)
+	return model
+
 
-app = FastAPI(title="Soul-Agent Demo", version="0.1.0")
+def _traced(endpoint: str, req: BaseModel, fn: Callable[[Any], BaseModel]):
+	# TRACE_DIR 开启时记录请求、prompt、模型输出与阶段耗时；否则零开销直通
+	with trace_service.trace_request(endpoint, req):
+		resp = fn(req)
+		trace_service.set_result(resp)
+	return _respond(resp)
+
+
+app = FastAPI(
+	title="Soul-Agent Demo",
+	version="0.1.0",
+	default_response_class=FastJSONResponse if FAST_JSON_RESPONSES else JSONResponse,
+)
+
+# 限流/过载保护在 CORS 之内，429 响应同样带跨域头
+app.add_middleware(AdmissionMiddleware)
 
 app.add_middleware(
 	CORSMiddleware,
@@ -30,19 +79,50 @@ app.add_middleware(
 	allow_headers=["*"],
 )
 
+
+@app.exception_handler(SchedulerRejected)
+def _on_scheduler_rejected(request: Request, exc: SchedulerRejected):
+	# 过载被调度器丢弃：告知客户端稍后重试
+	return JSONResponse(
+		status_code=503,
+		content={"detail": "upstream busy", "priority": exc.priority, "reason": exc.reason},
+		headers={"Retry-After": str(int(exc.retry_after + 0.999))},
+	)
+
+
+@app.exception_handler(BudgetExceeded)
+def _on_budget_exceeded(request: Request, exc: BudgetExceeded):
+	# 当日用量超出预算且无小模型可降级：次日（UTC）恢复
+	return JSONResponse(
+		status_code=429,
+		content={"detail": "token budget exceeded", "reason": "budget_exceeded", "used": exc.used, "budget": exc.budget},
+		headers={"Retry-After": str(86400 - int(time.time()) % 86400)},
+	)
+
+
+@app.exception_handler(PayloadTooLarge)
+def _on_payload_too_large(request: Request, exc: PayloadTooLarge):
+	# 对话轮次/单轮长度/请求体超出摄入上限
+	return JSONResponse(status_code=413, content={"detail": exc.detail})
+
+
 # API
 @app.post("/api/suggest", response_model=SuggestResponse)
 def api_suggest(req: SuggestRequest):
-	return handle_suggest(req)
+	return _traced("suggest", req, handle_suggest)
 
 
 @app.post("/api/mbti/submit", response_model=MBTISubmitResponse)
 def api_mbti_submit(req: MBTISubmitRequest):
-	return compute_mbti_submit(req)
+	return _respond(compute_mbti_submit(req))
 
 
 @app.post("/api/mbti/infer-from-chat", response_model=MBTIInferResponse)
 def api_mbti_infer_from_chat(req: MBTIInferRequest):
+	return _traced("mbti_infer", req, _infer_mbti)
+
+
+def _infer_mbti(req: MBTIInferRequest) -> MBTIInferResponse:
 	data = infer_mbti_from_chat([t.model_dump() for t in req.conversation])
 	return MBTIInferResponse(
 		mbtiGuess=data.get("mbti") or "",
@@ -63,13 +143,39 @@ def api_apply_persona(state: PersonaState):
 
 @app.post("/api/peer/reply", response_model=PeerReplyResponse)
 def api_peer_reply(req: PeerReplyRequest):
-	return generate_peer_reply(req)
+	return _traced("peer_reply", req, generate_peer_reply)
 
 
 # 场景分析
 @app.post("/api/scenario/analyze", response_model=ScenarioContext)
 def api_scenario_analyze(req: ScenarioInput):
-	return analyze_scenario(req)
+	return _traced("scenario_analyze", req, analyze_scenario)
+
+
+# 场景分析（流式）：开启思考模式时先逐行推送思考进度，最后一行为分析结果
+@app.post("/api/scenario/analyze/stream")
+def api_scenario_analyze_stream(req: ScenarioInput):
+	return StreamingResponse(analyze_scenario_stream(req), media_type="application/x-ndjson")
+
+
+# 实时会话通道：服务端保存会话状态，客户端发送增量事件，结果就绪即推送
+@app.websocket("/ws/session")
+async def ws_session(ws: WebSocket):
+	await serve_websocket(ws)
+
+
+# 运行指标（本进程）：调度器状态、排队/上游耗时分位数、输出长度统计
+@app.get("/api/metrics")
+def api_metrics():
+	return metrics_service.snapshot()
+
+
+# 内存占用（DEBUG_MEMORY=1 时开放）：RSS、各会话占用估算、tracemalloc 分配热点与两次报告间的增长
+@app.get("/api/debug/memory")
+def api_debug_memory(top: int = 20, sessions: int = 10, group: str = "lineno"):
+	if not DEBUG_MEMORY:
+		raise HTTPException(status_code=404, detail="Not Found")
+	return footprint_service.report(top=max(1, min(top, 200)), sessions=max(0, min(sessions, 100)), key_type=group)
 
 
 # 静态资源（前端）- 前端独立部署，不需要挂载
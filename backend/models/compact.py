@@ -0,0 +1,80 @@
+from __future__ import annotations
+from array import array
+from typing import Iterable, Iterator, List, Optional, Tuple
+import math
+import sys
+
+from backend.models.types import ConversationTurn
+
+# 服务端长期持有的会话数据的紧凑表示：
+# - 每轮只占 角色(1B) + 时间戳(8B) + 文本结束偏移(4B)，文本按 UTF-8 顺序追加在同一个 bytearray 中；
+# - 不为每轮保留 pydantic 对象与 dict 副本（每轮数百字节的对象开销），只在 API 边界转换为 ConversationTurn。
+
+_ROLES: Tuple[str, ...] = ("user", "peer")
+_ROLE_CODES = {r: i for i, r in enumerate(_ROLES)}
+_NO_TS = math.nan
+
+
+class TurnLog:
+	"""按列存储的对话轮次（只追加，可丢弃最早的轮次）。"""
+
+	__slots__ = ("_roles", "_ts", "_ends", "_buf")
+
+	def __init__(self, turns: Iterable[ConversationTurn] = ()):
+		self._roles = array("B")
+		self._ts = array("d")
+		self._ends = array("I")  # 第 i 轮文本在 _buf 中的结束偏移；开始偏移为上一轮的结束偏移
+		self._buf = bytearray()
+		for t in turns:
+			self.append(t.role, t.text, t.ts)
+
+	def __len__(self) -> int:
+		return len(self._roles)
+
+	def append(self, role: str, text: str, ts: Optional[float] = None) -> None:
+		self._buf += (text or "").encode("utf-8")
+		self._roles.append(_ROLE_CODES[role])
+		self._ts.append(_NO_TS if ts is None else float(ts))
+		self._ends.append(len(self._buf))
+
+	def trim(self, keep: int) -> None:
+		"""只保留最近 keep 轮。bytearray 删除头部只移动起始指针，不复制剩余文本。"""
+		drop = len(self) - keep
+		if drop <= 0:
+			return
+		cut = self._ends[drop - 1]
+		del self._roles[:drop]
+		del self._ts[:drop]
+		del self._ends[:drop]
+		del self._buf[:cut]
+		ends = self._ends
+		for i in range(len(ends)):
+			ends[i] -= cut
+
+	def role(self, i: int) -> str:
+		return _ROLES[self._roles[i]]
+
+	def text(self, i: int) -> str:
+		if i < 0:
+			i += len(self)
+		start = self._ends[i - 1] if i > 0 else 0
+		return self._buf[start:self._ends[i]].decode("utf-8")
+
+	def __iter__(self) -> Iterator[Tuple[str, str, Optional[float]]]:
+		buf = self._buf
+		start = 0
+		for code, ts, end in zip(self._roles, self._ts, self._ends):
+			yield _ROLES[code], buf[start:end].decode("utf-8"), None if math.isnan(ts) else ts
+			start = end
+
+	def to_models(self) -> List[ConversationTurn]:
+		# 文本写入前已经过请求模型的校验与截断，这里跳过重复校验
+		return [ConversationTurn.model_construct(role=r, text=t, ts=ts) for r, t, ts in self]
+
+	def nbytes(self) -> int:
+		"""本结构占用的内存（含容器对象头）。"""
+		return (
+			sys.getsizeof(self)
+			+ sys.getsizeof(self._roles) + sys.getsizeof(self._ts) + sys.getsizeof(self._ends)
+			+ sys.getsizeof(self._buf)
+		)
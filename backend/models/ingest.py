@@ -0,0 +1,31 @@
+from __future__ import annotations
+from typing import Any
+
+from backend.config.config import INGEST_MAX_TURNS, INGEST_MAX_TURN_CHARS
+
+
+class PayloadTooLarge(Exception):
+	"""请求体超出摄入上限。不继承 ValueError，pydantic 不会把它包装成 422，由 main 统一转为 413。"""
+
+	def __init__(self, detail: str):
+		super().__init__(detail)
+		self.detail = detail
+
+
+def keep_tail(value: Any, keep: int) -> Any:
+	"""
+	在逐轮校验之前截取对话尾部：超长历史只做一次长度检查，
+	被丢弃的轮次不再构造模型，单请求开销与历史长度无关。
+	"""
+	if isinstance(value, list):
+		if len(value) > INGEST_MAX_TURNS:
+			raise PayloadTooLarge(f"conversation has {len(value)} turns, limit is {INGEST_MAX_TURNS}")
+		if keep and len(value) > keep:
+			return value[-keep:]
+	return value
+
+
+def cap_text(value: Any, field: str) -> Any:
+	if isinstance(value, str) and len(value) > INGEST_MAX_TURN_CHARS:
+		raise PayloadTooLarge(f"{field} has {len(value)} chars, limit is {INGEST_MAX_TURN_CHARS}")
+	return value
@@ -0,0 +1,59 @@
+from __future__ import annotations
+from typing import Any, Mapping
+import json
+
+from pydantic import BaseModel
+
+# orjson 为可选依赖：安装后用于 dict/list 序列化，未安装时退回标准库
+try:
+	import orjson
+except ImportError:  # pragma: no cover
+	orjson = None
+
+
+def _default(obj: Any) -> Any:
+	if isinstance(obj, BaseModel):
+		return obj.model_dump(mode="json")
+	raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_bytes(obj: Any) -> bytes:
+	"""紧凑、不转义非 ASCII 的 JSON（UTF-8 字节）。"""
+	if isinstance(obj, BaseModel):
+		return obj.model_dump_json().encode("utf-8")
+	if orjson is not None:
+		return orjson.dumps(obj, default=_default)
+	return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def dumps(obj: Any) -> str:
+	"""紧凑、不转义非 ASCII 的 JSON 字符串，用于拼接 prompt。"""
+	if isinstance(obj, BaseModel):
+		return obj.model_dump_json()
+	if orjson is not None:
+		return orjson.dumps(obj, default=_default).decode("utf-8")
+	return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default)
+
+
+def dumps_object(mapping: Mapping[str, Any]) -> str:
+	"""
+	序列化顶层映射：值为 pydantic 模型时直接用其 model_dump_json（Rust 实现），
+	值为现成 JSON 片段（RawJSON）时原样拼入，避免先转 dict 再转字符串的中间拷贝。
+	"""
+	parts = []
+	for k, v in mapping.items():
+		if isinstance(v, RawJSON):
+			val = v.text
+		else:
+			val = dumps(v)
+		parts.append(dumps(str(k)) + ":" + val)
+	return "{" + ",".join(parts) + "}"
+
+
+class RawJSON:
+	"""已序列化好的 JSON 片段，供 dumps_object 原样拼接。"""
+
+	__slots__ = ("text",)
+
+	def __init__(self, text: str):
+		self.text = text
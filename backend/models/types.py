@@ -1,6 +1,9 @@
 from __future__ import annotations
 from typing import List, Optional, Literal, Dict, Any
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
+
+from backend.config.config import INGEST_SUGGEST_TURNS, INGEST_PEER_TURNS, INGEST_MBTI_TURNS, SESSION_KEEP_TURNS
+from backend.models.ingest import keep_tail, cap_text
 
 
 class ConversationTurn(BaseModel):
@@ -8,6 +11,11 @@ class ConversationTurn(BaseModel):
 	text: str
 	ts: Optional[float] = None
 
+	@field_validator("text", mode="before")
+	@classmethod
+	def _cap_text(cls, v):
+		return cap_text(v, "text")
+
 
 class Profile(BaseModel):
 	interests: Optional[List[str]] = None
@@ -41,6 +49,17 @@ class SuggestRequest(BaseModel):
 	memory: Optional[List[MemoryItem]] = None
 	personaWeights: Optional[PersonaWeights] = None
 	scenario: Optional["ScenarioContext"] = None
+	sessionId: Optional[str] = None  # 同会话内新的 typing/preSend 请求会取代旧请求
+
+	@field_validator("conversation", mode="before")
+	@classmethod
+	def _keep_tail(cls, v):
+		return keep_tail(v, INGEST_SUGGEST_TURNS)
+
+	@field_validator("draft", mode="before")
+	@classmethod
+	def _cap_draft(cls, v):
+		return cap_text(v, "draft")
 
 
 class Tip(BaseModel):
@@ -72,6 +91,7 @@ class SuggestResponse(BaseModel):
 	candidates: List[Candidate]
 	relationship: Relationship
 	safety: Safety
+	superseded: bool = False  # 已被同会话更新的请求取代，客户端应丢弃本结果
 
 
 class MBTIAnswer(BaseModel):
@@ -95,6 +115,11 @@ class MBTISubmitResponse(BaseModel):
 class MBTIInferRequest(BaseModel):
 	conversation: List[ConversationTurn]
 
+	@field_validator("conversation", mode="before")
+	@classmethod
+	def _keep_tail(cls, v):
+		return keep_tail(v, INGEST_MBTI_TURNS)
+
 
 class MBTIInferResponse(BaseModel):
 	mbtiGuess: str
@@ -124,6 +149,11 @@ class PeerReplyRequest(BaseModel):
 	personaWeights: Optional[PersonaWeights] = None  # 可选，用于影响对手理解用户偏好
 	scenario: Optional["ScenarioContext"] = None
 
+	@field_validator("conversation", mode="before")
+	@classmethod
+	def _keep_tail(cls, v):
+		return keep_tail(v, INGEST_PEER_TURNS)
+
 
 class PeerReplyItem(BaseModel):
 	id: str
@@ -166,3 +196,32 @@ class ScenarioInput(BaseModel):
 	userGoalHint: Optional[str] = None
 	mode: Optional[Literal["full", "goal_only"]] = "full"
 	opponentTraits: Optional[List[str]] = None
+
+
+class SessionEvent(BaseModel):
+	"""/ws/session 客户端事件；init 携带会话配置，其余事件只带增量。"""
+	type: Literal["init", "turn", "draft", "preSend", "peerReply", "ping"]
+	id: Optional[str] = None  # 客户端事件编号，服务端推送时原样回填到 replyTo
+	role: Optional[Literal["user", "peer"]] = None  # turn
+	text: Optional[str] = None  # turn / draft / preSend
+	# init
+	sessionId: Optional[str] = None  # 重连：上次 ready 下发的会话ID
+	resumeToken: Optional[str] = None  # 重连：上次 ready 下发的凭据，与 sessionId 一起校验
+	conversation: Optional[List[ConversationTurn]] = None
+	scenario: Optional[ScenarioContext] = None
+	opponent: Optional[OpponentProfile] = None
+	personaWeights: Optional[PersonaWeights] = None
+	userProfile: Optional[Profile] = None
+	peerProfile: Optional[Profile] = None
+	memory: Optional[List[MemoryItem]] = None
+	autoPeerReply: bool = False  # 用户发言后自动生成对方回复并记入会话
+
+	@field_validator("conversation", mode="before")
+	@classmethod
+	def _keep_tail(cls, v):
+		return keep_tail(v, SESSION_KEEP_TURNS)
+
+	@field_validator("text", mode="before")
+	@classmethod
+	def _cap_text(cls, v):
+		return cap_text(v, "text")
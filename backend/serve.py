@@ -0,0 +1,255 @@
+from __future__ import annotations
+import argparse
+import gc
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from backend.config.config import SERVE_WORKERS, SERVE_GRACEFUL_TIMEOUT_S, SERVE_READY_TIMEOUT_S
+
+# 生产运行入口：预加载 + fork 多个 worker 共享同一监听 socket。
+# - 主进程导入应用并预热只读产物（提示词模板、兜底话术库、场景模板、分词词典、打分权重表等），
+#   gc.freeze 后再 fork，worker 以写时复制方式共享，不重复启动耗时与内存；
+# - 上游 HTTP 客户端、sqlite 连接、后台线程在各 worker 内按需创建（见各模块的 register_at_fork）；
+# - 信号：TERM/INT 优雅退出；HUP 滚动重启（逐个起新 worker，就绪后再优雅停掉旧的）；
+#   worker 异常退出自动补齐。代码更新需要整体重启（worker 从主进程预加载的镜像 fork）。
+# 限制：同一 socket 上的连接在 worker 间随机分配，而 supersede_service 的取代/防抖票据、
+# WebSocket 会话状态与增量分析状态都是进程内的；在有会话亲和或共享存储之前默认只起 1 个 worker，
+# 多 worker 仅适合无状态请求为主的部署（启动时会告警）。
+# 用法：python -m backend.serve --host 0.0.0.0 --port 8000 [--workers 4]
+
+_log = logging.getLogger("soul.serve")
+
+
+def _preload():
+	"""主进程内导入应用并预热各模块的延迟加载项，返回 ASGI app。"""
+	from backend.main import app
+	from backend.services import keyword_service, scoring_service, safety_service
+
+	scoring_service.weights()  # 权重表首次访问时才读取文件
+	keyword_service.extract_keywords("周末一起去爬山吗")
+	safety_service.safety_check_text("预热")
+	# 启动期产生的对象移出 GC 跟踪：避免 worker 内的回收遍历触碰这些页面、破坏写时复制
+	gc.collect()
+	gc.freeze()
+	return app
+
+
+def _bind(host: str, port: int, backlog: int) -> socket.socket:
+	family = socket.AF_INET6 if ":" in host else socket.AF_INET
+	sock = socket.socket(family, socket.SOCK_STREAM)
+	sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	sock.bind((host, port))
+	sock.listen(backlog)
+	sock.set_inheritable(True)
+	return sock
+
+
+def _run_worker(app, sock: socket.socket, args: argparse.Namespace, ready_fd: int) -> int:
+	import uvicorn
+
+	# 信号交给 uvicorn 处理；退出后它会按原处理器重放捕获的信号，这里忽略以便正常收尾
+	for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+		signal.signal(sig, signal.SIG_IGN if sig != signal.SIGCHLD else signal.SIG_DFL)
+
+	class _Server(uvicorn.Server):
+		async def startup(self, sockets=None) -> None:
+			await super().startup(sockets=sockets)
+			if self.started:
+				os.write(ready_fd, b"1")
+			os.close(ready_fd)
+
+	config = uvicorn.Config(
+		app,
+		log_level=args.log_level,
+		proxy_headers=True,
+		forwarded_allow_ips=args.forwarded_allow_ips,
+		timeout_keep_alive=args.keep_alive,
+		timeout_graceful_shutdown=int(SERVE_GRACEFUL_TIMEOUT_S),
+	)
+	server = _Server(config)
+	server.run(sockets=[sock])
+	from backend.services import usage_service
+
+	usage_service.flush()
+	return 0 if server.started else 1
+
+
+class _Master:
+	def __init__(self, app, sock: socket.socket, args: argparse.Namespace):
+		self.app = app
+		self.sock = sock
+		self.args = args
+		self.workers: Dict[int, float] = {}  # pid -> 启动时间
+		self.retiring: set = set()  # 滚动重启中正在优雅退出的旧 worker
+		self.signal: Optional[int] = None
+		self.stopping = False
+
+	def _on_signal(self, sig: int, _frame) -> None:
+		self.signal = sig
+
+	def spawn(self) -> Optional[int]:
+		"""fork 一个 worker，等待其开始监听；超时或失败返回 None。"""
+		r, w = os.pipe()
+		pid = os.fork()
+		if pid == 0:
+			os.close(r)
+			code = 1
+			try:
+				code = _run_worker(self.app, self.sock, self.args, w)
+			except BaseException:
+				_log.exception("worker crashed")
+			finally:
+				os._exit(code)
+		os.close(w)
+		self.workers[pid] = time.monotonic()
+		try:
+			ready, _, _ = select.select([r], [], [], SERVE_READY_TIMEOUT_S)
+			ok = bool(ready) and os.read(r, 1) == b"1"
+		finally:
+			os.close(r)
+		if not ok:
+			_log.warning("worker %d failed to start", pid)
+			try:
+				os.kill(pid, signal.SIGKILL)
+			except ProcessLookupError:
+				pass
+			self._reap(pid, block=True)
+			return None
+		_log.info("worker %d ready", pid)
+		return pid
+
+	def _terminate(self, pid: int) -> None:
+		try:
+			os.kill(pid, signal.SIGTERM)
+		except ProcessLookupError:
+			pass
+
+	def _wait(self, pids: List[int], timeout: float) -> None:
+		deadline = time.monotonic() + timeout
+		pending = set(pids)
+		while pending and time.monotonic() < deadline:
+			for pid in list(pending):
+				if self._reap(pid, block=False):
+					pending.discard(pid)
+			time.sleep(0.05)
+		for pid in pending:
+			_log.warning("worker %d did not exit in time, killing", pid)
+			try:
+				os.kill(pid, signal.SIGKILL)
+			except ProcessLookupError:
+				pass
+			self._reap(pid, block=True)
+
+	def _reap(self, pid: int, block: bool) -> bool:
+		try:
+			done, _status = os.waitpid(pid, 0 if block else os.WNOHANG)
+		except ChildProcessError:
+			done = pid
+		if done == pid:
+			self.workers.pop(pid, None)
+			self.retiring.discard(pid)
+			return True
+		return False
+
+	def rolling_restart(self) -> None:
+		"""逐个替换：新 worker 就绪后才让旧 worker 优雅退出，任一时刻至少有 N 个进程在接收连接。"""
+		for old in list(self.workers):
+			if self.stopping or self.signal in (signal.SIGTERM, signal.SIGINT):
+				return
+			if old not in self.workers:
+				continue
+			if self.spawn() is None:
+				_log.warning("rolling restart aborted: new worker failed to start")
+				return
+			self.retiring.add(old)
+			self._terminate(old)
+			self._wait([old], SERVE_GRACEFUL_TIMEOUT_S + 5)
+		_log.info("rolling restart done")
+
+	def stop(self) -> None:
+		self.stopping = True
+		pids = list(self.workers)
+		for pid in pids:
+			self._terminate(pid)
+		self._wait(pids, SERVE_GRACEFUL_TIMEOUT_S + 5)
+
+	def _reap_exited(self) -> None:
+		while True:
+			try:
+				pid, status = os.waitpid(-1, os.WNOHANG)
+			except ChildProcessError:
+				return
+			if pid == 0:
+				return
+			started = self.workers.pop(pid, None)
+			if started is not None and pid not in self.retiring:
+				_log.warning("worker %d exited unexpectedly (status %d)", pid, status)
+				# 启动即崩溃时放慢补齐，避免 fork 风暴
+				if time.monotonic() - started < 1.0:
+					time.sleep(1.0)
+			self.retiring.discard(pid)
+
+	def run(self) -> int:
+		for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+			signal.signal(sig, self._on_signal)
+		if threading.active_count() > 1:
+			# 预加载阶段启动的线程不会被 fork 复制，其持有的锁在 worker 内可能永不释放
+			_log.warning("threads running before fork: %s", [t.name for t in threading.enumerate()])
+		for _ in range(self.args.workers):
+			self.spawn()
+		while True:
+			sig, self.signal = self.signal, None
+			if sig in (signal.SIGTERM, signal.SIGINT):
+				_log.info("shutting down %d workers", len(self.workers))
+				self.stop()
+				return 0
+			if sig == signal.SIGHUP:
+				_log.info("rolling restart of %d workers", len(self.workers))
+				self.rolling_restart()
+				continue
+			self._reap_exited()
+			while len(self.workers) - len(self.retiring) < self.args.workers and self.signal is None:
+				if self.spawn() is None:
+					time.sleep(1.0)
+					break
+			time.sleep(0.2)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+	ap = argparse.ArgumentParser(description="pre-fork multi-worker server")
+	ap.add_argument("--host", default="0.0.0.0")
+	ap.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+	ap.add_argument("--workers", type=int, default=max(1, SERVE_WORKERS))
+	ap.add_argument("--backlog", type=int, default=2048)
+	ap.add_argument("--keep-alive", type=int, default=5)
+	# 只信任这些代理给出的 X-Forwarded-For（限流按客户端地址计，信任任意来源会被伪造绕过）
+	ap.add_argument("--forwarded-allow-ips", default=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"))
+	ap.add_argument("--log-level", default="info")
+	args = ap.parse_args(argv)
+	logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s [%(process)d] %(name)s: %(message)s")
+
+	if args.workers > 1:
+		_log.warning(
+			"%d workers without session affinity: supersede/debounce, WebSocket resume and "
+			"incremental analytics are per-process and will miss requests routed to other workers",
+			args.workers,
+		)
+	t0 = time.perf_counter()
+	app = _preload()
+	sock = _bind(args.host, args.port, args.backlog)
+	_log.info(
+		"preloaded in %.2fs, listening on %s:%d with %d workers",
+		time.perf_counter() - t0, args.host, args.port, args.workers,
+	)
+	return _Master(app, sock, args).run()
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,308 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional, Tuple
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from backend.config.config import (
+	RATE_LIMIT_ENABLED, RATE_LIMITS, RATE_LIMIT_BACKEND, RATE_LIMIT_DB,
+	SHED_QUEUE_DEPTH, SHED_LATENCY_P95_MS, SHED_LATENCY_WINDOW_S, INGEST_MAX_BODY_BYTES,
+)
+from starlette.concurrency import run_in_threadpool
+from backend.clients.llm_scheduler import queue_depth
+from backend.services import metrics_service, usage_service
+
+# 准入控制：
+# 1) 按（客户端地址, 端点）的令牌桶限流，超限直接 429 + Retry-After，不进入业务逻辑；
+#    客户端地址取连接对端，不信任请求头（代理头由 uvicorn 按 FORWARDED_ALLOW_IPS 解析）；
+# 2) 过载保护：上游排队数或上游耗时 p95 超过阈值时，/api/suggest 降级为本地模板响应，
+#    其余会调用模型的端点快速 429。
+# 3) 请求体大小上限：声明长度超限直接 413；分块上传在上限内先读完再交给应用。
+# 令牌桶状态默认存放在本机 sqlite 文件中，同机多个 worker 共享同一份额度。
+
+# 端点 -> (桶容量, 每秒补充令牌数)
+_DEFAULT_LIMITS: Dict[str, Tuple[float, float]] = {
+	"suggest": (20, 4.0),
+	"peer_reply": (10, 1.0),
+	"scenario_analyze": (5, 0.2),
+	"mbti_infer": (3, 0.1),
+}
+
+_PATHS: Dict[str, str] = {
+	"/api/suggest": "suggest",
+	"/api/peer/reply": "peer_reply",
+	"/api/scenario/analyze": "scenario_analyze",
+	"/api/scenario/analyze/stream": "scenario_analyze",
+	"/api/mbti/infer-from-chat": "mbti_infer",
+}
+
+# 过载时可降级为本地响应（而非拒绝）的端点
+_DEGRADABLE = ("suggest",)
+
+_degraded: ContextVar[bool] = ContextVar("admission_degraded", default=False)
+
+
+def _load_limits() -> Dict[str, Tuple[float, float]]:
+	limits = dict(_DEFAULT_LIMITS)
+	if RATE_LIMITS:
+		try:
+			for k, v in json.loads(RATE_LIMITS).items():
+				limits[k] = (float(v[0]), float(v[1]))
+		except Exception:
+			pass
+	return limits
+
+
+_LIMITS = _load_limits()
+
+
+class _MemoryBuckets:
+	"""进程内令牌桶（单 worker 或测试用）。"""
+
+	_SWEEP_EVERY = 1000
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._buckets: Dict[str, Tuple[float, float]] = {}
+		self._ops = 0
+
+	def take(self, key: str, capacity: float, rate: float, now: float) -> float:
+		"""取一个令牌；成功返回 0，否则返回需要等待的秒数。"""
+		with self._lock:
+			self._ops += 1
+			if self._ops % self._SWEEP_EVERY == 0:
+				# 与 sqlite 后端一致：长时间未出现的客户端桶早已回满，直接删掉
+				cutoff = now - 3600
+				for k in [k for k, (_t, ts) in self._buckets.items() if ts < cutoff]:
+					del self._buckets[k]
+			tokens, ts = self._buckets.get(key, (capacity, now))
+			tokens = min(capacity, tokens + (now - ts) * rate)
+			if tokens >= 1:
+				self._buckets[key] = (tokens - 1, now)
+				return 0.0
+			self._buckets[key] = (tokens, now)
+			return (1 - tokens) / rate if rate > 0 else 60.0
+
+
+class _SqliteBuckets:
+	"""
+	sqlite 令牌桶：每次取令牌是一个 BEGIN IMMEDIATE 短事务，
+	同机多进程通过文件锁串行化；WAL 模式下读写互不阻塞。
+	"""
+
+	_SWEEP_EVERY = 1000
+
+	def __init__(self, path: str):
+		self._path = path
+		self._local = threading.local()
+		self._ops = 0
+		conn = self._conn()
+		conn.execute("PRAGMA journal_mode=WAL")
+		conn.execute(
+			"CREATE TABLE IF NOT EXISTS buckets (k TEXT PRIMARY KEY, tokens REAL NOT NULL, ts REAL NOT NULL)"
+		)
+
+	def _conn(self) -> sqlite3.Connection:
+		conn = getattr(self._local, "conn", None)
+		if conn is None:
+			conn = sqlite3.connect(self._path, timeout=1.0, isolation_level=None)
+			conn.execute("PRAGMA synchronous=OFF")
+			self._local.conn = conn
+		return conn
+
+	def take(self, key: str, capacity: float, rate: float, now: float) -> float:
+		conn = self._conn()
+		conn.execute("BEGIN IMMEDIATE")
+		try:
+			row = conn.execute("SELECT tokens, ts FROM buckets WHERE k = ?", (key,)).fetchone()
+			tokens, ts = row if row else (capacity, now)
+			tokens = min(capacity, tokens + max(0.0, now - ts) * rate)
+			wait = 0.0
+			if tokens >= 1:
+				tokens -= 1
+			else:
+				wait = (1 - tokens) / rate if rate > 0 else 60.0
+			conn.execute("INSERT OR REPLACE INTO buckets (k, tokens, ts) VALUES (?, ?, ?)", (key, tokens, now))
+			self._ops += 1
+			if self._ops % self._SWEEP_EVERY == 0:
+				# 长时间未出现的客户端桶早已回满，直接删掉
+				conn.execute("DELETE FROM buckets WHERE ts < ?", (now - 3600,))
+			conn.execute("COMMIT")
+		except Exception:
+			conn.execute("ROLLBACK")
+			raise
+		return wait
+
+
+def _make_store():
+	if RATE_LIMIT_BACKEND == "sqlite":
+		try:
+			return _SqliteBuckets(RATE_LIMIT_DB)
+		except Exception:
+			pass
+	return _MemoryBuckets()
+
+
+_store = _make_store() if RATE_LIMIT_ENABLED else None
+
+
+def _after_fork() -> None:
+	# 预fork部署：主进程打开的 sqlite 连接不能在 worker 内复用，按线程重新连接
+	if isinstance(_store, _SqliteBuckets):
+		_store._local = threading.local()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def rate_limit(client: str, endpoint: str) -> float:
+	"""返回 0 表示放行，否则为建议的 Retry-After（秒）。共享存储出错时放行。"""
+	if _store is None or endpoint not in _LIMITS:
+		return 0.0
+	capacity, rate = _LIMITS[endpoint]
+	try:
+		return _store.take(f"{endpoint}:{client}", capacity, rate, time.time())
+	except Exception:
+		return 0.0
+
+
+async def rate_limit_async(client: str, endpoint: str) -> float:
+	"""异步入口：sqlite 事务可能等待文件锁，放到线程池执行，不阻塞事件循环上的其他连接。"""
+	if isinstance(_store, _SqliteBuckets) and endpoint in _LIMITS:
+		return await run_in_threadpool(rate_limit, client, endpoint)
+	return rate_limit(client, endpoint)
+
+
+def overloaded() -> bool:
+	if SHED_QUEUE_DEPTH and queue_depth() >= SHED_QUEUE_DEPTH:
+		return True
+	# 只看最近 SHED_LATENCY_WINDOW_S 秒的样本：降级期间没有新的上游调用，旧样本过期后恢复放行
+	window = SHED_LATENCY_WINDOW_S
+	if SHED_LATENCY_P95_MS and metrics_service.sample_count("llm_latency_ms", max_age_s=window) >= 20:
+		return metrics_service.quantile("llm_latency_ms", 0.95, max_age_s=window) >= SHED_LATENCY_P95_MS
+	return False
+
+
+def degraded() -> bool:
+	"""当前请求是否已被准入层判定为降级（仅本地响应）。"""
+	return _degraded.get()
+
+
+@contextmanager
+def degraded_scope() -> Iterator[None]:
+	"""在当前上下文内将请求标记为降级（HTTP 中间件与 WebSocket 会话共用）。"""
+	token = _degraded.set(True)
+	try:
+		yield
+	finally:
+		_degraded.reset(token)
+
+
+def client_key(scope: Dict[str, Any]) -> str:
+	"""限流主体：连接对端地址。客户端可随意更换的请求头（会话/客户端ID）不参与，避免轮换绕过。"""
+	client = scope.get("client")
+	return client[0] if client else "anon"
+
+
+async def _too_large(send, detail: str) -> None:
+	metrics_service.incr("ingest_rejected:body_too_large")
+	body = json.dumps({"detail": detail}).encode("utf-8")
+	await send({
+		"type": "http.response.start",
+		"status": 413,
+		"headers": [(b"content-type", b"application/json")],
+	})
+	await send({"type": "http.response.body", "body": body})
+
+
+async def _read_limited(receive) -> Optional[bytes]:
+	"""未声明长度（分块上传）时先在上限内读完请求体；超限返回 None。"""
+	chunks = []
+	seen = 0
+	while True:
+		message = await receive()
+		if message["type"] != "http.request":
+			break
+		body = message.get("body", b"")
+		seen += len(body)
+		if seen > INGEST_MAX_BODY_BYTES:
+			return None
+		chunks.append(body)
+		if not message.get("more_body", False):
+			break
+	return b"".join(chunks)
+
+
+def _replay(body: bytes, receive):
+	sent = False
+
+	async def replay():
+		nonlocal sent
+		if not sent:
+			sent = True
+			return {"type": "http.request", "body": body, "more_body": False}
+		return await receive()
+
+	return replay
+
+
+async def _reject(send, endpoint: str, reason: str, retry_after: float) -> None:
+	metrics_service.incr(f"admission_rejected:{endpoint}:{reason}")
+	body = json.dumps({"detail": "too many requests", "reason": reason}).encode("utf-8")
+	await send({
+		"type": "http.response.start",
+		"status": 429,
+		"headers": [
+			(b"content-type", b"application/json"),
+			(b"retry-after", str(max(1, int(retry_after + 0.999))).encode("ascii")),
+		],
+	})
+	await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+	"""纯 ASGI 中间件：在解析请求体之前完成大小/限流/过载判断，拒绝路径不读取 body。"""
+
+	def __init__(self, app):
+		self.app = app
+
+	async def __call__(self, scope, receive, send):
+		if scope["type"] != "http" or scope.get("method") != "POST":
+			await self.app(scope, receive, send)
+			return
+		if INGEST_MAX_BODY_BYTES:
+			length = dict(scope.get("headers") or ()).get(b"content-length")
+			if length is not None:
+				if length.isdigit() and int(length) > INGEST_MAX_BODY_BYTES:
+					await _too_large(send, f"request body exceeds {INGEST_MAX_BODY_BYTES} bytes")
+					return
+			else:
+				body = await _read_limited(receive)
+				if body is None:
+					await _too_large(send, f"request body exceeds {INGEST_MAX_BODY_BYTES} bytes")
+					return
+				receive = _replay(body, receive)
+		endpoint = _PATHS.get(scope.get("path", ""))
+		if endpoint is None:
+			await self.app(scope, receive, send)
+			return
+		client = client_key(scope)
+		wait = await rate_limit_async(client, endpoint)
+		if wait > 0:
+			await _reject(send, endpoint, "rate_limited", wait)
+			return
+		# 用量与预算按客户端地址计入，不随客户端可任意更换的会话ID变化
+		with usage_service.subject_scope(client):
+			if overloaded():
+				if endpoint not in _DEGRADABLE:
+					await _reject(send, endpoint, "overloaded", 2.0)
+					return
+				metrics_service.incr(f"admission_degraded:{endpoint}")
+				with degraded_scope():
+					await self.app(scope, receive, send)
+				return
+			await self.app(scope, receive, send)
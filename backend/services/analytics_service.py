@@ -0,0 +1,228 @@
+from __future__ import annotations
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import re
+import sys
+import threading
+
+from backend.config.config import ANALYTICS_EWMA_ALPHA, ANALYTICS_MAX_SESSIONS
+from backend.services.keyword_service import extract_keywords, _trie_pattern
+
+# 情感词典：正负向与否定短语编译为单个正则（长词优先），一次扫描得到全部命中
+_POS_LEXICON = (
+	"喜欢", "开心", "有趣", "好玩", "期待", "不错", "赞", "哈哈", "嘿嘿", "嘻嘻", "太好了", "好呀", "好啊",
+	"可以呀", "没问题", "愿意", "感兴趣", "想去", "一起", "谢谢", "感谢", "辛苦", "厉害", "优秀", "棒",
+	"漂亮", "好看", "可爱", "温暖", "舒服", "放松", "满意", "高兴", "快乐", "幸福", "激动", "兴奋",
+	"惊喜", "佩服", "欣赏", "支持", "同意", "赞同", "认同", "对对", "确实", "真的吗", "好奇", "推荐",
+	"羡慕", "哇", "好耶", "期待一下", "约一下", "好的好的", "明白了", "受教",
+)
+_NEG_LEXICON = (
+	"无聊", "烦", "不想", "不愿", "生气", "晚回", "算了", "唉", "随便", "呵呵", "无所谓", "不感兴趣",
+	"没兴趣", "没空", "太忙", "再说吧", "改天吧", "以后再说", "不太方便", "不方便", "不行", "不要", "拒绝", "讨厌",
+	"累", "尴尬", "失望", "难过", "伤心", "郁闷", "焦虑", "紧张", "压力", "不舒服", "烦死", "够了",
+	"不用了", "不必", "没意思", "一般般", "还行吧", "哦哦", "好吧", "行吧", "抱歉", "对不起",
+	"不好意思", "奇怪", "离谱", "过分", "敷衍", "冷淡",
+)
+
+
+# 否定前缀：与正向词组成的短语（“不开心”“不太喜欢”）整体计为负向
+_NEGATORS = ("不", "没", "没有", "不太", "不是很", "不怎么", "不那么")
+
+
+def _polarity_table() -> Dict[str, int]:
+	table = {w: 1 for w in _POS_LEXICON}
+	for neg in _NEGATORS:
+		table.update({neg + w: -1 for w in _POS_LEXICON})
+	table.update({w: -1 for w in _NEG_LEXICON})
+	return table
+
+
+# 正负词典合并为一个前缀树正则：同一位置取最长词，“不感兴趣”命中后不会再单独命中其中的“感兴趣”
+_POLARITY = _polarity_table()
+_AFFECT_RE = re.compile(_trie_pattern(_POLARITY))
+
+
+def affect_score(text: str) -> float:
+	"""单条消息情感分（-1..1）：命中的不同正/负向词数之差，截断到 ±3 后归一。"""
+	if not text:
+		return 0.0
+	total = sum(_POLARITY[w] for w in set(_AFFECT_RE.findall(text)))
+	return max(-3, min(3, total)) / 3.0
+
+
+def _is_question(text: str) -> bool:
+	t = text.strip()
+	return t.endswith(("?", "？")) or t.endswith(("吗", "呢", "么"))
+
+
+def _fingerprint(role: Any, text: Any) -> int:
+	return hash((role, text))
+
+
+# 续接定位保留最近若干轮的指纹：客户端窗口与已处理历史的整段重叠都要一致，才认定为同一段对话
+_TAIL_TURNS = 8
+
+
+class SessionAnalytics:
+	"""
+	会话级增量分析状态：每追加一轮只处理该轮，请求期直接读取快照。
+	- affect：对方消息情感分的 EWMA（全量历史，近期权重更高）
+	- trend：快/慢两条 EWMA 之差
+	- 问答平衡：双方提问数（提示“回问一句”/“少问多分享”）
+	- 话题锚点：对方消息关键词的衰减计数（上一条无锚点时本地模板与续聊提示的兜底）
+	"""
+
+	__slots__ = (
+		"lock", "turns", "tail_fps", "affect", "affect_slow", "peer_turns",
+		"peer_questions", "user_questions",
+		"topics", "last_role", "last_text",
+	)
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self) -> None:
+		self.turns = 0
+		self.tail_fps: Tuple[int, ...] = ()
+		self.affect = 0.0
+		self.affect_slow = 0.0
+		self.peer_turns = 0
+		self.peer_questions = 0
+		self.user_questions = 0
+		self.topics: Counter = Counter()
+		self.last_role: Optional[str] = None
+		self.last_text = ""
+
+	def append(self, role: Optional[str], text: str) -> None:
+		text = text or ""
+		question = bool(text) and _is_question(text)
+		if role == "peer":
+			score = affect_score(text)
+			alpha = ANALYTICS_EWMA_ALPHA
+			self.affect = alpha * score + (1 - alpha) * self.affect
+			self.affect_slow = (alpha / 3) * score + (1 - alpha / 3) * self.affect_slow
+			self.peer_turns += 1
+			if question:
+				self.peer_questions += 1
+			# 旧话题按轮次衰减，新关键词加权
+			for k in list(self.topics):
+				self.topics[k] *= 0.8
+				if self.topics[k] < 0.05:
+					del self.topics[k]
+			for k in extract_keywords(text):
+				self.topics[k] += 1.0
+		elif role == "user" and question:
+			self.user_questions += 1
+		self.turns += 1
+		self.tail_fps = (self.tail_fps + (_fingerprint(role, text),))[-_TAIL_TURNS:]
+		self.last_role = role
+		self.last_text = text
+
+	def sync(self, conv: List[Dict[str, Any]]) -> None:
+		"""
+		对齐客户端上传的对话：在对话中从后往前寻找上次处理到的位置，只追加其后的新轮次；
+		对不上（如客户端改写了历史）则从头重建。对话可以只是尾部窗口。
+		"""
+		start = self._resume_index(conv)
+		if start is None:
+			self.reset()
+			start = 0
+		for t in conv[start:]:
+			self.append(t.get("role"), t.get("text") or "")
+
+	def _resume_index(self, conv: List[Dict[str, Any]]) -> Optional[int]:
+		"""
+		conv[:end] 的末尾须与已处理的最近轮次在整个重叠范围内逐轮一致（角色 + 内容），
+		且 end 不超过已处理的轮数（否则窗口里有从未处理过的更早轮次，说明历史被改写）。
+		从后往前取第一个满足的位置，即新增轮次最少的解释。
+		"""
+		tail = self.tail_fps
+		if not tail:
+			return None
+		fps = [_fingerprint(t.get("role"), t.get("text") or "") for t in conv]
+		for end in range(min(len(conv), self.turns), 0, -1):
+			m = min(end, len(tail))
+			if tuple(fps[end - m:end]) == tail[len(tail) - m:]:
+				return end
+		return None
+
+	def snapshot(self) -> Dict[str, Any]:
+		aff = self.affect
+		relationship_index = max(0, min(100, int(round(50 + aff * 30))))
+		diff = self.affect - self.affect_slow
+		if diff > 0.05:
+			trend = "up"
+		elif diff < -0.05:
+			trend = "down"
+		else:
+			trend = "up" if aff > 0.15 else ("down" if aff < -0.15 else "flat")
+		# 与问答统计使用同一判定：以问号或疑问语气词结尾
+		last_peer_is_question = self.last_role == "peer" and bool(self.last_text) and _is_question(self.last_text)
+		return {
+			"affect": aff,
+			"relationship_index": relationship_index,
+			"trend": trend,
+			"last_peer_is_question": last_peer_is_question,
+			"last_role": self.last_role,
+			"last_text": self.last_text,
+			"anchor_keywords": extract_keywords(self.last_text if self.last_role == "peer" else ""),
+			"topic_anchors": [k for k, _ in self.topics.most_common(5)],
+			"qa": {
+				"peer_questions": self.peer_questions,
+				"user_questions": self.user_questions,
+				"balance": (self.user_questions - self.peer_questions) / (self.turns + 1),
+			},
+			"turns": self.turns,
+		}
+
+
+_lock = threading.Lock()
+_SESSIONS: "OrderedDict[str, SessionAnalytics]" = OrderedDict()
+
+
+def _get_state(session_id: str) -> SessionAnalytics:
+	with _lock:
+		state = _SESSIONS.get(session_id)
+		if state is None:
+			state = SessionAnalytics()
+			_SESSIONS[session_id] = state
+			while len(_SESSIONS) > ANALYTICS_MAX_SESSIONS:
+				_SESSIONS.popitem(last=False)
+		else:
+			_SESSIONS.move_to_end(session_id)
+		return state
+
+
+def analyze(conv: List[Dict[str, Any]], session_id: Optional[str] = None) -> Dict[str, Any]:
+	"""有会话ID时增量更新并读取该会话状态；否则对本次对话一次性计算。"""
+	if not session_id:
+		state = SessionAnalytics()
+		state.sync(conv)
+		return state.snapshot()
+	state = _get_state(session_id)
+	with state.lock:
+		state.sync(conv)
+		return state.snapshot()
+
+
+def memory_stats() -> Dict[str, Any]:
+	"""调试用：增量分析状态的会话数与大致内存占用。"""
+	with _lock:
+		states = list(_SESSIONS.values())
+	total = 0
+	for st in states:
+		total += (
+			sys.getsizeof(st) + sys.getsizeof(st.topics) + sys.getsizeof(st.last_text)
+			+ sum(sys.getsizeof(k) for k in st.topics)
+		)
+	return {
+		"sessions": len(states),
+		"bytes": total,
+		"bytes_per_session": round(total / len(states)) if states else 0,
+	}
+
+
+def drop_session(session_id: str) -> None:
+	with _lock:
+		_SESSIONS.pop(session_id, None)
@@ -0,0 +1,75 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+import os
+import threading
+import tracemalloc
+
+from backend.services import analytics_service, session_service
+
+# 内存占用调试（GET /api/debug/memory）：用于按在线会话数评估实例规格。
+# - 进程 RSS、服务端会话/增量分析状态的占用估算与最大会话；
+# - tracemalloc 开启时（TRACEMALLOC_FRAMES，见 main.py）给出分配热点（按代码行或调用栈汇总）及相对上次报告的增长。
+
+_FILTERS = (
+	tracemalloc.Filter(False, tracemalloc.__file__),
+	tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+	tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+	tracemalloc.Filter(False, "<unknown>"),
+)
+
+_lock = threading.Lock()
+_last: Optional[tracemalloc.Snapshot] = None
+
+
+def _rss_bytes() -> Optional[int]:
+	try:
+		with open("/proc/self/statm") as f:
+			return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+	except (OSError, ValueError, IndexError):
+		return None
+
+
+def _stat(s: Any, key_type: str) -> Dict[str, Any]:
+	if key_type == "traceback":
+		site: Any = [str(f) for f in s.traceback]
+	else:
+		site = str(s.traceback[0])
+	out = {"site": site, "bytes": s.size, "count": s.count}
+	diff = getattr(s, "size_diff", None)
+	if diff is not None:
+		out["bytes_diff"] = diff
+		out["count_diff"] = s.count_diff
+	return out
+
+
+def _allocations(top: int, key_type: str) -> Dict[str, Any]:
+	global _last
+	if not tracemalloc.is_tracing():
+		return {"tracing": False}
+	current, peak = tracemalloc.get_traced_memory()
+	snap = tracemalloc.take_snapshot().filter_traces(_FILTERS)
+	with _lock:
+		prev, _last = _last, snap
+	stats: List[Any] = snap.statistics(key_type)
+	out: Dict[str, Any] = {
+		"tracing": True,
+		"frames": tracemalloc.get_traceback_limit(),
+		"traced_bytes": current,
+		"traced_peak_bytes": peak,
+		"top": [_stat(s, key_type) for s in stats[:top]],
+	}
+	if prev is not None:
+		# 相对上次报告增长最多的分配点：两次报告之间留存的对象，排查泄漏
+		out["growth"] = [_stat(s, key_type) for s in snap.compare_to(prev, key_type)[:top] if s.size_diff > 0]
+	return out
+
+
+def report(top: int = 20, sessions: int = 10, key_type: str = "lineno") -> Dict[str, Any]:
+	if key_type not in ("lineno", "filename", "traceback"):
+		key_type = "lineno"
+	return {
+		"rss_bytes": _rss_bytes(),
+		"sessions": session_service.memory_stats(sessions),
+		"analytics": analytics_service.memory_stats(),
+		"allocations": _allocations(top, key_type),
+	}
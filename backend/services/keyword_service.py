@@ -0,0 +1,242 @@
+from __future__ import annotations
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+import re
+import threading
+
+# 关键词/锚点抽取（不引入第三方分词库）：
+# - 一次正则扫描切出汉字片段与英文/数字串：标点、空白与“不出现在任何词典词里的单字虚词”都是断点，
+#   片段通常只有几个字，整段就是词典词时一次集合查找即可；
+# - 其余片段按词首两字索引做正向最大匹配，词典词之间的空隙在单字虚词处断开，作为未登录词候选；
+# - 过滤停用词后按 词频 × 词类权重 × 长度加成 排序，同分按首次出现位置。
+# 成本：这是抽取质量的改进，不是提速。真正的分词比旧的“替换分隔符 + split”贵一个数量级以上：
+# 未见过的长文本（片段缓存清空）约为旧实现的 15～50 倍耗时（462 字约 0.3ms 对 20µs，
+# 700 字无标点约 0.47ms 对 10µs），约为上一版逐字符前瞻正则的一半；
+# 重复的片段与整条文本（会话快照、场景目标）由缓存兜住。
+
+# 话题/内容词：覆盖闲聊、校园、职场、交友、商务等常见场景
+_LEXICON = (
+	# 兴趣与休闲
+	"户外", "徒步", "爬山", "登山", "露营", "骑行", "跑步", "健身", "瑜伽", "游泳", "篮球", "足球", "羽毛球",
+	"乒乓球", "网球", "滑雪", "冲浪", "潜水", "钓鱼", "摄影", "拍照", "绘画", "画画", "书法", "音乐", "唱歌",
+	"吉他", "钢琴", "乐队", "演唱会", "音乐节", "电影", "电视剧", "综艺", "动漫", "游戏", "桌游", "剧本杀",
+	"密室", "阅读", "看书", "小说", "写作", "旅行", "旅游", "自驾", "出国", "签证", "攻略", "美食", "做饭",
+	"烘焙", "咖啡", "奶茶", "火锅", "烧烤", "甜品", "餐厅", "探店", "宠物", "猫咪", "狗狗", "养猫", "养狗",
+	"逛街", "购物", "展览", "博物馆", "话剧", "脱口秀", "周末", "假期", "寒假", "暑假", "国庆", "春节", "节日",
+	# 校园
+	"社团", "招新", "学长", "学姐", "学弟", "学妹", "新生", "室友", "宿舍", "食堂", "图书馆", "操场", "课程",
+	"专业", "选课", "考试", "期末", "复习", "论文", "毕业", "考研", "保研", "留学", "实习", "奖学金", "竞赛",
+	"比赛", "志愿者", "学生会", "辅导员", "老师", "同学", "班级", "讲座", "答辩",
+	# 职场
+	"面试", "简历", "岗位", "职位", "公司", "团队", "部门", "同事", "领导", "老板", "项目", "经历", "经验",
+	"能力", "技能", "成果", "业绩", "目标", "绩效", "加班", "薪资", "待遇", "福利", "晋升", "跳槽", "离职",
+	"入职", "试用期", "转正", "培训", "会议", "汇报", "方案", "需求", "产品", "运营", "市场", "销售", "技术",
+	"开发", "设计", "数据", "分析", "管理", "沟通", "协作", "合作", "客户", "用户", "预算", "报价", "合同",
+	"交付", "演示", "试用", "成本", "效率", "痛点", "竞品", "行业", "资源", "计划", "进度", "风险", "问题",
+	"解决", "挑战", "优势", "不足", "职业", "规划", "发展", "创业",
+	# 交友与生活
+	"约会", "见面", "聊天", "朋友", "恋爱", "对象", "家人", "父母", "家乡", "老家", "城市", "租房", "通勤",
+	"搬家", "生活", "工作", "学习", "兴趣", "爱好", "性格", "习惯", "作息", "早起", "熬夜", "睡觉", "减肥",
+	"健康", "心情", "压力", "情绪", "故事", "经历", "回忆", "梦想", "计划", "推荐", "分享", "礼物", "生日",
+	"纪念日", "活动", "聚会", "聚餐", "约饭", "下次", "联系方式", "微信",
+)
+
+# 多字虚词/泛化词：参与分词（避免与相邻汉字粘成未登录词），但不作为关键词
+_STOPWORDS = (
+	"我们", "你们", "他们", "她们", "它们", "自己", "大家", "咱们", "什么", "怎么", "怎样", "为什么", "哪里",
+	"哪个", "哪些", "这个", "那个", "这些", "那些", "这样", "那样", "这里", "那里", "这边", "那边", "一下",
+	"一些", "一点", "一个", "一起", "一直", "一般", "一定", "可以", "可能", "应该", "需要", "觉得", "感觉",
+	"知道", "认为", "希望", "想要", "喜欢", "感兴趣", "时候", "现在", "今天", "明天", "昨天", "最近", "平时",
+	"已经", "还是", "就是", "因为", "所以", "但是", "不过", "如果", "然后", "而且", "或者", "虽然", "其实",
+	"真的", "确实", "当然", "比较", "非常", "特别", "有点", "有些", "没有", "不是", "不会", "不要", "没事",
+	"好的", "谢谢", "哈哈", "嗯嗯", "是的", "对的", "还有", "之前", "之后", "以后", "以前", "方面", "部分",
+	"东西", "事情", "情况", "时间", "地方", "看看", "说说", "聊聊", "试试", "一次", "一样", "怎么样",
+	"您好", "你好", "同学你好", "大概", "目前", "主要", "具体", "简单", "清晰", "自然", "轻松", "愉快",
+)
+
+# 单字虚词/代词/语气词：未登录词在这些字处断开，也不会被单独选为关键词
+_STOP_CHARS = (
+	"的了吗呢吧啊呀哦哇嘛么啦哈嗯喔噢唉诶"
+	"我你您他她它咱"
+	"是在有和与及或就也都很还又再才只把被给让对从向跟为于以到往"
+	"这那哪谁啥怎几多些个"
+	"不没别未非无"
+	"会能要想得地着过"
+)
+
+_DICT_WEIGHT = 1.0
+_OOV_WEIGHT = 0.6
+_ASCII_WEIGHT = 0.8
+_OOV_MAX_LEN = 4
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+	"""词表 -> 前缀树 -> 正则：子结点在前、结束符可选，贪婪匹配即最长词优先（情感词典也用它）。"""
+	trie: Dict[str, dict] = {}
+	for w in words:
+		node = trie
+		for ch in w:
+			node = node.setdefault(ch, {})
+		node[""] = {}
+
+	def build(node: Dict[str, dict]) -> str:
+		alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+		if not alts:
+			return ""
+		body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+		return f"(?:{body})?" if "" in node else body
+
+	return build(trie)
+
+
+class KeywordExtractor:
+	"""
+	编译后的抽取器：词典变化时整体重建并原子替换，读路径无锁。
+	片段的切分结果按片段缓存——聊天里的短语高度重复，长消息大多由已见过的片段组成。
+	"""
+
+	__slots__ = ("words", "stopwords", "_vocab", "_heads", "_stop_chars", "_frag_re", "_stop_split", "_runs")
+
+	_RUN_CACHE_SIZE = 65536
+
+	def __init__(self, words: Iterable[str], stopwords: Iterable[str], stop_chars: str):
+		self.words = frozenset(w for w in words if len(w) >= 2)
+		self.stopwords = frozenset(stopwords) | frozenset(stop_chars)
+		# 参与切分的词：内容词 + 多字虚词；按词首两字索引候选长度（长的在前）
+		self._vocab = self.words | frozenset(w for w in stopwords if len(w) >= 2)
+		heads: Dict[str, set] = {}
+		for w in self._vocab:
+			heads.setdefault(w[:2], set()).add(len(w))
+		self._heads = {h: tuple(sorted(ns, reverse=True)) for h, ns in heads.items()}
+		self._stop_chars = frozenset(stop_chars)
+		# 不出现在任何词典词里的单字虚词与汉字以外的字符一样是硬断点，由正则直接跳过
+		inner = set("".join(self._vocab))
+		breaks = re.escape("".join(sorted(c for c in stop_chars if c not in inner)))
+		self._frag_re = re.compile(f"[^\\x00-\\u4dff\\ua000-\\U0010ffff{breaks}]+|[A-Za-z][A-Za-z0-9+#]*")
+		self._stop_split = re.compile(f"[{re.escape(stop_chars)}]+")
+		self._runs: Dict[str, Tuple[Tuple[str, float], ...]] = {}
+
+	def _tokens(self, run: str) -> List[Tuple[str, str]]:
+		if run[0] < "\u4e00":
+			return [(run, "en")]
+		if run in self._vocab:
+			return [(run, "w")]
+		n = len(run)
+		if n == 1:
+			return [] if run in self._stop_chars else [(run, "oov")]
+		heads = self._heads
+		vocab = self._vocab
+		split = self._stop_split.split
+		out: List[Tuple[str, str]] = []
+		pos = i = 0
+		while i < n - 1:
+			lens = heads.get(run[i:i + 2])
+			if lens is None:
+				i += 1
+				continue
+			for k in lens:
+				word = run[i:i + k]
+				if word in vocab:
+					break
+			else:
+				i += 1
+				continue
+			# 词典词之间的空隙：在单字虚词处断开，其余为未登录词
+			if i > pos:
+				out.extend((g, "oov") for g in split(run[pos:i]) if g)
+			out.append((word, "w"))
+			i = pos = i + k
+		if pos < n:
+			out.extend((g, "oov") for g in split(run[pos:]) if g)
+		return out
+
+	def _score_run(self, run: str) -> Tuple[Tuple[str, float], ...]:
+		"""一个片段内可作关键词的词及其得分（已过滤停用词/过短的词），结果按片段缓存。"""
+		hits = []
+		for tok, kind in self._tokens(run):
+			if kind == "w":
+				if tok in self.stopwords:
+					continue
+				weight = _DICT_WEIGHT
+			elif kind == "oov":
+				if not 2 <= len(tok) <= _OOV_MAX_LEN:
+					continue
+				weight = _OOV_WEIGHT
+			else:
+				if len(tok) < 2:
+					continue
+				weight = _ASCII_WEIGHT
+			hits.append((tok, weight * (1 + 0.2 * (min(len(tok), 6) - 2))))
+		hits = tuple(hits)
+		if len(self._runs) >= self._RUN_CACHE_SIZE:
+			self._runs.clear()
+		self._runs[run] = hits
+		return hits
+
+	def segment(self, text: str) -> List[Tuple[str, str]]:
+		"""
+		切分为 (片段, 类别)：w 词典词（含多字虚词）/ en 英文数字串 / oov 未登录汉字串；
+		分隔符与单字虚词不输出，单个未登录字（如“去”）作为 oov 输出。
+		"""
+		out: List[Tuple[str, str]] = []
+		for run in self._frag_re.findall(text or ""):
+			out.extend(self._tokens(run))
+		return out
+
+	def extract(self, text: str, top_k: int = 5) -> List[str]:
+		"""按 词频 × 词类权重 × 长度加成 排序；字典保持插入顺序，同分即按首次出现位置。"""
+		if not text:
+			return []
+		runs = self._runs
+		scores: Dict[str, float] = {}
+		# 先按片段计数（C 实现），重复的片段只展开一次
+		for run, n in Counter(self._frag_re.findall(text)).items():
+			hits = runs.get(run)
+			if hits is None:
+				hits = self._score_run(run)
+			for tok, score in hits:
+				scores[tok] = scores.get(tok, 0.0) + score * n
+		return sorted(scores, key=scores.__getitem__, reverse=True)[:top_k]
+
+
+_lock = threading.Lock()
+_extra_words: set = set()
+_extractor = KeywordExtractor(_LEXICON, _STOPWORDS, _STOP_CHARS)
+
+
+def add_words(words: Iterable[str]) -> None:
+	"""追加领域词（如场景模板的锚点/对方关键词），重建抽取器并清空结果缓存。"""
+	global _extractor
+	new = {w.strip() for w in words if w and 2 <= len(w.strip()) <= 8}
+	with _lock:
+		if new <= _extra_words:
+			return
+		_extra_words.update(new)
+		_extractor = KeywordExtractor(_LEXICON + tuple(sorted(_extra_words)), _STOPWORDS, _STOP_CHARS)
+		_extract_cached.cache_clear()
+
+
+@lru_cache(maxsize=4096)
+def _extract_cached(text: str, top_k: int) -> Tuple[str, ...]:
+	return tuple(_extractor.extract(text, top_k))
+
+
+def extract_keywords(text: str, top_k: int = 5) -> list[str]:
+	"""
+	关键词抽取：词典最大匹配 + 未登录词候选，过滤停用词后按权重排序，取前 top_k 个。
+	同一文本（如会话快照中的上一条对方消息）重复抽取直接命中缓存。
+	"""
+	if not text:
+		return []
+	return list(_extract_cached(text, top_k))
+
+
+def extract_keywords_batch(texts: Iterable[Optional[str]], top_k: int = 5) -> List[List[str]]:
+	"""批量抽取：与逐条调用结果一致，共享同一编译后的抽取器与缓存。"""
+	return [extract_keywords(t or "", top_k) for t in texts]
+
+
+def segment(text: str) -> List[str]:
+	"""分词结果（调试/离线分析用），含单字未登录字；关键词候选的过滤见 extract。"""
+	return [tok for tok, _kind in _extractor.segment(text)]
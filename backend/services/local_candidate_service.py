@@ -0,0 +1,162 @@
+from __future__ import annotations
+from string import Formatter
+from typing import Any, Dict, List, Optional, Tuple
+
+# 本地候选引擎：不调用模型，按（场景领域, 情境）索引预编译的模板库，
+# 用上下文锚点填充后直接产出候选。用于 idle/firstEnter/postSend 等低价值事件，
+# 以及模型超时/限流时的兜底。
+# 开场方（startingParty）不参与索引：对方先开场的场景在会话为空时由 handle_suggest 直接提示等待，
+# 不会走到 opening；对方开场之后则与其他场景一样按 answer/probe 处理。
+
+# 情境（situation）：
+#   draft   已有草稿，做“增强与收束”
+#   answer  最近一条为对方提问，先答再问
+#   probe   最近一条为对方消息，承接推进
+#   self    最近一条为我方消息，自我补充 + 抛回对方
+#   opening 会话为空，开场
+
+# 领域别名：场景分析给出的 domain 是自由文本，按关键词归一
+_DOMAIN_ALIASES: List[Tuple[str, Tuple[str, ...]]] = [
+	("work", ("职场", "面试", "求职", "工作", "同事", "客户", "商务", "汇报")),
+	("campus", ("校园", "社团", "学校", "学长", "学姐", "学弟", "学妹", "同学", "招新")),
+	("dating", ("恋爱", "约会", "相亲", "交友", "暧昧", "脱单")),
+]
+
+_RAW_LIBRARY: Dict[Tuple[str, str], List[Dict[str, str]]] = {
+	("*", "draft"): [
+		{"id": "mirror", "text": "{draft} 想听听你的看法～", "why": "承接草稿并抛球", "risk": "low"},
+		{"id": "safe", "text": "我先说到这里，你这边怎么看？", "why": "稳妥推进", "risk": "low"},
+		{"id": "humor", "text": "这段我就不剧透啦，交给你来补完？😄", "why": "轻松化", "risk": "mid"},
+	],
+	("*", "answer"): [
+		{"id": "mirror", "text": "说到{anchor}，我这边还挺有体会的～如果你想我可以具体说说。", "why": "先回答再补充", "risk": "low"},
+		{"id": "safe", "text": "我的看法是这样……（简单两点）如果你也方便，想听听你的想法。", "why": "给出答案+轻抛球", "risk": "low"},
+		{"id": "humor", "text": "先交一份简短答卷，再抛个小问题：你会怎么选？", "why": "回答后轻松推进", "risk": "mid"},
+	],
+	("*", "probe"): [
+		{"id": "mirror", "text": "关于“{anchor}”，你更在意哪一部分？", "why": "承接其话题", "risk": "low"},
+		{"id": "safe", "text": "如果方便的话，能说说具体是怎么想的吗？", "why": "稳妥追问", "risk": "low"},
+		{"id": "humor", "text": "不如来个快问快答，我先抛一个：你会选A还是B？", "why": "轻松推进", "risk": "mid"},
+	],
+	("*", "self"): [
+		{"id": "mirror", "text": "主要是我这次在某一科状态更好～你最近有什么小高光？", "why": "自述+抛回", "risk": "low"},
+		{"id": "safe", "text": "我的部分先到这儿，你这边最近有什么想分享的吗？", "why": "稳妥转问", "risk": "low"},
+		{"id": "humor", "text": "给自己发一张小小“表扬券”，也想听听你的故事～", "why": "轻松转场", "risk": "mid"},
+	],
+	("*", "opening"): [
+		{"id": "mirror", "text": "周末一般怎么放松？我最近迷上了散步。", "why": "开启轻话题", "risk": "low"},
+		{"id": "safe", "text": "不急，我们可以从兴趣开始聊起～", "why": "稳妥开场", "risk": "low"},
+		{"id": "humor", "text": "发你一张“聊天启动券”，换你一个小分享？", "why": "幽默破冰", "risk": "mid"},
+	],
+	# 职场：语气更克制，少用表情
+	("work", "self"): [
+		{"id": "mirror", "text": "这是我目前的思路，关于{anchor}您看还有哪些需要补充？", "why": "自述+请对方补充", "risk": "low"},
+		{"id": "safe", "text": "我先汇报到这里，您这边有什么建议吗？", "why": "稳妥转问", "risk": "low"},
+		{"id": "humor", "text": "我的部分先交卷，等您批改～", "why": "轻松但得体", "risk": "mid"},
+	],
+	("work", "opening"): [
+		{"id": "mirror", "text": "您好，想就{goal}和您简单沟通一下，现在方便吗？", "why": "说明来意", "risk": "low"},
+		{"id": "safe", "text": "您好，我先简单介绍一下自己，再听听您的想法。", "why": "稳妥开场", "risk": "low"},
+		{"id": "humor", "text": "您好，占用您几分钟，保证简明扼要～", "why": "轻松开场", "risk": "mid"},
+	],
+	# 校园：以“我们/你们”区分身份，默认由用户发起招新/介绍
+	("campus", "opening"): [
+		{"id": "mirror", "text": "同学你好～想先了解一下我们最近的活动吗？", "why": "主动介绍", "risk": "low"},
+		{"id": "safe", "text": "你好呀，平时课余都喜欢做些什么？", "why": "从兴趣开场", "risk": "low"},
+		{"id": "humor", "text": "路过就是缘分，要不要听我用一分钟介绍一下？😄", "why": "幽默破冰", "risk": "mid"},
+	],
+	("campus", "self"): [
+		{"id": "mirror", "text": "大概就是这样～你对{anchor}这块有兴趣吗？", "why": "自述+抛回", "risk": "low"},
+		{"id": "safe", "text": "我先说这么多，你有什么想问的都可以问我。", "why": "稳妥转问", "risk": "low"},
+		{"id": "humor", "text": "广告时间结束，现在轮到你发言啦～", "why": "轻松转场", "risk": "mid"},
+	],
+	# 交友/约会：更重分享与共情
+	("dating", "opening"): [
+		{"id": "mirror", "text": "嗨～看到你也喜欢{anchor}，最近有什么推荐吗？", "why": "共同兴趣开场", "risk": "low"},
+		{"id": "safe", "text": "你好呀，今天过得怎么样？", "why": "稳妥开场", "risk": "low"},
+		{"id": "humor", "text": "先自我介绍：本人擅长聊天，偶尔冷场，请多包涵～", "why": "幽默破冰", "risk": "mid"},
+	],
+	("dating", "self"): [
+		{"id": "mirror", "text": "这就是我最近的小日常～你呢，有什么开心的事吗？", "why": "分享+抛回", "risk": "low"},
+		{"id": "safe", "text": "说了这么多我的事，也想多了解你一点。", "why": "表达兴趣", "risk": "low"},
+		{"id": "humor", "text": "我的故事先讲到这，下一集请你来主演～", "why": "轻松转场", "risk": "mid"},
+	],
+}
+
+
+class _CompiledTemplate:
+	"""模板预先拆分为（字面量, 字段名）片段，填充时只做拼接。"""
+
+	__slots__ = ("segments",)
+
+	def __init__(self, text: str):
+		self.segments: Tuple[Tuple[str, Optional[str]], ...] = tuple(
+			(literal, field) for literal, field, _spec, _conv in Formatter().parse(text)
+		)
+
+	def fill(self, slots: Dict[str, str]) -> str:
+		out: List[str] = []
+		for literal, field in self.segments:
+			out.append(literal)
+			if field is not None:
+				out.append(slots.get(field, ""))
+		return "".join(out)
+
+
+def _compile(raw: Dict[Tuple[str, str], List[Dict[str, str]]]) -> Dict[Tuple[str, str], List[Tuple[Dict[str, str], _CompiledTemplate]]]:
+	return {
+		key: [(item, _CompiledTemplate(item["text"])) for item in items]
+		for key, items in raw.items()
+	}
+
+
+_LIBRARY = _compile(_RAW_LIBRARY)
+
+
+def normalize_domain(domain: Optional[str]) -> str:
+	if not domain:
+		return "*"
+	for name, keys in _DOMAIN_ALIASES:
+		if domain == name or any(k in domain for k in keys):
+			return name
+	return "*"
+
+
+def _lookup(domain: str, situation: str) -> List[Tuple[Dict[str, str], _CompiledTemplate]]:
+	return _LIBRARY.get((domain, situation)) or _LIBRARY.get(("*", situation)) or _LIBRARY[("*", "opening")]
+
+
+def local_candidates(
+	conv: List[Dict[str, Any]],
+	draft: str,
+	reply_mode: str,
+	domain: Optional[str] = None,
+	anchors: Optional[List[str]] = None,
+	goal: Optional[str] = None,
+) -> List[Dict[str, str]]:
+	"""按情境选模板并填充锚点（关键词，不截取原句），返回与模型候选同结构的列表。"""
+	last_role = None
+	for t in reversed(conv):
+		if t.get("role") in ("user", "peer"):
+			last_role = t["role"]
+			break
+
+	if draft:
+		situation = "draft"
+	elif last_role == "peer":
+		situation = "answer" if reply_mode == "answer" else "probe"
+	elif last_role == "user":
+		situation = "self"
+	else:
+		situation = "opening"
+
+	slots = {
+		"draft": draft,
+		"anchor": next((a for a in (anchors or []) if a), "") or "这个话题",
+		"goal": goal or "这件事",
+	}
+	entry = _lookup(normalize_domain(domain), situation)
+	return [
+		{"id": item["id"], "text": tpl.fill(slots), "why": item["why"], "risk": item["risk"]}
+		for item, tpl in entry
+	]
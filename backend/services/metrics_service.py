@@ -0,0 +1,83 @@
+from __future__ import annotations
+from collections import defaultdict, deque
+from typing import Any, Callable, Deque, Dict, List, Tuple
+import threading
+import time
+
+# 进程内指标：计数器 + 滑动窗口分位数 + 外部提供者（如调度器状态），
+# 通过 GET /api/metrics 以 JSON 暴露。多 worker 时各进程独立统计。
+
+_WINDOW = 512
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_windows: Dict[str, Deque[Tuple[float, float]]] = {}  # 名称 -> (采样时刻, 值)
+_providers: Dict[str, Callable[[], Any]] = {}
+
+
+def incr(name: str, value: float = 1.0) -> None:
+	with _lock:
+		_counters[name] += value
+
+
+def observe(name: str, value: float) -> None:
+	with _lock:
+		win = _windows.get(name)
+		if win is None:
+			win = _windows[name] = deque(maxlen=_WINDOW)
+		win.append((time.monotonic(), float(value)))
+
+
+def _recent(name: str, max_age_s: float) -> List[float]:
+	"""（持锁调用）窗口内的样本值；max_age_s>0 时只取最近这段时间内的样本。"""
+	win = _windows.get(name)
+	if not win:
+		return []
+	if max_age_s <= 0:
+		return [v for _t, v in win]
+	cutoff = time.monotonic() - max_age_s
+	return [v for t, v in win if t >= cutoff]
+
+
+def quantile(name: str, q: float, default: float = 0.0, max_age_s: float = 0.0) -> float:
+	with _lock:
+		values = sorted(_recent(name, max_age_s))
+	if not values:
+		return default
+	return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def sample_count(name: str, max_age_s: float = 0.0) -> int:
+	with _lock:
+		if max_age_s <= 0:
+			win = _windows.get(name)
+			return len(win) if win else 0
+		return len(_recent(name, max_age_s))
+
+
+def register_provider(name: str, fn: Callable[[], Any]) -> None:
+	"""注册一个在 snapshot 时调用的状态提供者。"""
+	_providers[name] = fn
+
+
+def snapshot() -> Dict[str, Any]:
+	with _lock:
+		counters = dict(_counters)
+		windows = {k: sorted(v for _t, v in win) for k, win in _windows.items()}
+	summaries = {}
+	for k, v in windows.items():
+		if not v:
+			continue
+		summaries[k] = {
+			"n": len(v),
+			"p50": round(v[len(v) // 2], 2),
+			"p95": round(v[min(len(v) - 1, int(len(v) * 0.95))], 2),
+			"max": round(v[-1], 2),
+		}
+	out: Dict[str, Any] = {"counters": counters, "summaries": summaries}
+	for name, fn in list(_providers.items()):
+		try:
+			out[name] = fn()
+		except Exception as e:
+			out[name] = {"error": str(e)}
+	return out
@@ -1,22 +1,24 @@
 from __future__ import annotations
 from typing import Any, Dict, List
 
-from backend.clients.llm_client import chat_completion
-from backend.models.types import PeerReplyRequest, PeerReplyResponse
+from backend.clients.llm_client import stream_json_items, cascade
+from backend.clients.prompts import PEER_SYSTEM, PEER_USER, PEER_STYLE_DESC, PEER_TRAITS_STYLE
+from backend.services import trace_service
+from backend.services.safety_service import safety_check_text
+from backend.models.types import PeerReplyRequest, PeerReplyResponse, PeerReplyItem, OpponentProfile, UserGoal
 
 
 def generate_peer_reply(req: PeerReplyRequest) -> PeerReplyResponse:
-	conv_list = [t.model_dump() for t in req.conversation][-12:]
+	# 直接读取已校验的模型，只取最近12轮，不做 dict 拷贝
+	conv_list = req.conversation[-12:]
 	
 	# 格式化对话历史
 	conv_formatted = []
 	for turn in conv_list:
-		role = turn.get('role', 'unknown')
-		text = turn.get('text', '')
-		if role == 'user':
-			conv_formatted.append(f"我（用户）：{text}")
-		elif role == 'peer':
-			conv_formatted.append(f"你（{turn.get('roleTitle', '对方')}）：{text}")
+		if turn.role == 'user':
+			conv_formatted.append(f"我（用户）：{turn.text}")
+		elif turn.role == 'peer':
+			conv_formatted.append(f"你（对方）：{turn.text}")
 	conv_str = "\n".join(conv_formatted) if conv_formatted else "（无对话历史）"
 	style = (req.opponent.style if req.opponent and req.opponent.style else "自然").strip()
 	hint = (req.opponent.persona_hint if req.opponent and req.opponent.persona_hint else "").strip()
@@ -28,98 +30,81 @@ def generate_peer_reply(req: PeerReplyRequest) -> PeerReplyResponse:
 	scn_desc = ""
 	if req.scenario:
 		try:
-			scn = req.scenario.model_dump()
-			oppo = scn.get("opponent") or {}
-			ug = scn.get("userGoal") or {}
-			if oppo.get("style"):
-				style = str(oppo.get("style")).strip() or style
+			scn = req.scenario
+			oppo = scn.opponent or OpponentProfile(style=None)
+			ug = scn.userGoal or UserGoal()
+			if oppo.style:
+				style = str(oppo.style).strip() or style
 			scn_desc = (
-				f"场景：{scn.get('scenario') or ''}；领域：{oppo.get('domain') or domain}；"
-				f"对方：{oppo.get('roleTitle') or role_title}，风格：{oppo.get('style') or style}，语气：{oppo.get('tone') or tone}，特征：{','.join(oppo.get('traits') or traits)}；"
-				f"我的目标：{ug.get('goal') or ''}"
+				f"场景：{scn.scenario or ''}；领域：{oppo.domain or domain}；"
+				f"对方：{oppo.roleTitle or role_title}，风格：{oppo.style or style}，语气：{oppo.tone or tone}，特征：{','.join(oppo.traits or traits)}；"
+				f"我的目标：{ug.goal or ''}"
 			)
 		except Exception:
 			scn_desc = ""
 
-	sys = (
-		"你是一位中文虚拟聊天对象，目标是自然地与对方交流。"
-		"请根据你在场景中的身份和立场，使用符合该角色的语气、称谓和行为方式。"
-	)
-	style_map = {
-		"自然": "语气自然、不做作，表达清楚即可。",
-		"活泼": "语气轻快，偶尔用表情或拟声，加强互动感，但不过度。",
-		"理性": "语气沉稳偏理性，简洁、有逻辑，适度反问推进话题。",
-		"温和": "语气温柔与支持，给对方积极反馈与简短共情。",
-		"专业": "语气专业、信息密度较高，但不说教，注意浅显表达。",
-		"俏皮": "语气俏皮幽默，避免讽刺与刻板印象，轻松而不失礼貌。",
-		"克制": "语气简洁克制，不热情但不冷漠，回应在点上。",
-	}
 	# 优先使用 traits 作为对方形象关键词；若存在，则以其为准
 	if traits:
-		style_desc = (
-			f"请参考对方形象关键词：{'、'.join([str(t) for t in traits if t])}。"
-			"优先依据这些关键词调整语气、关注点与说话方式；若与固定风格冲突，以关键词为准。"
-		)
+		style_desc = PEER_TRAITS_STYLE.render(traits='、'.join([str(t) for t in traits if t]))
 	else:
-		style_desc = style_map.get(style, style_map["自然"])
+		style_desc = PEER_STYLE_DESC.get(style, PEER_STYLE_DESC["自然"])
 	persona_hint = f"对手设定：{hint}。" if hint else ""
 	role_hint = f"你的角色：{role_title}" if role_title else "你的角色：对话对象"
 	# 获取最后一句用户说的话（如果存在）
 	last_user_msg = ""
 	if conv_list:
 		for turn in reversed(conv_list):
-			if turn.get('role') == 'user':
-				last_user_msg = turn.get('text', '')
+			if turn.role == 'user':
+				last_user_msg = turn.text
 				break
 	
-	json_format = '[{"id":"pos","text":"...","tone":"positive"},{"id":"neut","text":"...","tone":"neutral"},{"id":"neg","text":"...","tone":"negative"}]'
 	scenario_line = f"场景设定：{scn_desc}\n" if scn_desc else ""
 	last_msg = last_user_msg if last_user_msg else "（无）"
 
-	usr = (
-		f"请扮演与我聊天的对象，风格：{style}（{style_desc}）。{persona_hint}\n"
-		f"{role_hint}\n\n"
-		f"{scenario_line}"
-		"\n【对话历史】\n"
-		f"{conv_str}\n\n"
-		"【回复要求】\n"
-		f"对方（用户）最后一句话是：{last_msg}\n"
-		"你必须针对这句话给出直接、相关的回复。\n\n"
-		"重要规则：\n"
-		"1. 中文输出，每条不超过2句\n"
-		"2. 不要重复问已经回答过的问题（如果对方已经解释了某事，不要再问）\n"
-		"3. 如果对方提出邀请或问你是否有兴趣，应该回应是/否，而不是反问\n"
-		f"4. 理解你的身份定位：作为{role_title}，应结合场景和对话历史决定合适的主动或被动程度\n"
-		f"5. 场景逻辑：作为{role_title}，不要说不符合身份的话（如学弟不会说'我们社团'，应该说'你们社团'）\n\n"
-		"请以 JSON 数组返回 3 条不同态度的回复（积极/中立/委婉拒绝）。\n"
-		f"格式：{json_format}\n"
-		"只输出 JSON 数组，不要任何解释文字。"
+	sys = PEER_SYSTEM.render()
+	usr = PEER_USER.render(
+		style=style,
+		style_desc=style_desc,
+		persona_hint=persona_hint,
+		role_hint=role_hint,
+		scenario_line=scenario_line,
+		conv_str=conv_str,
+		last_msg=last_msg,
 	)
 
-	try:
-		raw = chat_completion(
+	def _attempt(model):
+		# 恰好需要3条：流式解析，凑够即关闭上游
+		return stream_json_items(
 			[{"role": "system", "content": sys}, {"role": "user", "content": usr}],
+			need=3,
+			accept=lambda it: bool(it.get("text")),
 			max_tokens=300,
 			temperature=0.8,
-		).strip()
+			call_site="generate_peer_reply",
+			model=model,
+		)
+
+	def _valid(result) -> bool:
+		items, _raw = result
+		return len(items) >= 3 and not any(safety_check_text(str(it.get("text")))["blocked"] for it in items)
+
+	try:
+		# 小模型优先，条数不足或未过安全审校时升级到默认模型
+		data, raw = cascade("generate_peer_reply", _attempt, _valid)
+		raw = raw.strip()
 	except Exception:
-		raw = ""
+		data, raw = [], ""
 
-	from backend.clients.llm_client import _safe_json_parse
-	from backend.models.types import PeerReplyItem
-	
-	data = _safe_json_parse(raw) or []
 	replies = []
-	if isinstance(data, list):
-		for item in data[:3]:
-			if isinstance(item, dict) and item.get("text"):
-				replies.append({
-					"id": item.get("id", "alt"),
-					"text": str(item.get("text")),
-					"tone": item.get("tone"),
-					"why": item.get("why")
-				})
+	for item in data[:3]:
+		replies.append({
+			"id": item.get("id", "alt"),
+			"text": str(item.get("text")),
+			"tone": item.get("tone"),
+			"why": item.get("why")
+		})
 	
+	trace_service.record("replies", replies)
 	if not replies:
 		# fallback
 		if raw and isinstance(raw, str):
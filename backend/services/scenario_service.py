@@ -1,8 +1,13 @@
 from __future__ import annotations
-from typing import Any, Dict, Optional, List
+from typing import Any, Callable, Dict, Iterator, Optional, List, Tuple
+import contextvars
+import queue
+import threading
 
 from backend.models.types import ScenarioInput, ScenarioContext, OpponentProfile, UserGoal, ScenarioFlow
+from backend.models.serialization import dumps_bytes
 from backend.clients.llm_client import analyze_scenario_llm
+from backend.services import scenario_template_service, trace_service
 
 
 def _to_opponent(data: Dict[str, Any]) -> OpponentProfile:
@@ -25,7 +30,88 @@ def _to_user_goal(data: Dict[str, Any]) -> UserGoal:
 	)
 
 
-def analyze_scenario(req: ScenarioInput) -> ScenarioContext:
+def analyze_scenario(req: ScenarioInput, on_reasoning: Optional[Callable[[str], None]] = None) -> ScenarioContext:
+	"""
+	先查缓存：相同请求直接返回；同一模板/场景已有完整分析时只局部重算变化的字段，
+	goal_only 请求无变化时零模型调用。都没有才走完整的模型分析。
+	on_reasoning：完整分析开启了思考模式时接收思考增量。
+	"""
+	base = scenario_template_service.lookup_base(req)
+	ctx = scenario_template_service.lookup_exact(req, base is not None)
+	if ctx is not None:
+		return ctx
+	if base is not None:
+		ctx, complete = _derive_from_base(req, base)
+	else:
+		ctx, complete = _analyze_with_llm(req, on_reasoning)
+	# 模型失败/输出不完整时的兜底结果只返回本次，不写缓存，更不能成为后续请求的基底
+	if complete:
+		scenario_template_service.remember(req, ctx, base is not None)
+	return ctx
+
+
+def _derive_from_base(req: ScenarioInput, base: scenario_template_service.Base) -> Tuple[ScenarioContext, bool]:
+	"""返回（上下文, 是否完整）：局部重算的模型调用失败而沿用旧值/提示时视为不完整。"""
+	ctx = base.context.model_copy(deep=True)
+	traits = tuple(t for t in (req.opponentTraits or ()) if t)
+	goal_hint = (req.userGoalHint or "").strip()
+	traits_changed = bool(traits) and traits != base.traits
+	goal_changed = bool(goal_hint) and goal_hint != base.goal_hint
+	if not (traits_changed or goal_changed):
+		return ctx, True
+	complete = True
+
+	oppo = ctx.opponent or OpponentProfile(style=None)
+	payload: Dict[str, Any] = {
+		"scenarioText": ctx.scenario,
+		"opponentHint": oppo.roleTitle,
+		"userGoalHint": goal_hint or None,
+		"opponentTraits": list(traits or base.traits) or None,
+	}
+	if traits_changed:
+		oppo.traits = list(traits)
+		if (req.mode or "full") == "full":
+			# 只重算对方的称谓/风格/语气；失败时保留原值
+			try:
+				patch = analyze_scenario_llm({**payload, "mode": "opponent_patch"}).get("opponent") or {}
+			except Exception:
+				patch = {}
+			if not (isinstance(patch, dict) and patch):
+				complete = False
+			for key in ("roleTitle", "style", "tone"):
+				if isinstance(patch, dict) and patch.get(key):
+					setattr(oppo, key, patch[key])
+		ctx.opponent = oppo
+
+	# 对方形象或目标提示变化都会影响目标：用 goal_only 小请求只重算 goal/reason
+	try:
+		ug = analyze_scenario_llm({**payload, "mode": "goal_only"}).get("userGoal") or {}
+	except Exception:
+		ug = {}
+	if isinstance(ug, dict) and ug.get("goal"):
+		goal = ctx.userGoal or UserGoal()
+		goal.goal = ug["goal"]
+		goal.reason = ug.get("reason") or goal.reason
+		ctx.userGoal = goal
+	else:
+		complete = False
+		if goal_changed:
+			ctx.userGoal = (ctx.userGoal or UserGoal()).model_copy(update={"goal": goal_hint})
+	return ctx, complete
+
+
+def _complete(data: Dict[str, Any], mode: str) -> bool:
+	"""模型输出是否满足该模式的要求（与 analyze_scenario_llm 的级联校验一致）。"""
+	if mode == "goal_only":
+		return isinstance(data.get("userGoal"), dict) and bool(data["userGoal"].get("goal"))
+	return bool(data.get("opponent")) and bool(data.get("userGoal"))
+
+
+def _analyze_with_llm(
+	req: ScenarioInput,
+	on_reasoning: Optional[Callable[[str], None]] = None,
+) -> Tuple[ScenarioContext, bool]:
+	"""返回（上下文, 是否完整）；模型失败或输出缺字段时按请求提示兜底，并标记为不完整。"""
 	payload: Dict[str, Any] = {
 		"templateId": req.templateId,
 		"scenarioText": req.scenarioText,
@@ -34,9 +120,10 @@ def analyze_scenario(req: ScenarioInput) -> ScenarioContext:
 		"mode": req.mode or "full",
 		"opponentTraits": req.opponentTraits or None,
 	}
-	data = analyze_scenario_llm(payload) or {}
+	data = analyze_scenario_llm(payload, on_reasoning=on_reasoning) or {}
 	if not isinstance(data, dict):
 		data = {}
+	complete = _complete(data, payload["mode"])
 
 	scn_text = (data.get("scenario") or req.scenarioText or "")
 	oppo = data.get("opponent") or {}
@@ -58,7 +145,7 @@ def analyze_scenario(req: ScenarioInput) -> ScenarioContext:
 			startingParty=flow_data.get("startingParty") or "either",
 			openingHints=flow_data.get("openingHints") if isinstance(flow_data.get("openingHints"), list) else None
 		)
-	return ScenarioContext(
+	ctx = ScenarioContext(
 		scenario=(scn_text or req.scenarioText or None),
 		opponent=_to_opponent(oppo) if oppo else None,
 		userGoal=_to_user_goal(ug),
@@ -66,3 +153,35 @@ def analyze_scenario(req: ScenarioInput) -> ScenarioContext:
 		anchors=anchors if isinstance(anchors, list) else None,
 		flow=flow_obj
 	)
+	return ctx, complete
+
+
+_DONE = object()
+
+
+def analyze_scenario_stream(req: ScenarioInput) -> Iterator[bytes]:
+	"""
+	NDJSON 流：思考增量逐行推送 {"type":"reasoning","text":...}，
+	最后一行为 {"type":"result","data":ScenarioContext}，失败时为 {"type":"error","reason":...}。
+	命中缓存、局部重算或未开启思考时只有结果一行。
+	"""
+	events: "queue.Queue[Any]" = queue.Queue()
+
+	def run() -> None:
+		try:
+			with trace_service.trace_request("scenario_analyze_stream", req):
+				ctx = analyze_scenario(req, on_reasoning=lambda text: events.put({"type": "reasoning", "text": text}))
+				trace_service.set_result(ctx)
+			events.put({"type": "result", "data": ctx})
+		except Exception as e:
+			events.put({"type": "error", "reason": type(e).__name__})
+		finally:
+			events.put(_DONE)
+
+	# 分析在独立线程中进行（沿用当前上下文），这里只负责按顺序写出事件
+	threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True).start()
+	while True:
+		item = events.get()
+		if item is _DONE:
+			return
+		yield dumps_bytes(item) + b"\n"
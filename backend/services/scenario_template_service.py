@@ -0,0 +1,108 @@
+from __future__ import annotations
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Tuple
+import json
+import threading
+
+from backend.config.config import SCENARIO_TEMPLATES_FILE, SCENARIO_CACHE_SIZE
+from backend.models.types import ScenarioInput, ScenarioContext
+from backend.services import keyword_service
+
+# 场景模板注册表 + 完整分析缓存：
+# - 标准模板（templateId）的 ScenarioContext 预先写在 scenario_templates.json，直接命中，不调用模型；
+# - 自由文本场景的完整分析结果按（场景文本, 对方提示）缓存，之后的 goal_only 请求直接复用；
+# - 命中时记录当时的对方关键词与目标提示，调用方据此判断哪些字段需要局部重算。
+
+
+class Base(NamedTuple):
+	context: ScenarioContext
+	traits: Tuple[str, ...]  # 生成该上下文时的对方形象关键词
+	goal_hint: str  # 生成该上下文时的目标提示
+
+
+def _load_templates(path: str) -> Dict[str, Base]:
+	p = Path(path)
+	if not p.exists():
+		return {}
+	try:
+		raw = json.loads(p.read_text(encoding="utf-8"))
+	except Exception:
+		return {}
+	out: Dict[str, Base] = {}
+	for tid, data in raw.items():
+		try:
+			ctx = ScenarioContext.model_validate(data)
+		except Exception:
+			continue
+		traits = tuple(ctx.opponent.traits or ()) if ctx.opponent else ()
+		out[tid] = Base(ctx, traits, "")
+	return out
+
+
+_TEMPLATES = _load_templates(SCENARIO_TEMPLATES_FILE)
+# 模板的锚点与对方关键词加入分词词典，保证场景关键词能被完整切出
+keyword_service.add_words(
+	w for b in _TEMPLATES.values() for w in (*(b.context.anchors or ()), *b.traits)
+)
+
+_lock = threading.Lock()
+_bases: "OrderedDict[Tuple[str, ...], Base]" = OrderedDict()
+_exact: "OrderedDict[Tuple, ScenarioContext]" = OrderedDict()
+
+
+def template_ids() -> Tuple[str, ...]:
+	return tuple(_TEMPLATES)
+
+
+def _base_key(req: ScenarioInput) -> Tuple[str, ...]:
+	if req.templateId and req.templateId in _TEMPLATES:
+		return ("tpl", req.templateId)
+	return ("text", (req.scenarioText or "").strip(), (req.opponentHint or "").strip())
+
+
+def _exact_key(req: ScenarioInput, has_base: bool) -> Tuple:
+	# has_base 参与键：之后出现完整分析时，不再复用此前无基底时的 goal_only 结果
+	return (
+		_base_key(req), req.mode or "full", has_base,
+		tuple(req.opponentTraits or ()), (req.userGoalHint or "").strip(),
+	)
+
+
+def _put(cache: OrderedDict, key, value) -> None:
+	cache[key] = value
+	cache.move_to_end(key)
+	while len(cache) > SCENARIO_CACHE_SIZE:
+		cache.popitem(last=False)
+
+
+def lookup_exact(req: ScenarioInput, has_base: bool) -> Optional[ScenarioContext]:
+	"""完全相同的请求（含模式、关键词、目标提示）之前已算过时直接返回。"""
+	key = _exact_key(req, has_base)
+	with _lock:
+		ctx = _exact.get(key)
+		if ctx is not None:
+			_exact.move_to_end(key)
+		return ctx
+
+
+def lookup_base(req: ScenarioInput) -> Optional[Base]:
+	"""同一模板/场景已有完整分析时返回它，供 goal_only 与局部重算复用。"""
+	if req.templateId and req.templateId in _TEMPLATES:
+		return _TEMPLATES[req.templateId]
+	if not (req.scenarioText or "").strip():
+		return None
+	with _lock:
+		return _bases.get(_base_key(req))
+
+
+def remember(req: ScenarioInput, ctx: ScenarioContext, has_base: bool) -> None:
+	with _lock:
+		_put(_exact, _exact_key(req, has_base), ctx)
+		# 只有完整分析（含对方形象）可以作为后续请求的基底；模板本身不写入
+		if (
+			(req.mode or "full") == "full" and ctx.opponent is not None
+			and _base_key(req)[0] == "text" and (req.scenarioText or "").strip()
+		):
+			traits = tuple(req.opponentTraits or ()) or (tuple(ctx.opponent.traits or ()) if ctx.opponent else ())
+			_put(_bases, _base_key(req), Base(ctx, traits, (req.userGoalHint or "").strip()))
@@ -0,0 +1,192 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+import json
+import os
+import threading
+import time
+
+from backend.config.config import SCORING_WEIGHTS_FILE, SCORING_RELOAD_INTERVAL_S
+
+# 候选打分引擎：
+# - 权重表来自 JSON 文件（SCORING_WEIGHTS_FILE），按修改时间热加载，无需重启；
+# - 每条候选先算出触发的特征集合（位掩码），同一权重表下相同组合的总分与特征贡献只算一次并缓存，
+#   逐条打分只剩几次判断和一次字典查找（关键词仍逐个子串查找：列表很短，比正则快）；
+# - 每条候选返回总分与各特征贡献，写入追踪，供离线调参（replay_traces --weights）。
+
+# 文件缺失或字段不全时的内置默认值
+_DEFAULT_WEIGHTS: Dict[str, float] = {
+	"base": 0.5,
+	"answer_no_question": 0.12,  # 对方刚提问：回答优先，减少继续发问
+	"answer_one_question": 0.02,
+	"answer_multi_question": -0.08,
+	"probe_question": 0.1,  # 非回答场景：带问题促进互动
+	"answer_anchor_hit": 0.15,  # 回答承接了对方话题锚点
+	"answer_anchor_miss": -0.12,
+	"probe_anchor_hit": 0.06,
+	"scenario_hit": 0.06,  # 命中场景关键词
+	"concise": 0.05,
+	"low_risk": 0.08,
+	"negative_humor": -0.05,  # 负面情绪时降低幽默权重
+}
+_DEFAULT_THRESHOLDS: Dict[str, float] = {
+	"concise_max_chars": 40,
+	"negative_affect": -0.2,
+}
+
+
+class Scored(NamedTuple):
+	score: float
+	features: Dict[str, float]  # 特征名 -> 本条候选上的加减分（未触发的特征不出现）；多条候选共享，只读
+
+
+class WeightTable(NamedTuple):
+	version: str
+	weights: Dict[str, float]
+	thresholds: Dict[str, float]
+	combos: Dict[int, Scored]  # 特征位掩码 -> 打分结果（按需填充）
+
+
+_FEATURES: Tuple[str, ...] = tuple(k for k in _DEFAULT_WEIGHTS if k != "base")
+_BIT = {name: 1 << i for i, name in enumerate(_FEATURES)}
+
+
+def load_weights(path: str) -> WeightTable:
+	"""读取权重表文件；未给出的权重/阈值取内置默认值。文件不可读时抛出异常。"""
+	raw = json.loads(Path(path).read_text(encoding="utf-8"))
+	weights = dict(_DEFAULT_WEIGHTS)
+	weights.update({k: float(v) for k, v in (raw.get("weights") or {}).items()})
+	thresholds = dict(_DEFAULT_THRESHOLDS)
+	thresholds.update({k: float(v) for k, v in (raw.get("thresholds") or {}).items()})
+	return WeightTable(str(raw.get("version") or "file"), weights, thresholds, {})
+
+
+_BUILTIN = WeightTable("builtin", dict(_DEFAULT_WEIGHTS), dict(_DEFAULT_THRESHOLDS), {})
+
+
+class _WeightsFile:
+	"""热加载：最多每 SCORING_RELOAD_INTERVAL_S 秒 stat 一次，修改时间变化才重新解析；解析失败保留旧表。"""
+
+	def __init__(self, path: str):
+		self._path = path
+		self._lock = threading.Lock()
+		self._mtime: Optional[int] = None
+		self._checked = float("-inf")
+		self._table = _BUILTIN
+
+	def get(self) -> WeightTable:
+		now = time.monotonic()
+		if now - self._checked < SCORING_RELOAD_INTERVAL_S:
+			return self._table
+		with self._lock:
+			if now - self._checked < SCORING_RELOAD_INTERVAL_S:
+				return self._table
+			self._checked = now
+			try:
+				mtime = os.stat(self._path).st_mtime_ns
+			except OSError:
+				return self._table
+			if mtime != self._mtime:
+				try:
+					self._table = load_weights(self._path)
+				except Exception:
+					pass
+				self._mtime = mtime
+			return self._table
+
+
+_weights = _WeightsFile(SCORING_WEIGHTS_FILE)
+
+
+def weights() -> WeightTable:
+	"""当前生效的权重表。"""
+	return _weights.get()
+
+
+def _hits(keywords: Sequence[str], texts: List[str]) -> Optional[List[bool]]:
+	"""每条候选是否命中任一关键词（命中即停）；没有关键词时返回 None（对应特征不参与打分）。"""
+	words = [k for k in keywords if k]
+	if not words:
+		return None
+	out = []
+	for t in texts:
+		hit = False
+		for k in words:
+			if k in t:
+				hit = True
+				break
+		out.append(hit)
+	return out
+
+
+def _combo(table: WeightTable, mask: int) -> Scored:
+	w = table.weights
+	score = w["base"]
+	features: Dict[str, float] = {}
+	for name in _FEATURES:
+		if mask & _BIT[name]:
+			v = w.get(name)
+			if v:
+				features[name] = v
+				score += v
+	scored = Scored(max(0.0, min(1.0, score)), features)
+	table.combos[mask] = scored
+	return scored
+
+
+_Q_BITS = (_BIT["answer_no_question"], _BIT["answer_one_question"], _BIT["answer_multi_question"])
+_ANSWER_HIT, _ANSWER_MISS = _BIT["answer_anchor_hit"], _BIT["answer_anchor_miss"]
+_PROBE_Q, _PROBE_HIT = _BIT["probe_question"], _BIT["probe_anchor_hit"]
+_SCENARIO, _CONCISE, _LOW_RISK, _NEG_HUMOR = (
+	_BIT["scenario_hit"], _BIT["concise"], _BIT["low_risk"], _BIT["negative_humor"],
+)
+
+
+def score_candidates(
+	items: Sequence[Dict[str, Any]],
+	analysis: Dict[str, Any],
+	table: Optional[WeightTable] = None,
+) -> List[Scored]:
+	"""为一个请求的全部候选打分（顺序与 items 一致）。"""
+	table = table or weights()
+	th = table.thresholds
+	combos = table.combos
+	texts = [str(it.get("text") or "") for it in items]
+	anchor_hits = _hits(analysis.get("anchor_keywords") or (), texts)
+	scenario_hits = _hits(analysis.get("scenario_keywords") or (), texts)
+	answer = bool(analysis.get("last_peer_is_question"))
+	negative = analysis["affect"] < th["negative_affect"]
+	concise_max = th["concise_max_chars"]
+
+	out: List[Scored] = []
+	for i, text in enumerate(texts):
+		it = items[i]
+		q_count = text.count("？") + text.count("?")
+		if answer:
+			mask = _Q_BITS[q_count if q_count < 2 else 2]
+			if anchor_hits is not None:
+				mask |= _ANSWER_HIT if anchor_hits[i] else _ANSWER_MISS
+		else:
+			mask = _PROBE_Q if q_count else 0
+			if anchor_hits is not None and anchor_hits[i]:
+				mask |= _PROBE_HIT
+		if scenario_hits is not None and scenario_hits[i]:
+			mask |= _SCENARIO
+		if len(text) <= concise_max:
+			mask |= _CONCISE
+		if it.get("risk") == "low":
+			mask |= _LOW_RISK
+		if negative and "幽默" in str(it.get("why") or ""):
+			mask |= _NEG_HUMOR
+		scored = combos.get(mask)
+		out.append(scored if scored is not None else _combo(table, mask))
+	return out
+
+
+def score_batch(
+	requests: Iterable[Tuple[Sequence[Dict[str, Any]], Dict[str, Any]]],
+	table: Optional[WeightTable] = None,
+) -> List[List[Scored]]:
+	"""批量打分（离线回放/评估）：整批使用同一份权重表。"""
+	table = table or weights()
+	return [score_candidates(items, analysis, table) for items, analysis in requests]
@@ -0,0 +1,312 @@
+from __future__ import annotations
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Any, Dict, Optional
+import asyncio
+import hmac
+import secrets
+import sys
+import threading
+import uuid
+
+from fastapi import WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+
+from backend.config.config import SESSION_MAX_SESSIONS, SESSION_KEEP_TURNS
+from backend.models.compact import TurnLog
+from backend.models.ingest import PayloadTooLarge
+from backend.models.serialization import dumps
+from backend.models.types import (
+	SessionEvent, SuggestRequest, PeerReplyRequest,
+	Tip, Relationship,
+)
+from backend.services import admission_service, metrics_service, usage_service
+from backend.services.suggest_service import handle_suggest
+from backend.services.peer_service import generate_peer_reply
+
+# /ws/session：会话状态保存在服务端，客户端只发送增量事件，服务端在结果就绪时推送。
+# 事件 -> 推送：
+#   init                     -> ready（下发 sessionId + resumeToken；+ firstEnter 建议）
+#   turn(role=user)          -> postSend 建议；autoPeerReply 时再推送对方回复并记入会话
+#   turn(role=peer)          -> peerMsg 建议
+#   draft                    -> typing 建议（同会话新草稿取代在途请求，过期结果不推送）
+#   preSend                  -> preSend 建议
+#   peerReply                -> 对方回复候选
+#   ping                     -> pong
+# 每个建议先推送 progress（提示 + 关系指数，无需等模型），再推送 suggest（完整结果）。
+
+
+class SessionState:
+	__slots__ = (
+		"session_id", "conversation", "draft", "scenario", "opponent", "persona_weights",
+		"user_profile", "peer_profile", "memory", "auto_peer_reply", "resume_token",
+	)
+
+	def __init__(self, session_id: str):
+		self.session_id = session_id
+		self.resume_token = secrets.token_urlsafe(24)  # 重连凭据：只下发给建立会话的连接
+		self.conversation = TurnLog()  # 紧凑存储，构造请求时才转换为 ConversationTurn
+		self.draft = ""
+		self.scenario = None
+		self.opponent = None
+		self.persona_weights = None
+		self.user_profile = None
+		self.peer_profile = None
+		self.memory = None
+		self.auto_peer_reply = False
+
+	def configure(self, ev: SessionEvent) -> None:
+		# 只覆盖 init 中显式给出的字段，重连时可以只带 sessionId + resumeToken
+		if ev.conversation is not None:
+			self.conversation = TurnLog(ev.conversation[-SESSION_KEEP_TURNS:])
+		for attr, value in (
+			("scenario", ev.scenario), ("opponent", ev.opponent), ("persona_weights", ev.personaWeights),
+			("user_profile", ev.userProfile), ("peer_profile", ev.peerProfile), ("memory", ev.memory),
+		):
+			if value is not None:
+				setattr(self, attr, value)
+		self.auto_peer_reply = ev.autoPeerReply
+
+	def add_turn(self, role: str, text: str) -> None:
+		self.conversation.append(role, text)
+		self.conversation.trim(SESSION_KEEP_TURNS)
+		if role == "user":
+			self.draft = ""
+
+	def suggest_request(self, entry_type: str) -> SuggestRequest:
+		return SuggestRequest(
+			conversation=self.conversation.to_models(),
+			draft=self.draft,
+			entryType=entry_type,
+			userProfile=self.user_profile,
+			peerProfile=self.peer_profile,
+			memory=self.memory,
+			personaWeights=self.persona_weights,
+			scenario=self.scenario,
+			sessionId=self.session_id,
+		)
+
+	def peer_request(self) -> PeerReplyRequest:
+		return PeerReplyRequest(
+			conversation=self.conversation.to_models(),
+			opponent=self.opponent,
+			personaWeights=self.persona_weights,
+			scenario=self.scenario,
+		)
+
+	def nbytes(self) -> int:
+		"""会话状态的大致内存占用：轮次存储 + 草稿 + 配置对象（pydantic 模型按其字段递归估算）。"""
+		size = sys.getsizeof(self) + self.conversation.nbytes() + sys.getsizeof(self.draft)
+		for value in (
+			self.scenario, self.opponent, self.persona_weights, self.user_profile, self.peer_profile, self.memory,
+		):
+			if value is not None:
+				size += _deep_size(value)
+		return size
+
+
+def _deep_size(obj: Any, depth: int = 6) -> int:
+	size = sys.getsizeof(obj)
+	if depth <= 0 or isinstance(obj, (str, bytes, int, float, bool)):
+		return size
+	if isinstance(obj, dict):
+		return size + sum(_deep_size(k, depth - 1) + _deep_size(v, depth - 1) for k, v in obj.items())
+	if isinstance(obj, (list, tuple, set, frozenset)):
+		return size + sum(_deep_size(v, depth - 1) for v in obj)
+	fields = getattr(obj, "__dict__", None)
+	if fields is not None:
+		size += _deep_size(fields, depth - 1)
+	return size
+
+
+_lock = threading.Lock()
+_SESSIONS: "OrderedDict[str, SessionState]" = OrderedDict()
+
+
+def open_session(session_id: Optional[str], resume_token: Optional[str] = None) -> SessionState:
+	"""重连：会话ID与重连凭据都对上才取回原会话；否则新建会话，ID 由服务端生成（客户端给的 ID 不采用）。"""
+	with _lock:
+		state = _SESSIONS.get(session_id) if session_id else None
+		if state is not None and resume_token and hmac.compare_digest(state.resume_token, resume_token):
+			_SESSIONS.move_to_end(session_id)
+			return state
+		state = SessionState(uuid.uuid4().hex)
+		_SESSIONS[state.session_id] = state
+		while len(_SESSIONS) > SESSION_MAX_SESSIONS:
+			_SESSIONS.popitem(last=False)
+		return state
+
+
+def memory_stats(top: int = 10) -> Dict[str, Any]:
+	"""调试用：各会话内存占用估算（总量、每会话均值、最大的若干个会话）。"""
+	with _lock:
+		states = list(_SESSIONS.values())
+	sizes = [(s.nbytes(), len(s.conversation), s.session_id) for s in states]
+	total = sum(n for n, _t, _s in sizes)
+	turns = sum(t for _n, t, _s in sizes)
+	sizes.sort(reverse=True)
+	return {
+		"sessions": len(sizes),
+		"turns": turns,
+		"bytes": total,
+		"bytes_per_session": round(total / len(sizes)) if sizes else 0,
+		"bytes_per_turn": round(total / turns) if turns else 0,
+		"largest": [{"sessionId": sid, "bytes": n, "turns": t} for n, t, sid in sizes[:top]],
+	}
+
+
+class _Connection:
+	"""一个 WebSocket 连接：接收循环只更新状态并派发任务，推送统一经由发送队列串行写出。"""
+
+	def __init__(self, ws: WebSocket):
+		self.ws = ws
+		# 限流与用量预算的主体：连接对端地址（不用客户端给出的会话ID）
+		self.client = admission_service.client_key(ws.scope)
+		self.state: Optional[SessionState] = None
+		self.outbox: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+		self.loop = asyncio.get_running_loop()
+		self.tasks: set = set()
+
+	def push(self, msg: Dict[str, Any]) -> None:
+		self.outbox.put_nowait(msg)
+
+	def push_threadsafe(self, msg: Dict[str, Any]) -> None:
+		self.loop.call_soon_threadsafe(self.outbox.put_nowait, msg)
+
+	async def sender(self) -> None:
+		while True:
+			msg = await self.outbox.get()
+			if msg is None:
+				return
+			await self.ws.send_text(dumps(msg))
+
+	def spawn(self, coro) -> None:
+		task = asyncio.ensure_future(coro)
+		self.tasks.add(task)
+		task.add_done_callback(self.tasks.discard)
+
+	async def _admit(self, endpoint: str, reply_to: Optional[str]):
+		"""复用 HTTP 的限流与过载判断（按连接对端地址计）；返回 None 表示拒绝，否则返回执行期上下文。"""
+		wait = await admission_service.rate_limit_async(self.client, endpoint)
+		if wait > 0:
+			metrics_service.incr(f"admission_rejected:ws_{endpoint}:rate_limited")
+			self.push({"type": "error", "replyTo": reply_to, "reason": "rate_limited", "retryAfter": round(wait, 2)})
+			return None
+		if admission_service.overloaded():
+			if endpoint != "suggest":
+				self.push({"type": "error", "replyTo": reply_to, "reason": "overloaded", "retryAfter": 2})
+				return None
+			return admission_service.degraded_scope()
+		return nullcontext()
+
+	async def suggest(self, entry_type: str, reply_to: Optional[str]) -> None:
+		scope = await self._admit("suggest", reply_to)
+		if scope is None:
+			return
+		req = self.state.suggest_request(entry_type)
+
+		def on_progress(tip: Tip, rel: Relationship) -> None:
+			self.push_threadsafe({
+				"type": "progress", "replyTo": reply_to, "entryType": entry_type,
+				"tip": tip, "relationship": rel,
+			})
+
+		def run():
+			with scope, usage_service.subject_scope(self.client):
+				return handle_suggest(req, on_progress=on_progress)
+
+		try:
+			resp = await run_in_threadpool(run)
+		except Exception as e:
+			self.push({"type": "error", "replyTo": reply_to, "reason": type(e).__name__})
+			return
+		# 已被更新的草稿取代：客户端不需要这份结果
+		if not resp.superseded:
+			self.push({"type": "suggest", "replyTo": reply_to, "entryType": entry_type, "data": resp})
+
+	async def peer_reply(self, reply_to: Optional[str], commit: bool) -> None:
+		scope = await self._admit("peer_reply", reply_to)
+		if scope is None:
+			return
+		req = self.state.peer_request()
+
+		def run():
+			with scope, usage_service.subject_scope(self.client):
+				return generate_peer_reply(req)
+
+		try:
+			resp = await run_in_threadpool(run)
+		except Exception as e:
+			self.push({"type": "error", "replyTo": reply_to, "reason": type(e).__name__})
+			return
+		self.push({"type": "peerReply", "replyTo": reply_to, "data": resp})
+		if commit and resp.text:
+			# 自动对练：对方回复记入会话，紧接着给出针对它的建议
+			self.state.add_turn("peer", resp.text)
+			await self.suggest("peerMsg", reply_to)
+
+	def handle(self, ev: SessionEvent) -> None:
+		if ev.type == "ping":
+			self.push({"type": "pong", "replyTo": ev.id})
+			return
+		if ev.type == "init":
+			self.state = open_session(ev.sessionId, ev.resumeToken)
+			self.state.configure(ev)
+			self.push({
+				"type": "ready", "replyTo": ev.id, "sessionId": self.state.session_id,
+				"resumeToken": self.state.resume_token, "turns": len(self.state.conversation),
+			})
+			self.spawn(self.suggest("firstEnter", ev.id))
+			return
+		if self.state is None:
+			self.push({"type": "error", "replyTo": ev.id, "reason": "init_required"})
+			return
+		if ev.type == "turn":
+			if not ev.role or not ev.text:
+				self.push({"type": "error", "replyTo": ev.id, "reason": "invalid_turn"})
+				return
+			self.state.add_turn(ev.role, ev.text)
+			if ev.role == "user":
+				self.spawn(self.suggest("postSend", ev.id))
+				if self.state.auto_peer_reply:
+					self.spawn(self.peer_reply(ev.id, commit=True))
+			else:
+				self.spawn(self.suggest("peerMsg", ev.id))
+		elif ev.type == "draft":
+			self.state.draft = ev.text or ""
+			self.spawn(self.suggest("typing", ev.id))
+		elif ev.type == "preSend":
+			if ev.text is not None:
+				self.state.draft = ev.text
+			self.spawn(self.suggest("preSend", ev.id))
+		elif ev.type == "peerReply":
+			self.spawn(self.peer_reply(ev.id, commit=False))
+
+
+async def serve_websocket(ws: WebSocket) -> None:
+	await ws.accept()
+	conn = _Connection(ws)
+	sender = asyncio.ensure_future(conn.sender())
+	metrics_service.incr("ws_sessions_opened")
+	try:
+		while True:
+			raw = await ws.receive_text()
+			try:
+				ev = SessionEvent.model_validate_json(raw)
+			except ValidationError:
+				conn.push({"type": "error", "reason": "invalid_event"})
+				continue
+			except PayloadTooLarge as e:
+				conn.push({"type": "error", "reason": "payload_too_large", "detail": e.detail})
+				continue
+			conn.handle(ev)
+	except WebSocketDisconnect:
+		pass
+	finally:
+		# 在途的模型调用在线程池中自然结束，结果不再推送
+		for task in list(conn.tasks):
+			task.cancel()
+		conn.outbox.put_nowait(None)
+		sender.cancel()
+		metrics_service.incr("ws_sessions_closed")
@@ -1,73 +1,35 @@
 from __future__ import annotations
-from typing import Any, Dict, List, Optional
-from statistics import mean
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import json
 
-from backend.clients.llm_client import generate_candidates
+from backend.clients.llm_client import generate_candidates, cascade
+from backend.clients.llm_scheduler import priority_scope, INTERACTIVE, STANDARD
+from backend.config.config import SUGGEST_ROUTING_POLICY, CASCADE_MIN_SCORE
 from backend.models.types import (
-	SuggestRequest, SuggestResponse, Tip, Candidate, Relationship, Safety
+	SuggestRequest, SuggestResponse, Tip, Candidate, Relationship, Safety, ScenarioContext
 )
+from backend.services.local_candidate_service import local_candidates, normalize_domain
+from backend.services import analytics_service
+from backend.services import admission_service, metrics_service, usage_service
+from backend.services.keyword_service import extract_keywords as _extract_keywords
 from backend.services.safety_service import safety_check_text, redact_if_needed
+from backend.services import supersede_service
+from backend.services.supersede_service import Ticket
+from backend.services import trace_service
+from backend.services import scoring_service
+
+_TOP_K = 3
+# 问答平衡（双方提问数之差 / 轮数）超过该值时提示调整提问节奏
+_QA_IMBALANCE = 0.2
+
+
+def _passes_safety(item: Dict[str, Any]) -> bool:
+	return not safety_check_text(str(item.get("text") or ""))["blocked"]
 
-_POS_WORDS = {"喜欢", "开心", "有趣", "好玩", "期待", "不错", "赞", "哈哈", "开心"}
-_NEG_WORDS = {"无聊", "烦", "不想", "不愿", "生气", "晚回", "算了", "唉"}
-
-
-def _extract_keywords(text: str) -> list[str]:
-	"""
-	极简关键词抽取：按常见分隔符切分，保留长度>=2的片段，去重后取前5个。
-	避免引入第三方分词库，足以用于“上下文锚点”。
-	"""
-	if not text:
-		return []
-	seps = "，。！？!?,.;:：、()（）[]【】<>《》\"' \n\t"
-	tmp = text
-	for ch in seps:
-		tmp = tmp.replace(ch, " ")
-	parts = [p.strip() for p in tmp.split(" ") if p.strip()]
-	parts = [p for p in parts if len(p) >= 2]
-	# 去重保持顺序
-	seen = set()
-	result = []
-	for p in parts:
-		if p not in seen:
-			result.append(p)
-			seen.add(p)
-	return result[:5]
-
-
-def _affect_score(text: str) -> float:
-	score = 0
-	for w in _POS_WORDS:
-		if w in text:
-			score += 1
-	for w in _NEG_WORDS:
-		if w in text:
-			score -= 1
-	return max(-3, min(3, score)) / 3.0
-
-
-def _analyze_conversation(conv: List[Dict[str, Any]]) -> Dict[str, Any]:
-	peer_texts = [t["text"] for t in conv if t.get("role") == "peer" and t.get("text")]
-	aff = mean([_affect_score(t) for t in peer_texts[-5:]]) if peer_texts else 0.0
-	relationship_index = int(round(50 + aff * 30))
-	relationship_index = max(0, min(100, relationship_index))
-	# 判断最后一条是否为对方问句
-	last_peer_is_question = False
-	last_role = conv[-1]["role"] if conv else None
-	last_text = conv[-1]["text"] if conv else ""
-	if last_role == "peer" and last_text:
-		if last_text.strip().endswith(("?", "？")):
-			last_peer_is_question = True
-	anchor_keywords = _extract_keywords(last_text if last_role == "peer" else "")
-	return {
-		"affect": aff,
-		"relationship_index": relationship_index,
-		"trend": "up" if aff > 0.15 else ("down" if aff < -0.15 else "flat"),
-		"last_peer_is_question": last_peer_is_question,
-		"last_role": last_role,
-		"last_text": last_text,
-		"anchor_keywords": anchor_keywords,
-	}
+
+def _analyze_conversation(conv: List[Dict[str, Any]], session_id: Optional[str] = None) -> Dict[str, Any]:
+	# 有会话ID时读取增量维护的会话状态，只处理新追加的轮次
+	return analytics_service.analyze(conv, session_id)
 
 
 def _build_tip(analysis: Dict[str, Any], entry_type: str, draft: str) -> Tip:
@@ -82,113 +44,139 @@ def _build_tip(analysis: Dict[str, Any], entry_type: str, draft: str) -> Tip:
 			return Tip(text="建议降低强度，先共情再提问", tone="alert", risk="mid")
 		if len(draft) < 8:
 			return Tip(text="建议更具体些，给出一个小细节", tone="gentle", risk="low")
+		# 问答失衡：一方连续发问、另一方只回答
+		qa = analysis.get("qa") or {}
+		asked_more = qa.get("peer_questions", 0) - qa.get("user_questions", 0)
+		if asked_more >= 2 and qa.get("balance", 0.0) <= -_QA_IMBALANCE:
+			return Tip(text="TA问了你好几次，答完也回问一句TA的想法", tone="gentle", risk="low")
+		if asked_more <= -2 and qa.get("balance", 0.0) >= _QA_IMBALANCE:
+			return Tip(text="你问得有点多，先分享一点自己的经历", tone="gentle", risk="low")
 		return Tip(text="保持自然语气，附带一个轻问题", tone="gentle", risk="very_low")
 	if entry_type in ("idle",):
+		topics = analysis.get("topic_anchors") or []
+		if topics:
+			return Tip(text=f"可以接着聊TA提过的「{topics[0]}」，给一个续聊锚点", tone="neutral", risk="low")
 		return Tip(text="尝试承接TA的兴趣点，给一个续聊锚点", tone="neutral", risk="low")
 	return Tip(text="继续保持节奏～", tone="gentle", risk="very_low")
 
 
-def _score_candidate(text: str, why: str, risk: str, analysis: Dict[str, Any]) -> float:
-	base = 0.5
-	q_count = text.count("？") + text.count("?")
-	if analysis.get("last_peer_is_question"):
-		# 对方刚提问：回答优先，减少继续发问
-		if q_count == 0:
-			base += 0.12
-		elif q_count == 1:
-			base += 0.02
-		else:
-			base -= 0.08
-	else:
-		if q_count >= 1:
-			base += 0.1  # 促进互动
-	# 主题锚点重合度
-	anchors = analysis.get("anchor_keywords") or []
-	if anchors:
-		match = sum(1 for k in anchors if k and k in text)
-		if analysis.get("last_peer_is_question"):
-			if match >= 1:
-				base += 0.15
-			else:
-				base -= 0.12
-		else:
-			if match >= 1:
-				base += 0.06
-	sc_keys = analysis.get("scenario_keywords") or []
-	if sc_keys:
-		m2 = sum(1 for k in sc_keys if k and k in text)
-		if m2 >= 1:
-			base += 0.06
-	if len(text) <= 40:
-		base += 0.05  # 简洁
-	if risk == "low":
-		base += 0.08
-	if analysis["affect"] < -0.2 and "幽默" in why:
-		base -= 0.05  # 负面时降低幽默权重
-	return max(0.0, min(1.0, base))
-
-
-def _fallback_from_context(conv: List[Dict[str, Any]], draft: str, reply_mode: str) -> List[Dict[str, str]]:
+def _fallback_from_context(conv: List[Dict[str, Any]], draft: str, reply_mode: str, scenario: Optional[ScenarioContext] = None, anchors: Optional[List[str]] = None) -> List[Dict[str, str]]:
 	"""当模型超时/限流时的本地候选兜底（面向“你将要发送”的下一条）。"""
-	last_peer = ""
-	last_user = ""
-	last_role = None
-	for t in reversed(conv):
-		if t.get("role") in ("user", "peer"):
-			last_role = t["role"]
-			break
-	if last_role == "peer":
-		for t in reversed(conv):
-			if t.get("role") == "peer" and t.get("text"):
-				last_peer = t["text"]
-				break
-	else:
-		for t in reversed(conv):
-			if t.get("role") == "user" and t.get("text"):
-				last_user = t["text"]
-				break
-
-	# 若草稿已存在：做“增强与收束”
-	if draft:
-		return [
-			{"id":"mirror","text":f"{draft} 想听听你的看法～","why":"承接草稿并抛球","risk":"low"},
-			{"id":"safe","text":"我先说到这里，你这边怎么看？","why":"稳妥推进","risk":"low"},
-			{"id":"humor","text":"这段我就不剧透啦，交给你来补完？😄","why":"轻松化","risk":"mid"},
-		]
-
-	# 最近一条为对方消息：承接对方
-	if last_role == "peer":
-		if reply_mode == "answer":
-			return [
-				{"id":"mirror","text":f"我这边主要是{last_peer[:10]}这部分的体验比较深～如果你想我可以具体说说。","why":"先回答再补充","risk":"low"},
-				{"id":"safe","text":"我的看法是这样……（简单两点）如果你也方便，想听听你的想法。","why":"给出答案+轻抛球","risk":"low"},
-				{"id":"humor","text":"先交一份简短答卷，再抛个小问题：你会怎么选？","why":"回答后轻松推进","risk":"mid"},
-			]
-		return [
-			{"id":"mirror","text":f"关于“{last_peer[:18]}”，你更在意哪一部分？","why":"承接其话题","risk":"low"},
-			{"id":"safe","text":"如果方便的话，能说说具体是怎么想的吗？","why":"稳妥追问","risk":"low"},
-			{"id":"humor","text":"不如来个快问快答，我先抛一个：你会选A还是B？","why":"轻松推进","risk":"mid"},
-		]
-
-	# 最近一条为我方消息：做“自我补充 + 抛回对方”
-	if last_role == "user":
-		return [
-			{"id":"mirror","text":"主要是我这次在某一科状态更好～你最近有什么小高光？","why":"自述+抛回","risk":"low"},
-			{"id":"safe","text":"我的部分先到这儿，你这边最近有什么想分享的吗？","why":"稳妥转问","risk":"low"},
-			{"id":"humor","text":"给自己发一张小小“表扬券”，也想听听你的故事～","why":"轻松转场","risk":"mid"},
-		]
-
-	# 默认开场
-	return [
-		{"id":"mirror","text":"周末一般怎么放松？我最近迷上了散步。","why":"开启轻话题","risk":"low"},
-		{"id":"safe","text":"不急，我们可以从兴趣开始聊起～","why":"稳妥开场","risk":"low"},
-		{"id":"humor","text":"发你一张“聊天启动券”，换你一个小分享？","why":"幽默破冰","risk":"mid"},
+	domain = scenario.opponent.domain if scenario and scenario.opponent else None
+	goal = scenario.userGoal.goal if scenario and scenario.userGoal else None
+	return local_candidates(
+		conv, draft, reply_mode,
+		domain=domain, anchors=anchors, goal=goal,
+	)
+
+
+def _load_routing_policy(raw: str) -> Dict[str, Dict[str, str]]:
+	policy: Dict[str, Dict[str, str]] = {"*": dict(_DEFAULT_ROUTES)}
+	if not raw:
+		return policy
+	try:
+		data = json.loads(raw)
+	except Exception:
+		return policy
+	if isinstance(data, dict):
+		for domain, routes in data.items():
+			if isinstance(routes, dict):
+				policy.setdefault(normalize_domain(domain) if domain != "*" else "*", {}).update(
+					{str(k): str(v) for k, v in routes.items()}
+				)
+	return policy
+
+
+_DEFAULT_ROUTES = {"idle": "local", "firstEnter": "local", "postSend": "local"}
+_ROUTING = _load_routing_policy(SUGGEST_ROUTING_POLICY)
+
+
+def _route(entry_type: str, scenario: Optional[ScenarioContext]) -> str:
+	"""返回 "llm" 或 "local"：先查场景领域的策略，再查默认策略。"""
+	domain = normalize_domain(scenario.opponent.domain if scenario and scenario.opponent else None)
+	route = _ROUTING.get(domain, {}).get(entry_type) or _ROUTING["*"].get(entry_type) or "llm"
+	return route if route in ("llm", "local") else "llm"
+
+
+def _vet_candidates(raw_cands: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+	"""安全审校并规整字段；被拦截的候选直接丢弃。"""
+	kept: List[Dict[str, Any]] = []
+	for it in raw_cands:
+		safe = safety_check_text(it["text"])
+		if safe["blocked"]:
+			continue
+		risk_val = str(it.get("risk", "low"))
+		if risk_val not in ("low","mid","high"):
+			risk_val = "low"
+		kept.append({"id": it.get("id", "cand"), "text": it["text"], "why": it.get("why", ""), "risk": risk_val})
+	return kept
+
+
+def _score(
+	raw_cands: List[Dict[str, Any]],
+	analysis: Dict[str, Any],
+	table: Optional[scoring_service.WeightTable] = None,
+) -> Tuple[List[Candidate], Dict[str, Any]]:
+	"""安全审校 + 打分，无副作用；返回保留的候选与打分明细（权重表版本、各特征贡献，供追踪记录）。"""
+	kept = _vet_candidates(raw_cands)
+	table = table or scoring_service.weights()
+	scored = scoring_service.score_candidates(kept, analysis, table)
+	cands = [
+		Candidate(
+			id=it["id"],
+			text=redact_if_needed(it["text"]),
+			why=it["why"],
+			risk=it["risk"],
+			score=s.score,
+		)
+		for it, s in zip(kept, scored)
 	]
+	return cands, {"weights": table.version, "features": [s.features for s in scored]}
+
+
+def _score_and_filter(
+	raw_cands: List[Dict[str, Any]],
+	analysis: Dict[str, Any],
+	table: Optional[scoring_service.WeightTable] = None,
+) -> List[Candidate]:
+	"""安全审校 + 打分；被拦截的候选直接丢弃。离线回放工具也复用此函数（可传入待评估的权重表）。"""
+	cands, detail = _score(raw_cands, analysis, table)
+	# 各特征贡献随追踪记录，离线按录制流量调权
+	trace_service.record("score", detail)
+	return cands
+
+
+def _good_enough(scored: List[Candidate]) -> bool:
+	"""级联校验：小模型需给出足量安全候选，且最低分不低于 CASCADE_MIN_SCORE。"""
+	return len(scored) >= _TOP_K and min(c.score for c in scored) >= CASCADE_MIN_SCORE
+
 
+def _superseded_response(tip: Tip, analysis: Dict[str, Any]) -> SuggestResponse:
+	rel = Relationship(index=analysis["relationship_index"], trend=analysis["trend"])
+	return SuggestResponse(tip=tip, candidates=[], relationship=rel, safety=Safety(), superseded=True)
+
+
+def handle_suggest(
+	req: SuggestRequest,
+	on_progress: Optional[Callable[[Tip, Relationship], None]] = None,
+) -> SuggestResponse:
+	"""on_progress：提示与关系指数算出后（模型生成之前）回调，供 WebSocket 会话先行推送。"""
+	ticket = supersede_service.begin(req.sessionId, req.entryType)
+	try:
+		# 用量与预算的主体由入口按客户端地址设定（见 admission_service）；sessionId 由客户端给出，不能作为预算主体
+		return _handle_suggest(req, ticket, on_progress)
+	finally:
+		supersede_service.finish(ticket)
 
-def handle_suggest(req: SuggestRequest) -> SuggestResponse:
+
+def _handle_suggest(
+	req: SuggestRequest,
+	ticket: Optional[Ticket],
+	on_progress: Optional[Callable[[Tip, Relationship], None]] = None,
+) -> SuggestResponse:
 	conv = [t.model_dump() for t in req.conversation]
-	analysis = _analyze_conversation(conv)
+	with trace_service.stage("analyze"):
+		analysis = _analyze_conversation(conv, req.sessionId)
 	scenario_keywords: List[str] = []
 	if req.scenario and req.scenario.anchors:
 		scenario_keywords.extend([s for s in req.scenario.anchors if s])
@@ -208,53 +196,88 @@ def handle_suggest(req: SuggestRequest) -> SuggestResponse:
 		return SuggestResponse(tip=tip, candidates=[], relationship=rel, safety=safety)
 
 	tip = _build_tip(analysis, req.entryType, req.draft or "")
+	if on_progress is not None:
+		on_progress(tip, Relationship(index=analysis["relationship_index"], trend=analysis["trend"]))
 
+	# 画像/场景保持为已校验的模型，由序列化层直接输出 JSON，不做中间 dict 拷贝
 	context = {
 		"conversation": conv[-12:],
 		"draft": req.draft or "",
-		"userProfile": (req.userProfile or {}).model_dump() if req.userProfile else {},
-		"peerProfile": (req.peerProfile or {}).model_dump() if req.peerProfile else {},
+		"userProfile": req.userProfile or {},
+		"peerProfile": req.peerProfile or {},
 		"anchor": {
 			"last_role": analysis.get("last_role"),
 			"last_text": analysis.get("last_text"),
 			"keywords": analysis.get("anchor_keywords"),
 		},
-		"scenario": req.scenario.model_dump() if req.scenario else None,
+		"scenario": req.scenario,
 	}
 	persona = None
 	if req.personaWeights:
-		persona = {"enabled": req.personaWeights.enabled, "functions": req.personaWeights.model_dump()}
-	if persona and "enabled" in persona["functions"]:
-		persona["functions"].pop("enabled", None)
+		persona = {"enabled": req.personaWeights.enabled, "functions": req.personaWeights.model_dump(exclude={"enabled"})}
 
-	try:
-		reply_mode = "answer" if analysis.get("last_peer_is_question") else "probe"
-		raw_cands = generate_candidates(context, persona=persona, reply_mode=reply_mode)
-	except Exception:
-		reply_mode = "answer" if analysis.get("last_peer_is_question") else "probe"
-		raw_cands = _fallback_from_context(conv[-12:], req.draft or "", reply_mode)
+	reply_mode = "answer" if analysis.get("last_peer_is_question") else "probe"
+	# 上一条不是对方消息（或没有可用锚点）时，退回会话内对方反复提到的话题，再退回场景关键词
+	anchors = analysis.get("anchor_keywords") or analysis.get("topic_anchors") or analysis.get("scenario_keywords")
+	# 过载时准入层将请求标记为降级、或用量超出预算且无小模型可用：只用本地模板，不占用上游
+	if admission_service.degraded() or usage_service.budget_local_only():
+		route = "local"
+	else:
+		route = _route(req.entryType, req.scenario)
+	trace_service.record("analysis", analysis)
+	trace_service.record("route", route)
+	metrics_service.incr(f"suggest_route:{route}")
+	# 级联校验时已打分的 (原始候选, 打分结果)：最终采用的正是这批候选时直接复用，不重复审校与打分
+	checked: List[Any] = [None, None]
+	if route == "local":
+		# 低价值事件走本地模板库，不占用上游
+		raw_cands = _fallback_from_context(conv[-12:], req.draft or "", reply_mode, req.scenario, anchors)
+	# 防抖窗口内已有更新的草稿：直接放弃，不占用上游
+	elif not supersede_service.debounce(ticket):
+		return _superseded_response(tip, analysis)
+	else:
+		def _validate(cands: List[Dict[str, Any]]) -> bool:
+			# 已被取代的请求不再升级，直接按取代处理
+			if ticket is not None and ticket.cancelled():
+				return True
+			checked[:] = [cands, _score(cands, analysis)]
+			return _good_enough(checked[1][0])
+
+		try:
+			# 最终只保留3条：流式凑够3条安全候选即停止生成
+			# preSend 是用户按下发送前的同步等待，按交互优先级调度
+			priority = INTERACTIVE if req.entryType == "preSend" else STANDARD
+			with trace_service.stage("generate"), priority_scope(priority):
+				raw_cands = cascade(
+					"generate_candidates",
+					lambda model: generate_candidates(
+						context, persona=persona, reply_mode=reply_mode,
+						need=_TOP_K, accept=_passes_safety,
+						cancelled=ticket.cancelled if ticket else None, model=model,
+					),
+					_validate,
+				)
+		except Exception as e:
+			metrics_service.incr("suggest_fallback")
+			trace_service.record("fallback", f"{type(e).__name__}: {e}")
+			raw_cands = _fallback_from_context(conv[-12:], req.draft or "", reply_mode, req.scenario, anchors)
+	trace_service.record("candidates", raw_cands)
+
+	if ticket is not None and ticket.cancelled():
+		return _superseded_response(tip, analysis)
 
 	# 4) 安全审校、打分
-	final_cands: List[Candidate] = []
-	for it in raw_cands:
-		safe = safety_check_text(it["text"])
-		if safe["blocked"]:
-			continue
-		risk_val = str(it.get("risk", "low"))
-		if risk_val not in ("low","mid","high"):
-			risk_val = "low"
-		score = _score_candidate(it["text"], it.get("why", ""), risk_val, analysis)
-		final_cands.append(Candidate(
-			id=it.get("id", "cand"),
-			text=redact_if_needed(it["text"]),
-			why=it.get("why", ""),
-			risk=risk_val,
-			score=score
-		))
+	with trace_service.stage("score"):
+		if checked[0] is raw_cands:
+			final_cands, detail = checked[1]
+		else:
+			final_cands, detail = _score(raw_cands, analysis)
+		# 各特征贡献随追踪记录，离线按录制流量调权
+		trace_service.record("score", detail)
 
 	# 最多取3条
-	final_cands = sorted(final_cands, key=lambda x: x.score, reverse=True)[:3] or [
-		Candidate(id="safe", text="不急～可以聊聊你最近在忙什么？", why="稳妥推进", risk="very_low", score=0.7)
+	final_cands = sorted(final_cands, key=lambda x: x.score, reverse=True)[:_TOP_K] or [
+		Candidate(id="safe", text="不急～可以聊聊你最近在忙什么？", why="稳妥推进", risk="low", score=0.7)
 	]
 
 	rel = Relationship(index=analysis["relationship_index"], trend=analysis["trend"])
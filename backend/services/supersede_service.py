@@ -0,0 +1,63 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Dict, Optional
+import itertools
+import threading
+import time
+
+from backend.config.config import SUGGEST_DEBOUNCE_MS
+
+# 参与“新请求取代旧请求”的事件类型：打字中/发送前的建议会随草稿变化而过期
+_SUPERSEDABLE = ("typing", "preSend")
+
+_lock = threading.Lock()
+_latest: Dict[str, int] = {}
+_seq = itertools.count(1)
+
+
+@dataclass(frozen=True)
+class Ticket:
+	session_id: str
+	seq: int
+	entry_type: str = "typing"
+
+	def is_current(self) -> bool:
+		with _lock:
+			return _latest.get(self.session_id) == self.seq
+
+	def cancelled(self) -> bool:
+		return not self.is_current()
+
+
+def begin(session_id: Optional[str], entry_type: str) -> Optional[Ticket]:
+	"""
+	登记一个会话内的新请求；同会话更早的在途请求随即视为过期。
+	无会话ID或事件类型不参与取代时返回 None（按原逻辑完整执行）。
+	"""
+	if not session_id or entry_type not in _SUPERSEDABLE:
+		return None
+	ticket = Ticket(session_id=session_id, seq=next(_seq), entry_type=entry_type)
+	with _lock:
+		_latest[session_id] = ticket.seq
+	return ticket
+
+
+def finish(ticket: Optional[Ticket]) -> None:
+	if ticket is None:
+		return
+	with _lock:
+		if _latest.get(ticket.session_id) == ticket.seq:
+			del _latest[ticket.session_id]
+
+
+def debounce(ticket: Optional[Ticket]) -> bool:
+	"""
+	typing 事件的服务端防抖：等待一个短窗口，窗口内若有更新请求到达则放弃本次。
+	preSend 是用户按下发送后的同步等待，不做等待，只检查是否已被取代。
+	返回 True 表示本请求仍是最新、应继续处理。
+	"""
+	if ticket is None:
+		return True
+	if SUGGEST_DEBOUNCE_MS > 0 and ticket.entry_type == "typing":
+		time.sleep(SUGGEST_DEBOUNCE_MS / 1000.0)
+	return ticket.is_current()
@@ -0,0 +1,150 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+import logging
+import os
+import random
+import threading
+import time
+
+from pydantic import BaseModel
+
+from backend.config.config import TRACE_DIR, TRACE_MAX_BYTES, TRACE_BACKUPS, TRACE_SAMPLE_RATE
+from backend.models.serialization import dumps
+from backend.services.safety_service import redact_if_needed
+
+# 请求级追踪（默认关闭，设置 TRACE_DIR 开启）：
+# 记录请求、构造的 prompt、模型原始输出、解析结果与各阶段耗时，
+# 脱敏后按进程写入滚动 JSONL 文件，供 backend/tools/replay_traces.py 离线回放。
+
+_current: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+
+_writer_lock = threading.Lock()
+_writer: Optional[logging.Logger] = None
+
+
+def _get_writer() -> logging.Logger:
+	global _writer
+	with _writer_lock:
+		if _writer is None:
+			Path(TRACE_DIR).mkdir(parents=True, exist_ok=True)
+			# 每个进程单独一个文件，多 worker 时互不干扰
+			handler = RotatingFileHandler(
+				Path(TRACE_DIR) / f"trace-{os.getpid()}.jsonl",
+				maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUPS, encoding="utf-8",
+			)
+			handler.setFormatter(logging.Formatter("%(message)s"))
+			logger = logging.getLogger(f"soul.trace.{os.getpid()}")
+			logger.setLevel(logging.INFO)
+			logger.propagate = False
+			logger.addHandler(handler)
+			_writer = logger
+		return _writer
+
+
+def _redact(value: Any) -> Any:
+	if isinstance(value, str):
+		return redact_if_needed(value)
+	if isinstance(value, BaseModel):
+		return _redact(value.model_dump(mode="json"))
+	if isinstance(value, dict):
+		return {k: _redact(v) for k, v in value.items()}
+	if isinstance(value, (list, tuple)):
+		return [_redact(v) for v in value]
+	return value
+
+
+class Trace:
+	__slots__ = ("endpoint", "started", "request", "stages", "llm", "data", "result")
+
+	def __init__(self, endpoint: str, request: Any):
+		self.endpoint = endpoint
+		self.started = time.time()
+		self.request = request
+		self.stages: Dict[str, float] = {}
+		self.llm: List[Dict[str, Any]] = []
+		self.data: Dict[str, Any] = {}
+		self.result: Any = None
+
+	def to_record(self) -> Dict[str, Any]:
+		return _redact({
+			"ts": self.started,
+			"endpoint": self.endpoint,
+			"request": self.request,
+			"stages_ms": self.stages,
+			"llm": self.llm,
+			"data": self.data,
+			"result": self.result,
+		})
+
+
+def enabled() -> bool:
+	return bool(TRACE_DIR)
+
+
+def current() -> Optional[Trace]:
+	return _current.get()
+
+
+@contextmanager
+def trace_request(endpoint: str, request: Any) -> Iterator[Optional[Trace]]:
+	"""
+	包裹一次端点调用；未开启或未被采样时返回 None，其余记录函数均为空操作。
+	结束时（包括异常）写出一行 JSONL。
+	"""
+	if not enabled() or random.random() >= TRACE_SAMPLE_RATE:
+		yield None
+		return
+	tr = Trace(endpoint, request)
+	token = _current.set(tr)
+	t0 = time.perf_counter()
+	try:
+		yield tr
+	except Exception as e:
+		tr.data["error"] = f"{type(e).__name__}: {e}"
+		raise
+	finally:
+		tr.stages["total"] = round((time.perf_counter() - t0) * 1000, 2)
+		_current.reset(token)
+		try:
+			_get_writer().info(dumps(tr.to_record()))
+		except Exception:
+			pass
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+	"""记录一个阶段耗时（毫秒），同名阶段累加。"""
+	tr = _current.get()
+	if tr is None:
+		yield
+		return
+	t0 = time.perf_counter()
+	try:
+		yield
+	finally:
+		tr.stages[name] = round(tr.stages.get(name, 0.0) + (time.perf_counter() - t0) * 1000, 2)
+
+
+def record(key: str, value: Any) -> None:
+	tr = _current.get()
+	if tr is not None:
+		tr.data[key] = value
+
+
+def set_result(value: Any) -> None:
+	tr = _current.get()
+	if tr is not None:
+		tr.result = value
+
+
+def record_llm(call_site: str, messages: List[Dict[str, str]], raw: str, elapsed_ms: float, **meta: Any) -> None:
+	tr = _current.get()
+	if tr is None:
+		return
+	entry = {"call_site": call_site, "messages": messages, "raw": raw, "ms": round(elapsed_ms, 2)}
+	entry.update(meta)
+	tr.llm.append(entry)
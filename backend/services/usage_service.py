@@ -0,0 +1,371 @@
+from __future__ import annotations
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import atexit
+import os
+import sqlite3
+import threading
+import time
+
+from backend.config.config import (
+	USAGE_DB, USAGE_FLUSH_INTERVAL_S, USAGE_BUDGET_TOKENS, USAGE_BUDGET_ACTION, USAGE_MAX_SUBJECTS,
+	FAST_MODEL_NAME, MODEL_NAME,
+)
+from backend.clients.prompts import estimate_tokens
+from backend.services import metrics_service
+
+# Token 用量统计与预算：
+# - 每次上游调用记录 prompt/completion/缓存命中的 prompt token，按（调用点, 模型）汇总；
+#   上游未返回 usage 时按文本估算，estimated 单独计数；
+# - 进程内累加，后台线程定期把增量写入本机 sqlite（按 UTC 日期），并回读活跃用户的全机总量；
+# - 用量主体（用户/会话）由请求入口放入上下文，超出每日预算时改用小模型或本地兜底。
+
+_FIELDS = ("calls", "prompt", "completion", "cached", "estimated")
+
+_subject: ContextVar[Optional[str]] = ContextVar("usage_subject", default=None)
+
+
+class BudgetExceeded(Exception):
+	def __init__(self, subject: str, used: int, budget: int):
+		super().__init__(f"token budget exceeded: {used}/{budget}")
+		self.subject = subject
+		self.used = used
+		self.budget = budget
+
+
+def _today() -> str:
+	return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+def current_subject() -> Optional[str]:
+	return _subject.get()
+
+
+@contextmanager
+def subject_scope(subject: Optional[str]) -> Iterator[None]:
+	"""在当前上下文内把用量记到该用户/会话名下；subject 为空时沿用外层。"""
+	if not subject:
+		yield
+		return
+	token = _subject.set(subject[:128])
+	try:
+		yield
+	finally:
+		_subject.reset(token)
+
+
+class _Store:
+	"""sqlite 持久化：增量 upsert，同机多进程共享同一文件。"""
+
+	def __init__(self, path: str):
+		self._conn = sqlite3.connect(path, timeout=2.0, isolation_level=None, check_same_thread=False)
+		self._conn.execute("PRAGMA journal_mode=WAL")
+		self._conn.execute(
+			"CREATE TABLE IF NOT EXISTS usage_totals (day TEXT, call_site TEXT, model TEXT, "
+			"calls INTEGER, prompt INTEGER, completion INTEGER, cached INTEGER, estimated INTEGER, "
+			"PRIMARY KEY (day, call_site, model))"
+		)
+		self._conn.execute(
+			"CREATE TABLE IF NOT EXISTS usage_subjects (day TEXT, subject TEXT, tokens INTEGER, "
+			"PRIMARY KEY (day, subject))"
+		)
+		self._lock = threading.Lock()
+
+	def subject_total(self, day: str, subject: str) -> int:
+		with self._lock:
+			row = self._conn.execute(
+				"SELECT tokens FROM usage_subjects WHERE day = ? AND subject = ?", (day, subject)
+			).fetchone()
+		return int(row[0]) if row else 0
+
+	def write(
+		self,
+		day: str,
+		totals: Dict[Tuple[str, str], List[int]],
+		subjects: Dict[str, int],
+	) -> Dict[str, int]:
+		"""写入增量并返回这些用户写入后的全机总量。"""
+		with self._lock:
+			conn = self._conn
+			conn.execute("BEGIN IMMEDIATE")
+			try:
+				for (site, model), v in totals.items():
+					conn.execute(
+						"INSERT INTO usage_totals VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+						"ON CONFLICT (day, call_site, model) DO UPDATE SET "
+						"calls = calls + excluded.calls, prompt = prompt + excluded.prompt, "
+						"completion = completion + excluded.completion, cached = cached + excluded.cached, "
+						"estimated = estimated + excluded.estimated",
+						(day, site, model, *v),
+					)
+				for subject, tokens in subjects.items():
+					conn.execute(
+						"INSERT INTO usage_subjects VALUES (?, ?, ?) "
+						"ON CONFLICT (day, subject) DO UPDATE SET tokens = tokens + excluded.tokens",
+						(day, subject, tokens),
+					)
+				merged = {
+					subject: int(conn.execute(
+						"SELECT tokens FROM usage_subjects WHERE day = ? AND subject = ?", (day, subject)
+					).fetchone()[0])
+					for subject in subjects
+				}
+				conn.execute("COMMIT")
+			except Exception:
+				conn.execute("ROLLBACK")
+				raise
+		return merged
+
+
+def _make_store() -> Optional[_Store]:
+	if not USAGE_DB:
+		return None
+	try:
+		return _Store(USAGE_DB)
+	except Exception:
+		return None
+
+
+_lock = threading.Lock()
+_totals: Dict[Tuple[str, str], List[int]] = {}  # 本进程累计
+_pending: Dict[Tuple[str, str], List[int]] = {}  # 未写入存储的增量
+_pending_day = _today()
+# 用户 -> [日期, 当日已用 token（全机，含本进程未写入部分）]
+_subjects: "OrderedDict[str, List[Any]]" = OrderedDict()
+_subject_pending: Dict[str, int] = {}
+_store = _make_store()
+_flusher: Optional[threading.Thread] = None
+
+
+def _usage_field(obj: Any, name: str) -> int:
+	if obj is None:
+		return 0
+	val = obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+	try:
+		return int(val or 0)
+	except (TypeError, ValueError):
+		return 0
+
+
+def _cached_tokens(usage: Any) -> int:
+	details = usage.get("prompt_tokens_details") if isinstance(usage, dict) else getattr(usage, "prompt_tokens_details", None)
+	return _usage_field(details, "cached_tokens")
+
+
+def _estimate_prompt(messages: List[Dict[str, str]]) -> int:
+	# 每条消息约 4 个 token 的格式开销
+	return sum(estimate_tokens(str(m.get("content") or "")) + 4 for m in messages)
+
+
+def record(
+	call_site: str,
+	model: Optional[str],
+	usage: Any,
+	messages: List[Dict[str, str]],
+	output: str,
+) -> int:
+	"""记录一次上游调用的用量；usage 为上游返回的 usage 对象（可为 None，按文本估算）。返回本次总 token。"""
+	model = model or MODEL_NAME
+	if usage is not None and _usage_field(usage, "prompt_tokens"):
+		prompt = _usage_field(usage, "prompt_tokens")
+		completion = _usage_field(usage, "completion_tokens")
+		cached = _cached_tokens(usage)
+		estimated = 0
+	else:
+		prompt = _estimate_prompt(messages)
+		completion = estimate_tokens(output)
+		cached = 0
+		estimated = 1
+	row = (1, prompt, completion, cached, estimated)
+	subject = _subject.get()
+	total = prompt + completion
+	if subject:
+		_load_subject(subject, _today())
+	global _pending_day
+	rollover = None
+	with _lock:
+		day = _today()
+		if day != _pending_day:
+			# 跨天：先取走前一天的增量，按前一天的日期写入
+			rollover = _take_pending()
+			_pending_day = day
+		for table in (_totals, _pending):
+			acc = table.get((call_site, model))
+			if acc is None:
+				acc = table[(call_site, model)] = [0] * len(_FIELDS)
+			for i, v in enumerate(row):
+				acc[i] += v
+		if subject:
+			entry = _subject_entry(subject, day)
+			entry[1] += total
+			_subject_pending[subject] = _subject_pending.get(subject, 0) + total
+	if rollover is not None:
+		_write(*rollover)
+	metrics_service.incr(f"tokens_prompt:{call_site}", prompt)
+	metrics_service.incr(f"tokens_completion:{call_site}", completion)
+	if cached:
+		metrics_service.incr(f"tokens_cached:{call_site}", cached)
+	_ensure_flusher()
+	return total
+
+
+def _load_subject(subject: str, day: str) -> None:
+	"""
+	主体不在缓存中时，在锁外读出 sqlite 中的当日总量再放入缓存（双重检查），
+	避免一次磁盘读阻塞所有并发的 record / 预算检查。
+	"""
+	entry = _subjects.get(subject)  # 无锁预检：单次 dict 读取是原子的，命中即返回
+	if entry is not None and entry[0] == day:
+		return
+	stored = 0
+	if _store is not None:
+		try:
+			stored = _store.subject_total(day, subject)
+		except Exception:
+			stored = 0
+	with _lock:
+		entry = _subjects.get(subject)
+		if entry is None or entry[0] != day:
+			# 尚未落盘的增量不在 sqlite 里，一并计入
+			_subjects[subject] = [day, stored + _subject_pending.get(subject, 0)]
+			while len(_subjects) > USAGE_MAX_SUBJECTS:
+				_subjects.popitem(last=False)
+
+
+def _subject_entry(subject: str, day: str) -> List[Any]:
+	"""调用方持有 _lock，且已先调用 _load_subject；期间被挤出缓存时按 0 重建（不在锁内读盘）。"""
+	entry = _subjects.get(subject)
+	if entry is None or entry[0] != day:
+		entry = _subjects[subject] = [day, _subject_pending.get(subject, 0)]
+		while len(_subjects) > USAGE_MAX_SUBJECTS:
+			_subjects.popitem(last=False)
+	else:
+		_subjects.move_to_end(subject)
+	return entry
+
+
+def used(subject: Optional[str] = None) -> int:
+	"""该用户/会话当日已用 token（默认取当前上下文）。"""
+	subject = subject or _subject.get()
+	if not subject:
+		return 0
+	day = _today()
+	_load_subject(subject, day)
+	with _lock:
+		return int(_subject_entry(subject, day)[1])
+
+
+def over_budget(subject: Optional[str] = None) -> bool:
+	if USAGE_BUDGET_TOKENS <= 0:
+		return False
+	return used(subject) >= USAGE_BUDGET_TOKENS
+
+
+def budget_local_only() -> bool:
+	"""超预算且没有可降级的小模型：只能走本地兜底。"""
+	return over_budget() and (USAGE_BUDGET_ACTION == "local" or not FAST_MODEL_NAME)
+
+
+def budget_model(call_site: str, model: Optional[str]) -> Optional[str]:
+	"""上游调用前检查预算：超出时返回小模型；无小模型可用时抛 BudgetExceeded。"""
+	if not over_budget():
+		return model
+	subject = _subject.get() or ""
+	metrics_service.incr(f"usage_over_budget:{call_site}")
+	if USAGE_BUDGET_ACTION != "local" and FAST_MODEL_NAME:
+		return FAST_MODEL_NAME
+	raise BudgetExceeded(subject, used(subject), USAGE_BUDGET_TOKENS)
+
+
+def _take_pending() -> Tuple[str, Dict[Tuple[str, str], List[int]], Dict[str, int]]:
+	"""（持锁调用）取走待写入的增量。"""
+	taken = (_pending_day, {k: list(v) for k, v in _pending.items()}, dict(_subject_pending))
+	_pending.clear()
+	_subject_pending.clear()
+	return taken
+
+
+def _write(day: str, totals: Dict[Tuple[str, str], List[int]], subjects: Dict[str, int]) -> None:
+	"""（不持锁调用）写入存储；失败时把增量放回，成功时回读全机总量（含其他 worker 的用量）。"""
+	if _store is None or not (totals or subjects):
+		return
+	try:
+		merged = _store.write(day, totals, subjects)
+	except Exception:
+		with _lock:
+			for k, v in totals.items():
+				acc = _pending.setdefault(k, [0] * len(_FIELDS))
+				for i, x in enumerate(v):
+					acc[i] += x
+			for subject, tokens in subjects.items():
+				_subject_pending[subject] = _subject_pending.get(subject, 0) + tokens
+		return
+	with _lock:
+		for subject, tokens in merged.items():
+			entry = _subjects.get(subject)
+			if entry is not None and entry[0] == day:
+				entry[1] = tokens + _subject_pending.get(subject, 0)
+
+
+def flush() -> None:
+	with _lock:
+		taken = _take_pending()
+	_write(*taken)
+
+
+def _flush_loop() -> None:
+	while True:
+		time.sleep(USAGE_FLUSH_INTERVAL_S)
+		try:
+			flush()
+		except Exception:
+			pass
+
+
+def _ensure_flusher() -> None:
+	global _flusher
+	if _flusher is not None or _store is None:
+		return
+	with _lock:
+		if _flusher is None:
+			_flusher = threading.Thread(target=_flush_loop, name="usage-flush", daemon=True)
+			_flusher.start()
+			atexit.register(flush)
+
+
+def _after_fork() -> None:
+	# 预fork部署（backend.serve）：sqlite 连接与后台写入线程不能跨 fork 使用，worker 内重新创建
+	global _lock, _store, _flusher
+	_lock = threading.Lock()
+	_store = _make_store()
+	_flusher = None
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def snapshot() -> Dict[str, Any]:
+	with _lock:
+		by_site: Dict[str, Dict[str, int]] = {}
+		for (site, model), v in _totals.items():
+			acc = by_site.setdefault(site, dict.fromkeys(_FIELDS, 0))
+			for name, x in zip(_FIELDS, v):
+				acc[name] += x
+		by_model = {
+			model: sum(v[1] + v[2] for (_s, m), v in _totals.items() if m == model)
+			for model in {m for _s, m in _totals}
+		}
+		day = _today()
+		active = [e[1] for e in _subjects.values() if e[0] == day]
+	return {
+		"by_call_site": by_site,
+		"tokens_by_model": by_model,
+		"budget": USAGE_BUDGET_TOKENS,
+		"subjects": len(active),
+		"subjects_over_budget": sum(1 for t in active if USAGE_BUDGET_TOKENS and t >= USAGE_BUDGET_TOKENS),
+	}
+
+
+metrics_service.register_provider("token_usage", snapshot)
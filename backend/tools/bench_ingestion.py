@@ -0,0 +1,72 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List
+
+from pydantic import TypeAdapter
+
+from backend.models.types import ConversationTurn, SuggestRequest
+
+# 摄入压测：对话历史从几十轮增长到上限附近时，单请求开销应基本持平。
+#   parse：json.loads 请求体（框架层，随体积线性增长，由 INGEST_MAX_BODY_BYTES 封顶）
+#   full ：逐轮校验整段历史（旧行为）
+#   tail ：SuggestRequest 只校验端点会用到的尾部
+#   http ：经 /api/suggest 完整走一遍（entryType=idle 走本地模板，不调用模型）
+# 用法：python -m backend.tools.bench_ingestion --sizes 12,100,500,1000,2000 --iters 200
+
+_FULL = TypeAdapter(List[ConversationTurn])
+
+
+def _payload(turns: int) -> Dict[str, Any]:
+	return {
+		"conversation": [
+			{"role": "peer" if i % 2 else "user", "text": f"第{i}轮：周末去爬山了，风景很好，你最近有什么安排吗？", "ts": 1700000000.0 + i}
+			for i in range(turns)
+		],
+		"draft": "",
+		"entryType": "idle",
+	}
+
+
+def _per_call_us(fn, iters: int) -> float:
+	fn()
+	t0 = time.perf_counter()
+	for _ in range(iters):
+		fn()
+	return round((time.perf_counter() - t0) / iters * 1e6, 1)
+
+
+def main() -> None:
+	ap = argparse.ArgumentParser(description="对话摄入开销随历史长度变化")
+	ap.add_argument("--sizes", default="12,100,500,1000,2000")
+	ap.add_argument("--iters", type=int, default=200)
+	ap.add_argument("--http", action="store_true", help="同时压测 /api/suggest 端到端")
+	args = ap.parse_args()
+
+	client = None
+	if args.http:
+		# 压测不受限流影响
+		os.environ["RATE_LIMIT_ENABLED"] = "0"
+		from fastapi.testclient import TestClient
+		from backend.main import app
+		client = TestClient(app)
+
+	rows = []
+	for size in [int(s) for s in args.sizes.split(",") if s]:
+		payload = _payload(size)
+		body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+		row: Dict[str, Any] = {"turns": size, "body_bytes": len(body)}
+		row["parse_us"] = _per_call_us(lambda: json.loads(body), args.iters)
+		row["full_us"] = _per_call_us(lambda: _FULL.validate_python(payload["conversation"]), args.iters)
+		row["tail_us"] = _per_call_us(lambda: SuggestRequest.model_validate(payload), args.iters)
+		if client is not None:
+			headers = {"content-type": "application/json"}
+			row["http_us"] = _per_call_us(lambda: client.post("/api/suggest", content=body, headers=headers), args.iters)
+		rows.append(row)
+	print(json.dumps(rows, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,109 @@
+from __future__ import annotations
+import argparse
+import json
+import time
+import tracemalloc
+from typing import Any, Callable, Dict
+
+from fastapi.encoders import jsonable_encoder
+
+from backend.models.serialization import dumps_bytes, dumps_object, RawJSON
+from backend.models.types import (
+	SuggestRequest, SuggestResponse, Tip, Candidate, Relationship, Safety
+)
+
+# 对比 /api/suggest 单请求的序列化开销：
+#   legacy：逐个 model_dump → json.dumps(context)；响应走 jsonable_encoder + json.dumps
+#   fast  ：模型直接 model_dump_json 拼接；响应直接 model_dump_json
+# 用法：python -m backend.tools.bench_serialization --turns 12 --iters 2000
+
+
+def _sample_request(turns: int) -> SuggestRequest:
+	conv = [
+		{"role": "peer" if i % 2 else "user", "text": f"第{i}轮：周末去爬山了，风景很好，你最近有什么安排吗？", "ts": 1700000000.0 + i}
+		for i in range(turns)
+	]
+	return SuggestRequest.model_validate({
+		"conversation": conv,
+		"draft": "我也挺喜欢户外的",
+		"entryType": "preSend",
+		"userProfile": {"interests": ["徒步", "摄影"], "bio": "喜欢户外", "stylePref": "自然"},
+		"peerProfile": {"interests": ["读书"], "bio": None, "stylePref": None},
+		"personaWeights": {"Ni": 30, "Fe": 25, "enabled": True},
+		"scenario": {
+			"scenario": "社团招新，向新生介绍户外社",
+			"opponent": {"roleTitle": "学弟", "style": "活泼", "traits": ["好奇", "慢热", "爱运动"], "domain": "校园"},
+			"userGoal": {"goal": "邀请学弟参加周末徒步", "subgoals": ["介绍社团", "了解兴趣"], "successCriteria": ["对方答应"]},
+			"anchors": ["徒步", "周末"],
+			"flow": {"startingParty": "user", "openingHints": ["你好呀，对户外感兴趣吗？"]},
+		},
+	})
+
+
+def _sample_response() -> SuggestResponse:
+	return SuggestResponse(
+		tip=Tip(text="先回答TA的问题，再补一个小细节"),
+		candidates=[Candidate(id=i, text="我们社团最近有个徒步活动，你喜欢户外吗？", why="承接", score=0.8) for i in ("mirror", "safe", "humor")],
+		relationship=Relationship(index=62, trend="up"),
+		safety=Safety(),
+	)
+
+
+def legacy(req: SuggestRequest, resp: SuggestResponse) -> int:
+	conv = [t.model_dump() for t in req.conversation]
+	context = {
+		"conversation": conv[-12:],
+		"draft": req.draft or "",
+		"userProfile": req.userProfile.model_dump() if req.userProfile else {},
+		"peerProfile": req.peerProfile.model_dump() if req.peerProfile else {},
+		"anchor": {"last_role": "peer", "last_text": conv[-1]["text"], "keywords": []},
+		"scenario": req.scenario.model_dump() if req.scenario else None,
+	}
+	funcs = req.personaWeights.model_dump()
+	funcs.pop("enabled", None)
+	prompt = json.dumps(context, ensure_ascii=False) + json.dumps(funcs, ensure_ascii=False)
+	body = json.dumps(jsonable_encoder(resp), ensure_ascii=False).encode("utf-8")
+	return len(prompt) + len(body)
+
+
+def fast(req: SuggestRequest, resp: SuggestResponse) -> int:
+	conv = [t.model_dump() for t in req.conversation]
+	context = {
+		"conversation": conv[-12:],
+		"draft": req.draft or "",
+		"userProfile": req.userProfile or {},
+		"peerProfile": req.peerProfile or {},
+		"anchor": {"last_role": "peer", "last_text": conv[-1]["text"], "keywords": []},
+		"scenario": RawJSON(req.scenario.model_dump_json()),
+	}
+	funcs = req.personaWeights.model_dump(exclude={"enabled"})
+	prompt = dumps_object(context) + dumps_object(funcs)
+	body = dumps_bytes(resp)
+	return len(prompt) + len(body)
+
+
+def _measure(fn: Callable[[SuggestRequest, SuggestResponse], int], req: SuggestRequest, resp: SuggestResponse, iters: int) -> Dict[str, Any]:
+	fn(req, resp)
+	t0 = time.perf_counter()
+	for _ in range(iters):
+		fn(req, resp)
+	elapsed = time.perf_counter() - t0
+	tracemalloc.start()
+	fn(req, resp)
+	_cur, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return {"us_per_req": round(elapsed / iters * 1e6, 1), "peak_alloc_bytes": peak}
+
+
+def main() -> None:
+	ap = argparse.ArgumentParser(description="Suggest 请求序列化开销对比")
+	ap.add_argument("--turns", type=int, default=12)
+	ap.add_argument("--iters", type=int, default=2000)
+	args = ap.parse_args()
+	req, resp = _sample_request(args.turns), _sample_response()
+	res = {"legacy": _measure(legacy, req, resp, args.iters), "fast": _measure(fast, req, resp, args.iters)}
+	print(json.dumps(res, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,45 @@
+from __future__ import annotations
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from backend.clients.prompts import prompt_report
+
+# 输出各 prompt 模板的版本与固定部分 token 估算；可与基线对比发现体积回归。
+# 用法：
+#   python -m backend.tools.prompt_report                      # 打印报告
+#   python -m backend.tools.prompt_report --write base.json    # 保存基线
+#   python -m backend.tools.prompt_report --baseline base.json --max-growth 0.1
+
+
+def main() -> int:
+	ap = argparse.ArgumentParser(description="Prompt 模板体积报告")
+	ap.add_argument("--baseline", type=Path, default=None, help="基线报告 JSON")
+	ap.add_argument("--write", type=Path, default=None, help="将当前报告写入文件")
+	ap.add_argument("--max-growth", type=float, default=0.1, help="相对基线允许的 static_tokens 增幅")
+	args = ap.parse_args()
+
+	report = prompt_report()
+	for row in report:
+		print(f"{row['id']:<28} {row['version']:<4} static={row['static_tokens']:>5} prefix={row['prefix_tokens']:>5} slots={','.join(row['slots'])}")
+	if args.write:
+		args.write.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+	if not args.baseline:
+		return 0
+
+	base = {row["id"]: row for row in json.loads(args.baseline.read_text(encoding="utf-8"))}
+	failed = False
+	for row in report:
+		old = base.get(row["id"])
+		if not old or not old.get("static_tokens"):
+			continue
+		growth = row["static_tokens"] / old["static_tokens"] - 1.0
+		if growth > args.max_growth:
+			failed = True
+			print(f"REGRESSION {row['id']}: {old['static_tokens']} -> {row['static_tokens']} (+{growth:.0%})", file=sys.stderr)
+	return 1 if failed else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
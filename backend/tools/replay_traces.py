@@ -0,0 +1,136 @@
+from __future__ import annotations
+import argparse
+import glob
+import json
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from backend.clients.llm_client import _safe_json_parse, _JSONArrayStream
+from backend.services.safety_service import safety_check_text
+from backend.services.suggest_service import _score_and_filter, _vet_candidates, _TOP_K
+from backend.services.scoring_service import WeightTable, load_weights, score_candidates
+
+# 离线回放 trace_service 记录的 JSONL：把模型原始输出重新送入解析、安全审校与打分，
+# 不访问网络。用于对比解析/打分改动前后的耗时与排序变化；
+# --weights 指定待评估的权重表，统计排序变化与各特征的触发次数（按该表重新打分得到，
+# 录制时的特征另列为 recorded_features 供对照），用于离线调权。
+# 用法：python -m backend.tools.replay_traces --dir traces/ [--repeat 20] [--weights new_weights.json]
+
+
+def _iter_traces(paths: List[str]) -> Iterator[Dict[str, Any]]:
+	for path in paths:
+		with open(path, encoding="utf-8") as f:
+			for line in f:
+				line = line.strip()
+				if not line:
+					continue
+				try:
+					yield json.loads(line)
+				except Exception:
+					continue
+
+
+def _parse(entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+	raw = entry.get("raw") or ""
+	if entry.get("mode") == "stream":
+		parser = _JSONArrayStream()
+		need = int(entry.get("need") or 0)
+		items: List[Dict[str, Any]] = []
+		for obj in parser.feed(raw):
+			if isinstance(obj.get("text"), str) and obj["text"].strip() and not safety_check_text(obj["text"])["blocked"]:
+				items.append(obj)
+				if need and len(items) >= need:
+					break
+		if items:
+			return items
+	data = _safe_json_parse(raw)
+	if isinstance(data, dict):
+		return [data]
+	return [it for it in data if isinstance(it, dict)] if isinstance(data, list) else []
+
+
+def _normalize(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+	out = []
+	for it in items:
+		text = it.get("text")
+		if not isinstance(text, str) or not text.strip():
+			continue
+		out.append({"id": it.get("id") or "cand", "text": text.strip(), "why": it.get("why") or "", "risk": it.get("risk") or "low"})
+	return out
+
+
+def _pct(values: List[float], q: float) -> float:
+	if not values:
+		return 0.0
+	values = sorted(values)
+	return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def replay(paths: List[str], repeat: int = 1, table: Optional[WeightTable] = None) -> Dict[str, Any]:
+	timings: Dict[str, List[float]] = defaultdict(list)
+	upstream_ms: Dict[str, List[float]] = defaultdict(list)
+	counts: Dict[str, int] = defaultdict(int)
+	features: Dict[str, int] = defaultdict(int)
+	recorded: Dict[str, int] = defaultdict(int)
+	parse_ok = parse_total = rank_changed = ranked = 0
+	for tr in _iter_traces(paths):
+		endpoint = tr.get("endpoint") or "?"
+		counts[endpoint] += 1
+		data = tr.get("data") or {}
+		for entry in tr.get("llm") or []:
+			site = entry.get("call_site") or "default"
+			upstream_ms[site].append(float(entry.get("ms") or 0.0))
+			t0 = time.perf_counter()
+			for _ in range(repeat):
+				items = _parse(entry)
+			timings[f"parse:{site}"].append((time.perf_counter() - t0) / repeat * 1e6)
+			parse_total += 1
+			parse_ok += 1 if items else 0
+		if endpoint != "suggest" or not data.get("analysis") or not data.get("candidates"):
+			continue
+		cands = _normalize(data["candidates"])
+		t0 = time.perf_counter()
+		for _ in range(repeat):
+			scored = _score_and_filter(cands, data["analysis"], table)
+		timings["score"].append((time.perf_counter() - t0) / repeat * 1e6)
+		new_ids = [c.id for c in sorted(scored, key=lambda c: c.score, reverse=True)[:_TOP_K]]
+		for s in score_candidates(_vet_candidates(cands), data["analysis"], table):
+			for name in s.features:
+				features[name] += 1
+		for feats in ((data.get("score") or {}).get("features") or []):
+			for name in feats:
+				recorded[name] += 1
+		old_ids = [c.get("id") for c in ((tr.get("result") or {}).get("candidates") or [])]
+		if old_ids:
+			ranked += 1
+			rank_changed += 1 if new_ids != old_ids else 0
+	return {
+		"traces": dict(counts),
+		"parse_success_rate": round(parse_ok / parse_total, 4) if parse_total else None,
+		"ranking_changed": f"{rank_changed}/{ranked}",
+		"weights": table.version if table else "current",
+		"features": dict(features),
+		"recorded_features": dict(recorded),
+		"cpu_us": {k: {"p50": round(_pct(v, 0.5), 1), "p95": round(_pct(v, 0.95), 1), "n": len(v)} for k, v in timings.items()},
+		"upstream_ms": {k: {"p50": round(_pct(v, 0.5), 1), "p95": round(_pct(v, 0.95), 1), "n": len(v)} for k, v in upstream_ms.items()},
+	}
+
+
+def main() -> None:
+	ap = argparse.ArgumentParser(description="离线回放请求追踪")
+	ap.add_argument("--dir", type=Path, default=None, help="追踪目录（读取其中全部 *.jsonl*）")
+	ap.add_argument("files", nargs="*", help="追踪文件")
+	ap.add_argument("--repeat", type=int, default=1, help="每条记录重复执行次数，用于稳定耗时")
+	ap.add_argument("--weights", default="", help="用该权重表重新打分（默认使用当前生效的权重表）")
+	args = ap.parse_args()
+	paths = list(args.files)
+	if args.dir:
+		paths += sorted(glob.glob(str(args.dir / "*.jsonl*")))
+	table = load_weights(args.weights) if args.weights else None
+	print(json.dumps(replay(paths, max(1, args.repeat), table), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+	main()
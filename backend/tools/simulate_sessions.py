@@ -0,0 +1,272 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+# 自对弈压测：模拟用户完整走一遍练习流程——
+#   场景分析 → 对方回复（generate_peer_reply）→ 建议（handle_suggest）→ 取最高分候选作为用户发言 → ...
+# 会话按进程分片（进程池承担分析/打分等 CPU 阶段），进程内用 asyncio 并发驱动大量会话，
+# 阻塞的服务调用放进线程池。上游可以是真实模型，也可以是本地替身（--model standin）。
+# 报告：每秒轮次、各阶段耗时分位数、兜底率、关系指数分布。
+# 用法：python -m backend.tools.simulate_sessions --sessions 2000 --turns 6 --procs 4 --concurrency 128 --model standin
+
+_SCENARIO_TEXTS = [
+	"周末户外社招新，向路过的新生介绍社团",
+	"部门新同事第一次午饭闲聊",
+	"技术岗二面，面试官追问项目细节",
+	"相亲后第一次约咖啡",
+	"给老客户打电话推荐新方案",
+]
+
+_PHRASES = [
+	"我们周末有个徒步活动，你对户外感兴趣吗？",
+	"这个问题挺好的，我先说说我的经历。",
+	"哈哈，那你平时一般怎么安排周末？",
+	"我之前做过一个类似的项目，主要负责数据部分。",
+	"听起来你也很喜欢旅行，最近去过哪里？",
+	"谢谢你的耐心，我再补充一点细节。",
+	"要不下次一起去试试那家店？",
+	"嗯嗯，我理解你的顾虑，我们可以先从小范围试起。",
+]
+
+
+# ---- 本地替身模型：OpenAI 兼容接口，按 prompt 类型返回结构化 JSON，按 token 速率模拟耗时 ----
+
+class _StandinStream:
+	def __init__(self, text: str, ttft_s: float, tokens_per_s: float):
+		self._text = text
+		self._ttft_s = ttft_s
+		self._step_s = 8 / tokens_per_s if tokens_per_s > 0 else 0.0
+		self._closed = False
+
+	def __iter__(self):
+		time.sleep(self._ttft_s)
+		for i in range(0, len(self._text), 8):
+			if self._closed:
+				return
+			if self._step_s:
+				time.sleep(self._step_s)
+			delta = SimpleNamespace(content=self._text[i:i + 8], reasoning_content=None)
+			yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=None)], usage=None)
+		delta = SimpleNamespace(content=None, reasoning_content=None)
+		yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason="stop")], usage=None)
+
+	def close(self) -> None:
+		self._closed = True
+
+
+class _StandinCompletions:
+	def __init__(self, ttft_s: float, tokens_per_s: float, error_rate: float):
+		from backend.clients.prompts import CANDIDATES_SYSTEM, PEER_SYSTEM, SCENARIO_SYSTEM, MBTI_SYSTEM
+		self._kinds = {
+			CANDIDATES_SYSTEM.render(): "candidates",
+			PEER_SYSTEM.render(): "peer",
+			SCENARIO_SYSTEM.render(): "scenario",
+			MBTI_SYSTEM.render(): "mbti",
+		}
+		self._ttft_s = ttft_s
+		self._tokens_per_s = tokens_per_s
+		self._error_rate = error_rate
+
+	def _answer(self, kind: str) -> str:
+		rnd = random.Random()
+		if kind in ("candidates", "peer"):
+			picks = rnd.sample(_PHRASES, 3)
+			return json.dumps([
+				{"id": sid, "text": text, "why": "替身输出", "risk": "low" if sid != "humor" else "mid", "tone": "自然"}
+				for sid, text in zip(("mirror", "safe", "humor"), picks)
+			], ensure_ascii=False)
+		if kind == "scenario":
+			return json.dumps({
+				"scenario": rnd.choice(_SCENARIO_TEXTS),
+				"opponent": {"roleTitle": "对方", "tone": "友好", "traits": ["慢热", "爱运动"], "domain": rnd.choice(["校园", "职场", "交友"])},
+				"userGoal": {"goal": "自然地推进话题并约定下一步", "reason": "替身输出"},
+				"flow": {"startingParty": "either", "openingHints": []},
+				"anchors": ["周末", "活动"],
+			}, ensure_ascii=False)
+		return json.dumps({"mbti": "INFP", "confidence": 0.5, "functions": {"Fi": 60, "Ne": 55}}, ensure_ascii=False)
+
+	def create(self, **kwargs: Any):
+		if self._error_rate and random.random() < self._error_rate:
+			raise RuntimeError("standin upstream error")
+		system = kwargs["messages"][0]["content"] if kwargs.get("messages") else ""
+		text = self._answer(self._kinds.get(system, "candidates"))
+		if kwargs.get("stream"):
+			return _StandinStream(text, self._ttft_s, self._tokens_per_s)
+		time.sleep(self._ttft_s + (len(text) / 1.5) / self._tokens_per_s if self._tokens_per_s > 0 else self._ttft_s)
+		message = SimpleNamespace(content=text, reasoning_content=None)
+		return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=None)
+
+
+def _install_standin(ttft_ms: float, tokens_per_s: float, error_rate: float) -> None:
+	import backend.clients.llm_client as llm_client
+	completions = _StandinCompletions(ttft_ms / 1000, tokens_per_s, error_rate)
+	llm_client._client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+
+# ---- 单个会话 ----
+
+async def _session(idx: int, args: SimpleNamespace, pool: ThreadPoolExecutor, stats: Dict[str, Any]) -> None:
+	from backend.models.types import ScenarioInput, PeerReplyRequest, SuggestRequest, ConversationTurn
+	from backend.services.scenario_service import analyze_scenario
+	from backend.services.peer_service import generate_peer_reply
+	from backend.services.suggest_service import handle_suggest
+	from backend.services.scenario_template_service import template_ids
+
+	loop = asyncio.get_running_loop()
+	rnd = random.Random(idx)
+	session_id = f"sim-{args.shard}-{idx}"
+
+	async def timed(stage: str, fn, *a):
+		t0 = time.perf_counter()
+		try:
+			return await loop.run_in_executor(pool, fn, *a)
+		except Exception:
+			stats["errors"][stage] += 1
+			return None
+		finally:
+			stats["latency"][stage].append((time.perf_counter() - t0) * 1000)
+
+	templates = template_ids()
+	if templates and rnd.random() < args.template_ratio:
+		scn_req = ScenarioInput(templateId=rnd.choice(templates), mode="full")
+	else:
+		scn_req = ScenarioInput(scenarioText=rnd.choice(_SCENARIO_TEXTS), mode="full")
+	scenario = await timed("scenario", analyze_scenario, scn_req)
+
+	conv: List[ConversationTurn] = []
+	rel = None
+	for _ in range(args.turns):
+		peer = await timed("peer", generate_peer_reply, PeerReplyRequest(conversation=conv, scenario=scenario))
+		if peer is None or not peer.text:
+			break
+		conv.append(ConversationTurn(role="peer", text=peer.text))
+		resp = await timed("suggest", handle_suggest, SuggestRequest(
+			conversation=conv, entryType="peerMsg", scenario=scenario, sessionId=session_id,
+		))
+		if resp is None or not resp.candidates:
+			break
+		rel = resp.relationship.index
+		stats["suggest_by_source"][resp.candidates[0].id] += 1
+		conv.append(ConversationTurn(role="user", text=resp.candidates[0].text))
+		stats["turns"] += 1
+	if rel is not None:
+		stats["relationship"].append(rel)
+	stats["sessions"] += 1
+
+
+async def _shard_main(args: SimpleNamespace) -> Dict[str, Any]:
+	stats: Dict[str, Any] = {
+		"turns": 0, "sessions": 0,
+		"latency": defaultdict(list), "errors": Counter(),
+		"relationship": [], "suggest_by_source": Counter(),
+	}
+	sem = asyncio.Semaphore(args.concurrency)
+	pool = ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="sim")
+
+	async def one(i: int) -> None:
+		async with sem:
+			await _session(i, args, pool, stats)
+
+	await asyncio.gather(*(one(i) for i in range(args.sessions)))
+	pool.shutdown(wait=False)
+	from backend.services import metrics_service
+	counters = metrics_service.snapshot()["counters"]
+	stats["counters"] = {k: v for k, v in counters.items() if k.startswith(("suggest_", "llm_", "cascade_"))}
+	return stats
+
+
+def _run_shard(shard_args: Dict[str, Any]) -> Dict[str, Any]:
+	args = SimpleNamespace(**shard_args)
+	if args.model == "standin":
+		_install_standin(args.ttft_ms, args.tokens_per_s, args.error_rate)
+	stats = asyncio.run(_shard_main(args))
+	# 跨进程返回普通 dict
+	stats["latency"] = dict(stats["latency"])
+	stats["errors"] = dict(stats["errors"])
+	stats["suggest_by_source"] = dict(stats["suggest_by_source"])
+	return stats
+
+
+def _quantiles(values: List[float]) -> Dict[str, float]:
+	if not values:
+		return {}
+	v = sorted(values)
+	pick = lambda q: round(v[min(len(v) - 1, int(len(v) * q))], 1)
+	return {"n": len(v), "p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": round(v[-1], 1)}
+
+
+def _report(shards: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+	latency: Dict[str, List[float]] = defaultdict(list)
+	errors: Counter = Counter()
+	counters: Counter = Counter()
+	sources: Counter = Counter()
+	rel: List[int] = []
+	turns = sessions = 0
+	for st in shards:
+		turns += st["turns"]
+		sessions += st["sessions"]
+		for k, v in st["latency"].items():
+			latency[k].extend(v)
+		errors.update(st["errors"])
+		counters.update(st["counters"])
+		sources.update(st["suggest_by_source"])
+		rel.extend(st["relationship"])
+	llm_suggests = counters.get("suggest_route:llm", 0)
+	buckets = Counter(min(9, int(r) // 10) for r in rel)
+	return {
+		"sessions": sessions,
+		"turns": turns,
+		"elapsed_s": round(elapsed, 2),
+		"turns_per_s": round(turns / elapsed, 2) if elapsed else 0.0,
+		"latency_ms": {k: _quantiles(v) for k, v in latency.items()},
+		"stage_errors": dict(errors),
+		"fallback_rate": round(counters.get("suggest_fallback", 0) / llm_suggests, 4) if llm_suggests else 0.0,
+		"relationship_index": {
+			"mean": round(sum(rel) / len(rel), 2) if rel else None,
+			"histogram": {f"{b * 10}-{b * 10 + 9 if b < 9 else 100}": buckets.get(b, 0) for b in range(10)},
+		},
+		"top_candidate_ids": dict(sources.most_common(8)),
+		"counters": dict(counters),
+	}
+
+
+def main() -> None:
+	ap = argparse.ArgumentParser(description="并发自对弈会话模拟与容量压测")
+	ap.add_argument("--sessions", type=int, default=200, help="总会话数")
+	ap.add_argument("--turns", type=int, default=6, help="每个会话的对方/用户往返轮数")
+	ap.add_argument("--procs", type=int, default=2, help="进程数（会话按进程分片）")
+	ap.add_argument("--concurrency", type=int, default=64, help="每个进程内同时进行的会话数")
+	ap.add_argument("--model", choices=["standin", "upstream"], default="standin")
+	ap.add_argument("--ttft-ms", type=float, default=300.0, help="替身模型首 token 延迟")
+	ap.add_argument("--tokens-per-s", type=float, default=60.0, help="替身模型输出速率")
+	ap.add_argument("--error-rate", type=float, default=0.0, help="替身模型随机报错比例")
+	ap.add_argument("--template-ratio", type=float, default=0.5, help="使用标准模板场景的比例")
+	ap.add_argument("--out", default="", help="报告另存为 JSON 文件")
+	args = ap.parse_args()
+
+	procs = max(1, args.procs)
+	per = [args.sessions // procs + (1 if i < args.sessions % procs else 0) for i in range(procs)]
+	shard_args = [
+		dict(vars(args), sessions=n, shard=i)
+		for i, n in enumerate(per) if n
+	]
+	t0 = time.perf_counter()
+	with ProcessPoolExecutor(max_workers=len(shard_args)) as ex:
+		shards = list(ex.map(_run_shard, shard_args))
+	report = _report(shards, time.perf_counter() - t0)
+	text = json.dumps(report, ensure_ascii=False, indent=2)
+	print(text)
+	if args.out:
+		with open(args.out, "w", encoding="utf-8") as f:
+			f.write(text)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,39 @@
+from collections import deque
+import time
+
+from backend.services import admission_service, metrics_service
+
+
+def _fake_clock(monkeypatch, start: float):
+	now = [start]
+	monkeypatch.setattr(time, "monotonic", lambda: now[0])
+	return now
+
+
+def test_latency_shedding_recovers_after_window(monkeypatch):
+	monkeypatch.setattr(admission_service, "SHED_QUEUE_DEPTH", 0)
+	monkeypatch.setattr(admission_service, "SHED_LATENCY_P95_MS", 1000.0)
+	monkeypatch.setattr(admission_service, "SHED_LATENCY_WINDOW_S", 60.0)
+	monkeypatch.setitem(metrics_service._windows, "llm_latency_ms", deque(maxlen=512))
+	now = _fake_clock(monkeypatch, 1000.0)
+
+	for _ in range(30):
+		metrics_service.observe("llm_latency_ms", 5000.0)
+	assert admission_service.overloaded()
+
+	# 降级期间没有新的上游样本：窗口过期后恢复放行
+	now[0] += 61.0
+	assert not admission_service.overloaded()
+
+
+def test_memory_buckets_evict_idle_keys():
+	buckets = admission_service._MemoryBuckets()
+	for i in range(admission_service._MemoryBuckets._SWEEP_EVERY - 1):
+		buckets.take(f"idle:{i}", 5, 1.0, 0.0)
+	buckets.take("active", 5, 1.0, 7200.0)
+	assert list(buckets._buckets) == ["active"]
+
+
+def test_client_key_ignores_client_headers():
+	scope = {"client": ("203.0.113.7", 5000), "headers": [(b"x-session-id", b"rotating"), (b"x-client-id", b"x")]}
+	assert admission_service.client_key(scope) == "203.0.113.7"
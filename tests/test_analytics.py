@@ -0,0 +1,40 @@
+from backend.services.analytics_service import SessionAnalytics, affect_score
+
+
+def _turn(role: str, text: str):
+	return {"role": role, "text": text}
+
+
+def test_sync_counts_repeated_turns_as_new():
+	state = SessionAnalytics()
+	conv = [_turn("peer", "在吗"), _turn("user", "在")]
+	state.sync(conv)
+	# 新增的两轮与已处理的两轮内容相同：按已处理轮数定位，不能误判为没有新内容
+	state.sync(conv + conv)
+	assert state.turns == 4
+
+
+def test_sync_resumes_on_sliding_window():
+	state = SessionAnalytics()
+	conv = [_turn("peer" if i % 2 else "user", f"第{i}句") for i in range(12)]
+	state.sync(conv[:10])
+	state.sync(conv[4:])
+	assert state.turns == 12
+	# 已处理过的轮次被改写：对不上，按本次窗口从头重建
+	state.sync(conv[4:11] + [_turn("peer", "改写")])
+	assert state.turns == 8
+
+
+def test_question_predicate_is_shared():
+	state = SessionAnalytics()
+	state.sync([_turn("user", "周末有空"), _turn("peer", "你也喜欢爬山吗")])
+	snap = state.snapshot()
+	assert snap["last_peer_is_question"]
+	assert snap["qa"]["peer_questions"] == 1
+
+
+def test_negated_phrases_score_negative():
+	# 否定短语整体匹配，不再被其中的正向词抵消或反转
+	for text in ("我不感兴趣", "不舒服", "不开心", "我不太喜欢这个"):
+		assert affect_score(text) < 0, text
+	assert affect_score("开心") > 0
@@ -0,0 +1,27 @@
+from backend.services.local_candidate_service import _RAW_LIBRARY, local_candidates
+
+_ANCHORS = ["周末"]
+_GOAL = "合作方案"
+
+# 每种情境对应的上下文（草稿, 对话, 应对模式）
+_SITUATIONS = {
+	"draft": ("我也想去", [{"role": "peer", "text": "周末去爬山吗"}], "probe"),
+	"answer": ("", [{"role": "peer", "text": "你平时周末一般都做什么呀？"}], "answer"),
+	"probe": ("", [{"role": "peer", "text": "我周末去爬山了"}], "probe"),
+	"self": ("", [{"role": "peer", "text": "好呀"}, {"role": "user", "text": "我最近在准备考试"}], "probe"),
+	"opening": ("", [], "probe"),
+}
+
+
+def test_every_library_key_is_selected():
+	for (domain, situation), items in _RAW_LIBRARY.items():
+		draft, conv, mode = _SITUATIONS[situation]
+		out = local_candidates(conv, draft, mode, domain=None if domain == "*" else domain, anchors=_ANCHORS, goal=_GOAL)
+		expected = [it["text"].format(draft=draft, anchor=_ANCHORS[0], goal=_GOAL) for it in items]
+		assert [c["text"] for c in out] == expected, (domain, situation)
+
+
+def test_answer_mirror_fills_keyword_not_message_prefix():
+	out = local_candidates([{"role": "peer", "text": "你平时周末一般都做什么呀？"}], "", "answer", anchors=["周末"])
+	mirror = next(c["text"] for c in out if c["id"] == "mirror")
+	assert "周末" in mirror and "你平时" not in mirror
@@ -0,0 +1,16 @@
+from backend.services.session_service import open_session
+
+
+def test_reattach_requires_resume_token():
+	state = open_session(None)
+	assert open_session(state.session_id, state.resume_token) is state
+	# 只知道会话ID（或凭据不对）不能接管原会话，而是拿到一个新的服务端会话
+	for token in (None, "", "guess", state.resume_token[:-1]):
+		other = open_session(state.session_id, token)
+		assert other is not state
+		assert other.session_id != state.session_id
+
+
+def test_client_chosen_id_is_not_adopted():
+	state = open_session("my-own-id", None)
+	assert state.session_id != "my-own-id"
@@ -0,0 +1,22 @@
+from backend.services.analytics_service import SessionAnalytics
+from backend.services.suggest_service import _build_tip
+
+
+def _analysis(turns):
+	state = SessionAnalytics()
+	state.sync([{"role": r, "text": t} for r, t in turns])
+	return state.snapshot()
+
+
+def test_idle_tip_uses_topic_anchor():
+	analysis = _analysis([("peer", "我最近迷上了摄影"), ("user", "挺好的")])
+	assert "摄影" in _build_tip(analysis, "idle", "").text
+
+
+def test_draft_tip_flags_one_sided_questions():
+	analysis = _analysis([
+		("peer", "你是哪个专业的？"), ("user", "设计"),
+		("peer", "平时喜欢做什么？"), ("user", "画画"),
+		("peer", "周末有空吗？"), ("user", "有的"),
+	])
+	assert "回问" in _build_tip(analysis, "typing", "周末下午都可以出来").text
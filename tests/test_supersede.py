@@ -0,0 +1,17 @@
+import time
+
+from backend.services import supersede_service
+
+
+def test_debounce_waits_for_typing_only(monkeypatch):
+	monkeypatch.setattr(supersede_service, "SUGGEST_DEBOUNCE_MS", 200)
+	slept = []
+	monkeypatch.setattr(time, "sleep", slept.append)
+
+	ticket = supersede_service.begin("s-presend", "preSend")
+	assert supersede_service.debounce(ticket)
+	assert slept == []
+
+	ticket = supersede_service.begin("s-typing", "typing")
+	assert supersede_service.debounce(ticket)
+	assert slept == [0.2]
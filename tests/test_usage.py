@@ -0,0 +1,30 @@
+from collections import OrderedDict
+
+from backend.services import usage_service
+
+
+class _SlowStore:
+	def __init__(self):
+		self.reads = 0
+
+	def subject_total(self, day, subject):
+		# 读盘期间全局锁必须空闲，其他请求的 record / 预算检查不被阻塞
+		assert not usage_service._lock.locked()
+		self.reads += 1
+		return 500
+
+
+def test_subject_total_is_read_outside_lock(monkeypatch):
+	store = _SlowStore()
+	monkeypatch.setattr(usage_service, "_store", store)
+	monkeypatch.setattr(usage_service, "_subjects", OrderedDict())
+	monkeypatch.setattr(usage_service, "_subject_pending", {})
+	monkeypatch.setattr(usage_service, "_totals", {})
+	monkeypatch.setattr(usage_service, "_pending", {})
+	monkeypatch.setattr(usage_service, "_ensure_flusher", lambda: None)
+
+	assert usage_service.used("203.0.113.7") == 500
+	with usage_service.subject_scope("203.0.113.7"):
+		usage_service.record("generate_candidates", "m", None, [{"role": "user", "content": "你好"}], "好")
+	assert usage_service.used("203.0.113.7") > 500
+	assert store.reads == 1